@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+from decimal import Decimal
+
+import httpx
+import zeep
+from anyio import to_thread
+from zeep.transports import AsyncTransport
+
+from currency_converter.client import (
+    CURRENCY_RATE_PROVIDER,
+    CURRENCY_RATE_SHARED_TABLE_PATH,
+    RATE_BASE_CURRENCY,
+    RATE_FETCH_SCALE,
+    AsyncRateProvider,
+    ExchangeRateCache,
+    JwtTokenManager,
+    currency_converter_circuit_breaker,
+    get_wsdl_cache,
+)
+from currency_converter.metrics import observe_operation
+from exceptions.currencies import CurrencyServiceUnavailableException
+
+logger = logging.getLogger(__name__)
+
+_async_currency_converter_client_instance = None
+# Concurrent first calls wait for one client to be built instead of each building one with its own token refresh
+_async_currency_converter_client_lock = asyncio.Lock()
+
+# Factory function that creates and returns an async client instance
+async def get_async_currency_converter_client_instance():
+    global _async_currency_converter_client_instance
+    if _async_currency_converter_client_instance is None:
+        async with _async_currency_converter_client_lock:
+            if _async_currency_converter_client_instance is None:
+                try:
+                    # Fetching the token and loading the WSDL are blocking, keep them off the event loop
+                    _async_currency_converter_client_instance = await to_thread.run_sync(
+                        currency_converter_circuit_breaker.call, AsyncCurrencyConverterClient
+                    )
+                except CurrencyServiceUnavailableException:
+                    raise
+                except Exception as e:
+                    raise CurrencyServiceUnavailableException(str(e))
+    return _async_currency_converter_client_instance
+
+
+class AsyncSoapRateProvider(AsyncRateProvider):
+    """Rates from the CurrencyConverterService, fetched with the async zeep transport"""
+    def __init__(self):
+        self.token_manager = JwtTokenManager()
+        self.client = get_async_currency_converter_client(self.token_manager.token)
+        self.token_manager.attach(self.client.transport.client)
+        self.token_manager.attach(self.client.transport.wsdl_client)
+        self.token_manager.start_background_refresh()
+
+    async def fetch_rate_async(self, currency: str) -> Decimal:
+        try:
+            scaled_rate = await currency_converter_circuit_breaker.call_async(
+                self.client.service.convert, RATE_BASE_CURRENCY, currency, RATE_FETCH_SCALE
+            )
+            return Decimal(scaled_rate) / RATE_FETCH_SCALE
+        except CurrencyServiceUnavailableException:
+            raise
+        except Exception as e:
+            raise CurrencyServiceUnavailableException(str(e))
+
+    async def get_available_currencies_async(self) -> list[str]:
+        try:
+            return await currency_converter_circuit_breaker.call_async(self.client.service.getAvailableCurrencies)
+        except CurrencyServiceUnavailableException:
+            raise
+        except Exception as e:
+            raise CurrencyServiceUnavailableException(str(e))
+
+
+def create_async_rate_provider() -> AsyncRateProvider:
+    """Async counterpart of create_rate_provider, the SOAP provider uses the async transport"""
+    if CURRENCY_RATE_SHARED_TABLE_PATH:
+        from currency_converter.shared_rates import create_async_shared_rate_provider
+        return create_async_shared_rate_provider(create_async_upstream_rate_provider)
+    return create_async_upstream_rate_provider()
+
+
+def create_async_upstream_rate_provider() -> AsyncRateProvider:
+    if CURRENCY_RATE_PROVIDER == "ecb":
+        from currency_converter.ecb_provider import EcbXmlRateProvider
+        return EcbXmlRateProvider()
+    return AsyncSoapRateProvider()
+
+
+class AsyncCurrencyConverterClient:
+    """
+    Async variant of CurrencyConverterClient for the async route handlers.
+    Cached rates are served without awaiting anything, missing or expired rates
+    are fetched from the rate provider so a slow converter never blocks the event loop.
+    Expired rates are served stale (up to the cache's maximum staleness) while a single
+    background task per currency fetches the new rate (stale-while-revalidate).
+    """
+    def __init__(self, rate_provider: AsyncRateProvider | None = None):
+        self.rate_provider = rate_provider or create_async_rate_provider()
+        self.rate_cache = ExchangeRateCache()
+        self._refresh_tasks: dict[str, asyncio.Task] = {}
+
+    @observe_operation("get_available_currencies")
+    async def get_available_currencies(self) -> list:
+        return await self.rate_provider.get_available_currencies_async()
+
+    @observe_operation("convert")
+    async def convert(self, from_currency: str, to_currency: str, amount: Decimal) -> Decimal:
+        return (await self.convert_many(from_currency, to_currency, [amount]))[0]
+
+    @observe_operation("convert_many")
+    async def convert_many(self, from_currency: str, to_currency: str, amounts: list[Decimal]) -> list[Decimal]:
+        """Convert a batch of amounts with a single rate lookup, results are returned in the same order"""
+        await self._get_rate(from_currency)
+        await self._get_rate(to_currency)
+        return self.rate_cache.get_matrix().convert_many(from_currency, to_currency, amounts)
+
+    @observe_operation("get_currency_rate")
+    async def get_currency_rate(self, from_currency: str, to_currency: str) -> Decimal:
+        return await self.convert(from_currency, to_currency, Decimal(1))
+
+    @observe_operation("get_exchange_rates")
+    async def get_exchange_rates(
+        self, from_currency: str, to_currencies: list[str], refetch: bool = False
+    ) -> dict[str, Decimal]:
+        """
+        Unrounded rates from one currency to several others.
+        With refetch all rates come from the rate provider, cached and stale rates are not used.
+        """
+        get_rate = self._refetch_rate if refetch else self._get_rate
+        rates = {currency: await get_rate(currency) for currency in dict.fromkeys([from_currency, *to_currencies])}
+        return {to_currency: rates[to_currency] / rates[from_currency] for to_currency in to_currencies}
+
+    def get_rate_age(self, from_currency: str, to_currency: str) -> float | None:
+        """Seconds since the older of the two rates was fetched, None if one of them is not cached"""
+        ages = [self.rate_cache.get_age(from_currency), self.rate_cache.get_age(to_currency)]
+        if None in ages:
+            return None
+        return max(ages)
+
+    async def _get_rate(self, currency: str) -> Decimal:
+        rate = self.rate_cache.get_fresh_rate(currency)
+        if rate is not None:
+            return rate
+
+        rate = self.rate_cache.get_stale_rate(currency)
+        if rate is not None:
+            self._schedule_refresh(currency)
+            return rate
+
+        return await self._fetch_rate(currency)
+
+    async def _refetch_rate(self, currency: str) -> Decimal:
+        if currency == RATE_BASE_CURRENCY:
+            return Decimal(1)
+        return await self._fetch_rate(currency)
+
+    @observe_operation("fetch_rate")
+    async def _fetch_rate(self, currency: str) -> Decimal:
+        rate = await self.rate_provider.fetch_rate_async(currency)
+        self.rate_cache.set_rate(currency, rate)
+        return rate
+
+    def _schedule_refresh(self, currency: str):
+        task = self._refresh_tasks.get(currency)
+        if task is not None and not task.done():
+            return
+        self._refresh_tasks[currency] = asyncio.create_task(self._refresh_rate(currency))
+
+    async def _refresh_rate(self, currency: str):
+        try:
+            await self._fetch_rate(currency)
+        except Exception as e:
+            # The stale rate keeps being served until it exceeds the maximum staleness
+            logger.warning(f"Failed to refresh exchange rate for '{currency}': {e}")
+
+
+def get_async_currency_converter_client(jwt_token: str) -> zeep.AsyncClient:
+    try:
+        # Get host from environment variable or use default
+        currency_converter_host = os.environ.get('CURRENCY_CONVERTER_HOST', 'currency-converter')
+
+        # Build the WSDL URL using the proper host
+        wsdl_url = f'{currency_converter_host}/ws/currencies.wsdl'
+
+        # The WSDL is loaded with the sync client, the operations use the async client
+        transport = AsyncTransport(
+            client=httpx.AsyncClient(timeout=10),
+            wsdl_client=httpx.Client(timeout=10),
+            cache=get_wsdl_cache()
+        )
+
+        # AsyncTransport resets the client headers, so the token is added afterwards
+        transport.client.headers["Authorization"] = f"Bearer {jwt_token}"
+        transport.wsdl_client.headers["Authorization"] = f"Bearer {jwt_token}"
+
+        return zeep.AsyncClient(wsdl=wsdl_url, transport=transport)
+    except Exception as e:
+        error_message = f"Error connecting to currency converter service: {e}"
+        raise CurrencyServiceUnavailableException(error_message)
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Awaitable, Callable, TypeVar
+
+from exceptions.currencies import CurrencyServiceUnavailableException
+
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing upstream for a while instead of paying its timeouts on every request.
+    After `failure_threshold` consecutive failures the circuit opens and calls fail fast
+    with CurrencyServiceUnavailableException. Once `cooldown_seconds` have passed a single
+    trial call is let through (half-open), its result closes or reopens the circuit.
+    """
+    def __init__(self, name: str, failure_threshold: int = 5, cooldown_seconds: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._state = CircuitState.CLOSED
+        self._failure_count = 0
+        self._opened_at: float | None = None
+        self._trial_in_progress = False
+        self._last_error: str | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            return self._current_state()
+
+    def call(self, func: Callable[..., T], *args, **kwargs) -> T:
+        is_trial = self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            # Interrupted without a result, another call may try instead
+            if is_trial:
+                self.release_trial()
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, func: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        is_trial = self.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            # Cancelled, e.g. when the client disconnected, another call may try instead
+            if is_trial:
+                self.release_trial()
+            raise
+        self.record_success()
+        return result
+
+    def before_call(self) -> bool:
+        """
+        Raise CurrencyServiceUnavailableException if the call is not allowed right now.
+        Returns True if the call is the trial call of the half-open circuit.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CircuitState.CLOSED:
+                return False
+            if state == CircuitState.HALF_OPEN and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            last_error = self._last_error
+
+        raise CurrencyServiceUnavailableException(f"{self.name} circuit is open (last error: {last_error})")
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CircuitState.CLOSED:
+                logger.info(f"Circuit '{self.name}' closed")
+            self._state = CircuitState.CLOSED
+            self._failure_count = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self._failure_count += 1
+            self._last_error = str(error)
+            # A failed trial call reopens the circuit right away
+            if self._trial_in_progress or self._failure_count >= self.failure_threshold:
+                if self._state != CircuitState.OPEN:
+                    logger.warning(f"Circuit '{self.name}' opened after {self._failure_count} failures: {error}")
+                self._state = CircuitState.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_progress = False
+
+    def release_trial(self):
+        """Give up the trial call of the half-open circuit without a result"""
+        with self._lock:
+            self._trial_in_progress = False
+
+    def reset(self):
+        self.record_success()
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self._current_state().value,
+                "failure_count": self._failure_count,
+                "failure_threshold": self.failure_threshold,
+                "cooldown_seconds": self.cooldown_seconds,
+                "seconds_until_retry": self._seconds_until_retry(),
+                "last_error": self._last_error,
+            }
+
+    def _current_state(self) -> CircuitState:
+        # OPEN turns into HALF_OPEN once the cooldown has passed, must be called with the lock held
+        if self._state == CircuitState.OPEN and self._seconds_until_retry() == 0:
+            self._state = CircuitState.HALF_OPEN
+        return self._state
+
+    def _seconds_until_retry(self) -> float:
+        if self._opened_at is None:
+            return 0
+        return max(0.0, self._opened_at + self.cooldown_seconds - time.monotonic())
@@ -1,11 +1,69 @@
+import logging
 import os
+import threading
+import time
+from abc import ABC, abstractmethod
 from decimal import Decimal
+from typing import Callable
 
 import requests
 import zeep
+from anyio import to_thread
+from zeep.cache import SqliteCache
 
+from currency_converter.circuit_breaker import CircuitBreaker
+from currency_converter.metrics import (
+    CURRENCY_RATE_CACHE_LOOKUPS,
+    CURRENCY_RATE_FETCHED_AT,
+    CURRENCY_RATE_STALE_SERVED,
+    CURRENCY_TOKEN_REFRESHES,
+    observe_operation,
+)
+from currency_converter.rate_matrix import CrossRateMatrix
 from exceptions.currencies import CurrencyServiceUnavailableException
 
+# Rates are cached relative to EUR because the converter service is backed by the ECB reference rates
+RATE_BASE_CURRENCY = "EUR"
+# Where the rates come from: "soap" (CurrencyConverterService) or "ecb" (eurofxref XML read in-process)
+CURRENCY_RATE_PROVIDER = os.getenv("CURRENCY_RATE_PROVIDER", "soap").lower()
+# Memory-mapped rate table shared by all workers on the host, one of them polls the rate source (empty to disable)
+CURRENCY_RATE_SHARED_TABLE_PATH = os.getenv("CURRENCY_RATE_SHARED_TABLE_PATH", "")
+# Amount sent to the converter service when fetching a rate, gives 8 decimal places of precision
+RATE_FETCH_SCALE = 100_000_000
+
+# How long a cached rate is served before it has to be fetched again
+CURRENCY_RATE_CACHE_TTL_SECONDS = float(os.getenv("CURRENCY_RATE_CACHE_TTL_SECONDS", "3600"))
+# Expired rates are still served for this long while they are refreshed in the background (async client)
+CURRENCY_RATE_MAX_STALENESS_SECONDS = float(os.getenv("CURRENCY_RATE_MAX_STALENESS_SECONDS", "86400"))
+# How often the background thread refreshes the cached rates (should be below the TTL)
+CURRENCY_RATE_REFRESH_INTERVAL_SECONDS = float(
+    os.getenv("CURRENCY_RATE_REFRESH_INTERVAL_SECONDS", str(CURRENCY_RATE_CACHE_TTL_SECONDS * 0.75))
+)
+
+# Refresh the Auth0 token this many seconds before it expires
+CURRENCY_CONVERTER_TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("CURRENCY_CONVERTER_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+# Lifetime assumed when the token response does not contain expires_in (Auth0 default)
+DEFAULT_TOKEN_EXPIRES_IN_SECONDS = 86400
+# Wait time before retrying a failed token refresh
+TOKEN_REFRESH_RETRY_SECONDS = 30
+
+# On-disk cache of the WSDL/XSD documents, shared by restarts and all workers on the host
+CURRENCY_CONVERTER_WSDL_CACHE_PATH = os.getenv("CURRENCY_CONVERTER_WSDL_CACHE_PATH", "/tmp/currency-converter-wsdl-cache.db")
+CURRENCY_CONVERTER_WSDL_CACHE_TIMEOUT_SECONDS = int(os.getenv("CURRENCY_CONVERTER_WSDL_CACHE_TIMEOUT_SECONDS", "86400"))
+
+# Consecutive failures that open the circuit and how long it stays open before a trial call
+CURRENCY_CONVERTER_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CURRENCY_CONVERTER_CIRCUIT_FAILURE_THRESHOLD", "5"))
+CURRENCY_CONVERTER_CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("CURRENCY_CONVERTER_CIRCUIT_COOLDOWN_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+# Shared by the sync and async clients, both talk to the same converter service
+currency_converter_circuit_breaker = CircuitBreaker(
+    "currency_converter",
+    failure_threshold=CURRENCY_CONVERTER_CIRCUIT_FAILURE_THRESHOLD,
+    cooldown_seconds=CURRENCY_CONVERTER_CIRCUIT_COOLDOWN_SECONDS
+)
+
 _currency_converter_client_instance = None
 
 # Factory function that creates and returns a client instance
@@ -13,38 +71,345 @@ def get_currency_converter_client_instance():
     global _currency_converter_client_instance
     if _currency_converter_client_instance is None:
         try:
-            _currency_converter_client_instance = CurrencyConverterClient()
+            # While the circuit is open this fails fast instead of retrying the token request and WSDL download
+            _currency_converter_client_instance = currency_converter_circuit_breaker.call(CurrencyConverterClient)
+        except CurrencyServiceUnavailableException:
+            raise
         except Exception as e:
             raise CurrencyServiceUnavailableException(str(e))
     return _currency_converter_client_instance
 
-class CurrencyConverterClient:
+
+class ExchangeRateCache:
+    """
+    In-memory table of exchange rates relative to RATE_BASE_CURRENCY.
+    Each currency is fetched once with `fetch_rate` and served locally until it is older than the TTL.
+    A background thread refreshes the known currencies before they expire.
+    The cross rates of all cached currencies are kept as a CrossRateMatrix that is rebuilt when a rate changes.
+    """
+    def __init__(
+        self,
+        fetch_rate: Callable[[str], Decimal] | None = None,
+        ttl_seconds: float = CURRENCY_RATE_CACHE_TTL_SECONDS,
+        refresh_interval_seconds: float = CURRENCY_RATE_REFRESH_INTERVAL_SECONDS,
+        max_staleness_seconds: float = CURRENCY_RATE_MAX_STALENESS_SECONDS
+    ):
+        self._fetch_rate = fetch_rate
+        self.ttl_seconds = ttl_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+        self.refresh_interval_seconds = refresh_interval_seconds
+        # currency code -> (rate, monotonic time when it was fetched)
+        self._rates: dict[str, tuple[Decimal, float]] = {}
+        # Bumped whenever a rate changes, the matrix is rebuilt lazily when it is behind
+        self._version = 0
+        self._matrix: CrossRateMatrix | None = None
+        self._matrix_version = -1
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresh_thread: threading.Thread | None = None
+
+    def get_rate(self, currency: str) -> Decimal:
+        rate = self.get_fresh_rate(currency)
+        if rate is not None:
+            return rate
+
+        return self._load(currency)
+
+    def get_fresh_rate(self, currency: str) -> Decimal | None:
+        """Return the cached rate if it is still within the TTL, without fetching"""
+        if currency == RATE_BASE_CURRENCY:
+            return Decimal(1)
+
+        with self._lock:
+            entry = self._rates.get(currency)
+
+        if entry is not None:
+            rate, fetched_at = entry
+            if time.monotonic() - fetched_at < self.ttl_seconds:
+                CURRENCY_RATE_CACHE_LOOKUPS.labels("hit").inc()
+                return rate
+        CURRENCY_RATE_CACHE_LOOKUPS.labels("miss").inc()
+        return None
+
+    def get_stale_rate(self, currency: str) -> Decimal | None:
+        """Return the cached rate if it is younger than the maximum staleness, even if the TTL has passed"""
+        if currency == RATE_BASE_CURRENCY:
+            return Decimal(1)
+
+        with self._lock:
+            entry = self._rates.get(currency)
+
+        if entry is not None:
+            rate, fetched_at = entry
+            if time.monotonic() - fetched_at < self.max_staleness_seconds:
+                CURRENCY_RATE_STALE_SERVED.inc()
+                return rate
+        return None
+
+    def get_age(self, currency: str) -> float | None:
+        """Seconds since the rate was fetched, None if it is not cached"""
+        if currency == RATE_BASE_CURRENCY:
+            return 0.0
+
+        with self._lock:
+            entry = self._rates.get(currency)
+        return time.monotonic() - entry[1] if entry is not None else None
+
+    def set_rate(self, currency: str, rate: Decimal):
+        with self._lock:
+            previous = self._rates.get(currency)
+            if previous is None or previous[0] != rate:
+                self._version += 1
+            self._rates[currency] = (rate, time.monotonic())
+        CURRENCY_RATE_FETCHED_AT.labels(currency).set(time.time())
+
+    def get_matrix(self) -> CrossRateMatrix:
+        """Cross rates of all cached currencies, only rebuilt after a rate changed"""
+        with self._lock:
+            if self._matrix_version != self._version:
+                rates = {currency: rate for currency, (rate, _) in self._rates.items()}
+                rates[RATE_BASE_CURRENCY] = Decimal(1)
+                self._matrix = CrossRateMatrix(rates)
+                self._matrix_version = self._version
+            return self._matrix
+
+    def refresh(self):
+        """Fetch all known currencies again"""
+        with self._lock:
+            currencies = list(self._rates)
+
+        for currency in currencies:
+            try:
+                self._load(currency)
+            except Exception as e:
+                # Keep the old entry, it is fetched again on demand once it expires
+                logger.warning(f"Failed to refresh exchange rate for '{currency}': {e}")
+
+    def clear(self):
+        with self._lock:
+            self._rates.clear()
+            self._version += 1
+
+    def start_background_refresh(self):
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(
+            target=self._refresh_loop,
+            name="exchange-rate-refresh",
+            daemon=True
+        )
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop_event.set()
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.refresh_interval_seconds):
+            self.refresh()
+
+    @observe_operation("fetch_rate")
+    def _load(self, currency: str) -> Decimal:
+        rate = self._fetch_rate(currency)
+        self.set_rate(currency, rate)
+        return rate
+
+
+class JwtTokenManager:
+    """
+    Keeps the Auth0 token of the currency converter valid.
+    The token is refreshed in the background ahead of its expiry and the bearer header
+    of the attached sessions is swapped in place, so running requests are never interrupted.
+    """
+    def __init__(self, refresh_margin_seconds: float = CURRENCY_CONVERTER_TOKEN_REFRESH_MARGIN_SECONDS):
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresh_thread: threading.Thread | None = None
+        # requests.Session or httpx clients, anything with a mutable `headers` mapping
+        self._sessions = []
+        self._token, self._expires_at = self._fetch()
+
+    @property
+    def token(self) -> str:
+        with self._lock:
+            return self._token
+
+    @property
+    def expires_at(self) -> float:
+        """Monotonic time when the current token expires"""
+        with self._lock:
+            return self._expires_at
+
+    def attach(self, session):
+        """Keep the Authorization header of the session in sync with the current token"""
+        with self._lock:
+            self._sessions.append(session)
+            session.headers["Authorization"] = f"Bearer {self._token}"
+
+    def refresh(self):
+        try:
+            token, expires_at = self._fetch()
+        except Exception:
+            CURRENCY_TOKEN_REFRESHES.labels("failure").inc()
+            raise
+        CURRENCY_TOKEN_REFRESHES.labels("success").inc()
+        with self._lock:
+            self._token, self._expires_at = token, expires_at
+            for session in self._sessions:
+                session.headers["Authorization"] = f"Bearer {token}"
+        logger.info("Refreshed currency converter JWT token")
+
+    def start_background_refresh(self):
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(
+            target=self._refresh_loop,
+            name="currency-converter-token-refresh",
+            daemon=True
+        )
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop_event.set()
+
+    def _seconds_until_refresh(self) -> float:
+        return max(0.0, self.expires_at - self.refresh_margin_seconds - time.monotonic())
+
+    def _refresh_loop(self):
+        wait_seconds = self._seconds_until_refresh()
+        while not self._stop_event.wait(wait_seconds):
+            try:
+                self.refresh()
+                wait_seconds = self._seconds_until_refresh()
+            except CurrencyServiceUnavailableException as e:
+                # The old token stays in use until it expires, retry soon
+                logger.warning(f"Failed to refresh currency converter JWT token: {e}")
+                wait_seconds = TOKEN_REFRESH_RETRY_SECONDS
+
+    def _fetch(self) -> tuple[str, float]:
+        token, expires_in = get_jwt_token_with_expiry()
+        return token, time.monotonic() + expires_in
+
+
+class AsyncRateProvider(ABC):
+    """Source of exchange rates relative to RATE_BASE_CURRENCY for the AsyncCurrencyConverterClient"""
+    @abstractmethod
+    async def fetch_rate_async(self, currency: str) -> Decimal:
+        pass
+
+    @abstractmethod
+    async def get_available_currencies_async(self) -> list[str]:
+        pass
+
+
+class RateProvider(AsyncRateProvider):
+    """
+    Source of exchange rates relative to RATE_BASE_CURRENCY.
+    The async methods run the sync ones in a worker thread, providers with a native async transport
+    implement AsyncRateProvider instead.
+    """
+    @abstractmethod
+    def fetch_rate(self, currency: str) -> Decimal:
+        pass
+
+    @abstractmethod
+    def get_available_currencies(self) -> list[str]:
+        pass
+
+    async def fetch_rate_async(self, currency: str) -> Decimal:
+        return await to_thread.run_sync(self.fetch_rate, currency)
+
+    async def get_available_currencies_async(self) -> list[str]:
+        return await to_thread.run_sync(self.get_available_currencies)
+
+
+class SoapRateProvider(RateProvider):
+    """Rates from the remote CurrencyConverterService over SOAP"""
     def __init__(self):
-        self.jwt_token = get_jwt_token()
-        self.client = get_currency_converter_client(self.jwt_token)
-        
-    def get_available_currencies(self) -> list:
+        self.token_manager = JwtTokenManager()
+        self.client = get_currency_converter_client(self.token_manager.token)
+        self.token_manager.attach(self.client.transport.session)
+        self.token_manager.start_background_refresh()
+
+    def fetch_rate(self, currency: str) -> Decimal:
         try:
-            return self.client.service.getAvailableCurrencies()
+            scaled_rate = currency_converter_circuit_breaker.call(
+                self.client.service.convert, RATE_BASE_CURRENCY, currency, RATE_FETCH_SCALE
+            )
+            return Decimal(scaled_rate) / RATE_FETCH_SCALE
+        except CurrencyServiceUnavailableException:
+            raise
         except Exception as e:
             raise CurrencyServiceUnavailableException(str(e))
 
-    def convert(self, from_currency: str, to_currency: str, amount: Decimal) -> Decimal:
+    def get_available_currencies(self) -> list[str]:
         try:
-            price_in_cent = int(amount * 100)
-            converted_price_in_cent = self.client.service.convert(from_currency, to_currency, price_in_cent)
-            return (Decimal(converted_price_in_cent) / Decimal('100')).quantize(Decimal('0.00'))
+            return currency_converter_circuit_breaker.call(self.client.service.getAvailableCurrencies)
+        except CurrencyServiceUnavailableException:
+            raise
         except Exception as e:
             raise CurrencyServiceUnavailableException(str(e))
-    
+
+
+def create_rate_provider() -> RateProvider:
+    """Rate provider selected with CURRENCY_RATE_PROVIDER, read from the shared rate table if it is enabled"""
+    if CURRENCY_RATE_SHARED_TABLE_PATH:
+        from currency_converter.shared_rates import create_shared_rate_provider
+        return create_shared_rate_provider(create_upstream_rate_provider)
+    return create_upstream_rate_provider()
+
+
+def create_upstream_rate_provider() -> RateProvider:
+    """Provider that asks the rate source itself"""
+    if CURRENCY_RATE_PROVIDER == "ecb":
+        from currency_converter.ecb_provider import EcbXmlRateProvider
+        return EcbXmlRateProvider()
+    return SoapRateProvider()
+
+
+class CurrencyConverterClient:
+    def __init__(self, rate_provider: RateProvider | None = None):
+        self.rate_provider = rate_provider or create_rate_provider()
+        self.rate_cache = ExchangeRateCache(self.rate_provider.fetch_rate)
+        self.rate_cache.start_background_refresh()
+        
+    @observe_operation("get_available_currencies")
+    def get_available_currencies(self) -> list:
+        return self.rate_provider.get_available_currencies()
+
+    @observe_operation("convert")
+    def convert(self, from_currency: str, to_currency: str, amount: Decimal) -> Decimal:
+        return self.convert_many(from_currency, to_currency, [amount])[0]
+
+    @observe_operation("convert_many")
+    def convert_many(self, from_currency: str, to_currency: str, amounts: list[Decimal]) -> list[Decimal]:
+        """Convert a batch of amounts with a single rate lookup, results are returned in the same order"""
+        # Only fetches if one of the rates is missing or expired, the conversion itself is a matrix lookup
+        self.rate_cache.get_rate(from_currency)
+        self.rate_cache.get_rate(to_currency)
+        return self.rate_cache.get_matrix().convert_many(from_currency, to_currency, amounts)
+
+    @observe_operation("get_currency_rate")
     def get_currency_rate(self, from_currency: str, to_currency: str) -> Decimal:
-        try:
-            currency_rate_in_cent = self.client.service.convert(from_currency, to_currency, 100)
-            return (Decimal(currency_rate_in_cent) / Decimal('100')).quantize(Decimal('0.00'))
-        except Exception as e:
-            raise CurrencyServiceUnavailableException(str(e))
+        return self.convert(from_currency, to_currency, Decimal(1))
+
+    @observe_operation("get_exchange_rates")
+    def get_exchange_rates(self, from_currency: str, to_currencies: list[str]) -> dict[str, Decimal]:
+        """Unrounded rates from one currency to several others"""
+        from_rate = self.rate_cache.get_rate(from_currency)
+        return {to_currency: self.rate_cache.get_rate(to_currency) / from_rate for to_currency in to_currencies}
 
 def get_jwt_token() -> str:
+    token, _ = get_jwt_token_with_expiry()
+    return token
+
+
+def get_jwt_token_with_expiry() -> tuple[str, float]:
+    """Get a new token from Auth0, returns the token and its lifetime in seconds"""
     client_id = os.getenv("AUTH0_CURRENCY_CONVERTER_CLIENT_ID")
     client_secret = os.getenv("AUTH0_CURRENCY_CONVERTER_CLIENT_SECRET")
 
@@ -57,13 +422,15 @@ def get_jwt_token() -> str:
                 "audience": "https://dev-nrarsg0w7pf50t7d.us.auth0.com/api/v2/",
                 "grant_type": "client_credentials"
             },
-            headers={'content-type': 'application/json'}
+            headers={'content-type': 'application/json'},
+            timeout=10
         )
         
         if response.status_code != 200:
             raise CurrencyServiceUnavailableException(f"Failed to get JWT token: {response.json()}")
 
-        return response.json()['access_token']
+        token_data = response.json()
+        return token_data['access_token'], float(token_data.get('expires_in', DEFAULT_TOKEN_EXPIRES_IN_SECONDS))
     except Exception as e:
         raise CurrencyServiceUnavailableException(f"Error getting JWT token: {str(e)}")
     
@@ -82,6 +449,7 @@ def get_currency_converter_client(jwt_token: str) -> zeep.Client:
         
         transport = zeep.Transport(
             session=session,
+            cache=get_wsdl_cache(),
             timeout=10, 
             operation_timeout=10
         )
@@ -91,3 +459,15 @@ def get_currency_converter_client(jwt_token: str) -> zeep.Client:
     except Exception as e:
         error_message = f"Error connecting to currency converter service: {e}"
         raise CurrencyServiceUnavailableException(error_message)
+
+
+def get_wsdl_cache() -> SqliteCache | None:
+    """Persistent cache for the WSDL and XSD documents, so new workers and restarts skip downloading them"""
+    if not CURRENCY_CONVERTER_WSDL_CACHE_PATH:
+        return None
+    try:
+        return SqliteCache(path=CURRENCY_CONVERTER_WSDL_CACHE_PATH, timeout=CURRENCY_CONVERTER_WSDL_CACHE_TIMEOUT_SECONDS)
+    except Exception as e:
+        # The cache is only an optimization, fall back to downloading the documents
+        logger.warning(f"WSDL cache at '{CURRENCY_CONVERTER_WSDL_CACHE_PATH}' is not usable: {e}")
+        return None
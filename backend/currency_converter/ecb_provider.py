@@ -0,0 +1,81 @@
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from decimal import Decimal
+
+import requests
+
+from currency_converter.client import RATE_BASE_CURRENCY, RateProvider
+from exceptions.currencies import CurrencyServiceUnavailableException
+
+# Local file path or URL of an eurofxref-style XML document
+ECB_RATES_SOURCE = os.getenv("ECB_RATES_SOURCE", "https://www.ecb.europa.eu/stats/eurofxref/eurofxref-daily.xml")
+# The document is read again at most this often, a refresh of all currencies causes a single read
+ECB_RATES_RELOAD_INTERVAL_SECONDS = float(os.getenv("ECB_RATES_RELOAD_INTERVAL_SECONDS", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+class EcbXmlRateProvider(RateProvider):
+    """
+    In-process rate provider reading the ECB reference rates (EUR based) from a file or URL.
+    Cross rates are computed locally, so conversions need no currency converter service.
+    """
+    def __init__(self, source: str = ECB_RATES_SOURCE, reload_interval_seconds: float = ECB_RATES_RELOAD_INTERVAL_SECONDS):
+        self.source = source
+        self.reload_interval_seconds = reload_interval_seconds
+        self._rates: dict[str, Decimal] = {}
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+
+    def fetch_rate(self, currency: str) -> Decimal:
+        rates = self._get_rates()
+        if currency not in rates:
+            raise CurrencyServiceUnavailableException(f"Currency {currency} is not available")
+        return rates[currency]
+
+    def get_available_currencies(self) -> list[str]:
+        return list(self._get_rates())
+
+    def _get_rates(self) -> dict[str, Decimal]:
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_interval_seconds:
+                try:
+                    self._rates = parse_ecb_rates(self._read_source())
+                except Exception as e:
+                    if not self._rates:
+                        raise CurrencyServiceUnavailableException(f"Error reading ECB rates from '{self.source}': {e}")
+                    # Keep serving the previous document, try again after the reload interval
+                    logger.warning(f"Failed to reload ECB rates from '{self.source}': {e}")
+                self._loaded_at = time.monotonic()
+            return self._rates
+
+    def _read_source(self) -> bytes:
+        if self.source.startswith(("http://", "https://")):
+            response = requests.get(self.source, timeout=10)
+            response.raise_for_status()
+            return response.content
+
+        with open(self.source, "rb") as file:
+            return file.read()
+
+
+def parse_ecb_rates(xml: bytes) -> dict[str, Decimal]:
+    """Parse an eurofxref document, only the newest day is used if it contains several"""
+    root = ET.fromstring(xml)
+
+    dated_cubes = [element for element in root.iter() if element.get("time")]
+    cube = dated_cubes[0] if dated_cubes else root
+
+    rates = {RATE_BASE_CURRENCY: Decimal(1)}
+    for element in cube.iter():
+        currency = element.get("currency")
+        rate = element.get("rate")
+        if currency and rate:
+            rates[currency] = Decimal(rate)
+
+    if len(rates) == 1:
+        raise ValueError("Document contains no rates")
+    return rates
@@ -0,0 +1,66 @@
+import functools
+import inspect
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Registered in the default prometheus_client registry, scraped through GET /metrics
+CURRENCY_OPERATION_LATENCY = Histogram(
+    "currency_converter_operation_seconds",
+    "Latency of currency converter operations",
+    ["operation"]
+)
+CURRENCY_OPERATION_ERRORS = Counter(
+    "currency_converter_operation_errors_total",
+    "Failed currency converter operations by exception type",
+    ["operation", "exception"]
+)
+CURRENCY_TOKEN_REFRESHES = Counter(
+    "currency_converter_token_refreshes_total",
+    "Auth0 token refreshes of the currency converter client",
+    ["result"]
+)
+CURRENCY_RATE_CACHE_LOOKUPS = Counter(
+    "currency_rate_cache_lookups_total",
+    "Exchange rate cache lookups, a miss means the rate was missing or past its TTL",
+    ["result"]
+)
+CURRENCY_RATE_STALE_SERVED = Counter(
+    "currency_rate_stale_served_total",
+    "Cache misses answered with an expired rate while it is refreshed in the background"
+)
+CURRENCY_RATE_FETCHED_AT = Gauge(
+    "currency_rate_fetched_timestamp_seconds",
+    "Unix time when the cached rate of a currency was fetched, the staleness is time() minus this value",
+    ["currency"]
+)
+
+
+def observe_operation(operation: str):
+    """Record the latency of the decorated function and count its errors, works for sync and async functions"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    CURRENCY_OPERATION_ERRORS.labels(operation, type(e).__name__).inc()
+                    raise
+                finally:
+                    CURRENCY_OPERATION_LATENCY.labels(operation).observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                CURRENCY_OPERATION_ERRORS.labels(operation, type(e).__name__).inc()
+                raise
+            finally:
+                CURRENCY_OPERATION_LATENCY.labels(operation).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,49 @@
+from decimal import Decimal
+
+import numpy as np
+
+from models.currencies import Currency
+
+# Row/column of each currency in the matrix, follows the order of the Currency enum
+CURRENCY_INDEX = {currency.value: index for index, currency in enumerate(Currency)}
+
+# float64 can land just below a whole cent where the Decimal arithmetic of the converter
+# service is exact (e.g. 110 USD at 1.1 USD/EUR), nudge up before truncating
+TRUNCATION_TOLERANCE = 1e-12
+
+
+class CrossRateMatrix:
+    """
+    Dense matrix of cross rates between all Currency members, built from rates relative to a
+    common base currency. matrix[from, to] is the rate from one currency to another, so converting
+    a batch of prices is a single vectorized multiply. Currencies without a rate are NaN.
+    """
+    def __init__(self, base_rates: dict[str, Decimal]):
+        rates = np.full(len(CURRENCY_INDEX), np.nan)
+        for currency, rate in base_rates.items():
+            index = CURRENCY_INDEX.get(currency)
+            if index is not None:
+                rates[index] = float(rate)
+
+        # Same order of operations as the converter service: divide by the source rate, multiply by the target rate
+        self.matrix = rates[np.newaxis, :] / rates[:, np.newaxis]
+        self.matrix.flags.writeable = False
+
+    def rate(self, from_currency: str, to_currency: str) -> float:
+        rate = self.matrix[CURRENCY_INDEX[from_currency], CURRENCY_INDEX[to_currency]]
+        if np.isnan(rate):
+            raise KeyError(f"No rate from {from_currency} to {to_currency}")
+        return rate
+
+    def convert_many(self, from_currency: str, to_currency: str, amounts: list[Decimal]) -> list[Decimal]:
+        """Convert amounts, rounded down to cents like the converter service"""
+        if not amounts:
+            return []
+
+        rate = self.rate(from_currency, to_currency)
+        prices_in_cent = np.array([int(amount * 100) for amount in amounts], dtype=np.float64)
+        converted_in_cent = np.floor(prices_in_cent * rate * (1 + TRUNCATION_TOLERANCE)).astype(np.int64)
+        return [(Decimal(int(cents)) / Decimal('100')).quantize(Decimal('0.00')) for cents in converted_in_cent]
+
+    def convert(self, from_currency: str, to_currency: str, amount: Decimal) -> Decimal:
+        return self.convert_many(from_currency, to_currency, [amount])[0]
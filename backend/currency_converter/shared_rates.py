@@ -0,0 +1,241 @@
+import logging
+import mmap
+import os
+import threading
+import time
+from decimal import Decimal
+from typing import Callable
+
+import numpy as np
+
+from currency_converter.client import (
+    CURRENCY_RATE_CACHE_TTL_SECONDS,
+    CURRENCY_RATE_REFRESH_INTERVAL_SECONDS,
+    CURRENCY_RATE_SHARED_TABLE_PATH,
+    RATE_BASE_CURRENCY,
+    AsyncRateProvider,
+    RateProvider,
+    create_upstream_rate_provider,
+)
+from currency_converter.rate_matrix import CURRENCY_INDEX
+
+try:
+    import fcntl
+except ImportError:  # Windows, every worker keeps polling the converter itself
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Layout: header (magic, sequence, currency count, reserved) as uint64, then one float64 rate
+# and one float64 fetch time (unix seconds) per Currency ordinal. Missing rates are NaN.
+SHARED_RATES_MAGIC = 0x5241544553
+HEADER_FIELDS = 4
+CURRENCY_COUNT = len(CURRENCY_INDEX)
+SHARED_RATES_FILE_SIZE = (HEADER_FIELDS + 2 * CURRENCY_COUNT) * 8
+
+# Readers retry this often if they keep catching the writer mid-update
+MAX_READ_ATTEMPTS = 100
+
+_shared_rate_table = None
+_shared_rate_table_lock = threading.Lock()
+
+
+class SharedRateTable:
+    """
+    Exchange rates relative to RATE_BASE_CURRENCY in a memory-mapped file shared by all workers on the host.
+    A single writer (whoever holds the file lock) updates the table, readers use NumPy views on the
+    mapping without copying it. The sequence counter is odd while a write is in progress (seqlock),
+    readers retry until they saw the same even value before and after reading.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < SHARED_RATES_FILE_SIZE:
+            os.ftruncate(self._fd, SHARED_RATES_FILE_SIZE)
+        self._mmap = mmap.mmap(self._fd, SHARED_RATES_FILE_SIZE)
+        self._header = np.frombuffer(self._mmap, dtype=np.uint64, count=HEADER_FIELDS)
+        self._rates = np.frombuffer(self._mmap, dtype=np.float64, count=CURRENCY_COUNT, offset=HEADER_FIELDS * 8)
+        self._fetched_at = np.frombuffer(
+            self._mmap, dtype=np.float64, count=CURRENCY_COUNT, offset=(HEADER_FIELDS + CURRENCY_COUNT) * 8
+        )
+        self.is_writer = False
+        self._write_lock = threading.Lock()
+
+    def try_become_writer(self) -> bool:
+        """Take the exclusive file lock, only one process on the host gets it"""
+        if self.is_writer:
+            return True
+        if fcntl is None:
+            return False
+
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+
+        with self._write_lock:
+            if self._header[0] != SHARED_RATES_MAGIC or self._header[2] != CURRENCY_COUNT:
+                # New file or a different Currency layout, start empty
+                self._header[1] = 0
+                self._rates[:] = np.nan
+                self._fetched_at[:] = np.nan
+                self._header[2] = CURRENCY_COUNT
+                self._header[0] = SHARED_RATES_MAGIC
+        self.is_writer = True
+        return True
+
+    def write_rates(self, rates: dict[str, Decimal]):
+        if not self.is_writer:
+            raise RuntimeError("Only the process holding the shared rate table lock can write it")
+
+        now = time.time()
+        with self._write_lock:
+            self._header[1] += 1
+            for currency, rate in rates.items():
+                index = CURRENCY_INDEX.get(currency)
+                if index is not None:
+                    self._rates[index] = float(rate)
+                    self._fetched_at[index] = now
+            self._header[1] += 1
+
+    def get_rate(self, currency: str, max_age_seconds: float) -> Decimal | None:
+        """Rate written less than max_age_seconds ago, None if there is none"""
+        if currency == RATE_BASE_CURRENCY:
+            return Decimal(1)
+
+        index = CURRENCY_INDEX.get(currency)
+        if index is None:
+            return None
+
+        for _ in range(MAX_READ_ATTEMPTS):
+            sequence = self._header[1]
+            if sequence % 2:
+                continue
+            if self._header[0] != SHARED_RATES_MAGIC:
+                return None
+            rate = self._rates[index]
+            fetched_at = self._fetched_at[index]
+            if self._header[1] == sequence:
+                break
+        else:
+            return None
+
+        if np.isnan(rate) or time.time() - fetched_at >= max_age_seconds:
+            return None
+        return Decimal(repr(float(rate)))
+
+    def start_writer(
+        self,
+        create_provider: Callable[[], RateProvider] = create_upstream_rate_provider,
+        interval_seconds: float = CURRENCY_RATE_REFRESH_INTERVAL_SECONDS
+    ) -> bool:
+        """Refresh the table in a background thread if this process wins the writer lock"""
+        if self.is_writer or not self.try_become_writer():
+            return False
+
+        def refresh_loop():
+            provider = None
+            while True:
+                try:
+                    # Created in the writer only, the other workers never fetch a token or parse the WSDL
+                    if provider is None:
+                        provider = create_provider()
+                    self.write_rates(fetch_all_rates(provider))
+                except Exception as e:
+                    # Readers keep the old rates until they are too old
+                    logger.warning(f"Failed to refresh shared exchange rate table: {e}")
+                time.sleep(interval_seconds)
+
+        threading.Thread(target=refresh_loop, name="shared-rate-refresh", daemon=True).start()
+        logger.info(f"Refreshing shared exchange rate table '{self.path}' from this worker")
+        return True
+
+
+class _SharedRateReader:
+    """
+    Serves rates from the SharedRateTable. Rates the writer has not published (yet) are fetched
+    from the fallback provider, which is only created when it is first needed. A miss also lets
+    this worker take over the writer role if the previous writer is gone.
+    """
+    def __init__(self, table: SharedRateTable, create_fallback: Callable[[], AsyncRateProvider], max_age_seconds: float):
+        self.table = table
+        self.max_age_seconds = max_age_seconds
+        self._create_fallback = create_fallback
+        self._fallback: AsyncRateProvider | None = None
+        self._fallback_lock = threading.Lock()
+
+    def _read_table(self, currency: str) -> Decimal | None:
+        rate = self.table.get_rate(currency, self.max_age_seconds)
+        if rate is None:
+            self.table.start_writer()
+        return rate
+
+    def _get_fallback(self) -> AsyncRateProvider:
+        with self._fallback_lock:
+            if self._fallback is None:
+                self._fallback = self._create_fallback()
+            return self._fallback
+
+    async def fetch_rate_async(self, currency: str) -> Decimal:
+        # Reading the table is a few memory loads, no need for a worker thread
+        rate = self._read_table(currency)
+        if rate is not None:
+            return rate
+        return await self._get_fallback().fetch_rate_async(currency)
+
+    async def get_available_currencies_async(self) -> list[str]:
+        return await self._get_fallback().get_available_currencies_async()
+
+
+class SharedRateProvider(_SharedRateReader, RateProvider):
+    """Shared rate table for the sync client, the fallback is a RateProvider"""
+    def __init__(self, table: SharedRateTable, create_fallback: Callable[[], RateProvider], max_age_seconds: float):
+        super().__init__(table, create_fallback, max_age_seconds)
+
+    def fetch_rate(self, currency: str) -> Decimal:
+        rate = self._read_table(currency)
+        if rate is not None:
+            return rate
+        return self._get_fallback().fetch_rate(currency)
+
+    def get_available_currencies(self) -> list[str]:
+        return self._get_fallback().get_available_currencies()
+
+
+class AsyncSharedRateProvider(_SharedRateReader, AsyncRateProvider):
+    """Shared rate table for the async client, the fallback may be an async-only provider"""
+
+
+def fetch_all_rates(provider: RateProvider) -> dict[str, Decimal]:
+    """Rates of all Currency members that the provider knows"""
+    rates = {}
+    for currency in CURRENCY_INDEX:
+        if currency == RATE_BASE_CURRENCY:
+            continue
+        try:
+            rates[currency] = provider.fetch_rate(currency)
+        except Exception as e:
+            logger.warning(f"Failed to fetch exchange rate for '{currency}': {e}")
+    return rates
+
+
+def create_shared_rate_provider(create_fallback: Callable[[], RateProvider]) -> SharedRateProvider:
+    """
+    Provider on top of the process-wide shared rate table. The first call opens the table and,
+    if no other worker does it yet, starts refreshing it from the upstream rate source.
+    """
+    return SharedRateProvider(_get_shared_rate_table(), create_fallback, CURRENCY_RATE_CACHE_TTL_SECONDS)
+
+
+def create_async_shared_rate_provider(create_fallback: Callable[[], AsyncRateProvider]) -> AsyncSharedRateProvider:
+    """create_shared_rate_provider for the async client"""
+    return AsyncSharedRateProvider(_get_shared_rate_table(), create_fallback, CURRENCY_RATE_CACHE_TTL_SECONDS)
+
+
+def _get_shared_rate_table() -> SharedRateTable:
+    global _shared_rate_table
+    with _shared_rate_table_lock:
+        if _shared_rate_table is None:
+            _shared_rate_table = SharedRateTable(CURRENCY_RATE_SHARED_TABLE_PATH)
+            _shared_rate_table.start_writer()
+        return _shared_rate_table
@@ -1,8 +1,14 @@
 import os
+import threading
+import time
+from collections import OrderedDict
 from urllib.parse import quote_plus
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from prometheus_client import Gauge, Histogram
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 # Default database connection parameters
 DB_HOST = os.getenv("DB_HOST", "localhost")
@@ -10,20 +16,193 @@ DB_PORT = os.getenv("DB_PORT", "5432")
 DB_USERNAME = os.getenv("DB_USERNAME", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 DB_NAME = os.getenv("DB_NAME", "postgres")
+# Optional read replica of the database for the read-only routes, same credentials and database name
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST", "")
+DB_REPLICA_PORT = os.getenv("DB_REPLICA_PORT", DB_PORT)
+# After a user's writes their reads go to the primary this long, so they don't miss them on a lagging replica
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+
+# Connection pool of each engine, the defaults are the ones of SQLAlchemy
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "-1"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "False").lower() == "true"
+# Set on every connection, 0 disables the statement timeout
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "car-rental-backend")
+
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Connections of the database pool by state",
+    ["pool", "state"]
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the database pool",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+)
+
+
+class _CheckoutTimingMixin:
+    """Observes how long a checkout waits for a free connection or a new one"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(pool=self.logging_name).observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(_CheckoutTimingMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def register_pool_metrics(pool: QueuePool):
+    """Report the live connection counts of the pool, they are read on every scrape"""
+    name = pool.logging_name
+    DB_POOL_CONNECTIONS.labels(pool=name, state="checked_out").set_function(pool.checkedout)
+    DB_POOL_CONNECTIONS.labels(pool=name, state="idle").set_function(pool.checkedin)
+    # overflow() starts at -pool_size, it only counts connections beyond the pool size
+    DB_POOL_CONNECTIONS.labels(pool=name, state="overflow").set_function(lambda: max(pool.overflow(), 0))
+
+
+def engine_options(pool_name: str) -> dict:
+    """create_engine arguments for the configured pool and connection settings"""
+    # Understood by psycopg2 and psycopg 3, the name shows up in pg_stat_activity
+    connect_args = {"application_name": DB_APPLICATION_NAME}
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_logging_name": pool_name,
+        "connect_args": connect_args
+    }
 
 # PostgreSQL database URL
 DATABASE_URL = f"postgresql://{DB_USERNAME}:{quote_plus(DB_PASSWORD)}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Same database for the API, psycopg 3 talks to it without blocking the event loop
+ASYNC_DATABASE_URL = f"postgresql+psycopg://{DB_USERNAME}:{quote_plus(DB_PASSWORD)}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_REPLICA_DATABASE_URL = (
+    f"postgresql+psycopg://{DB_USERNAME}:{quote_plus(DB_PASSWORD)}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+    if DB_REPLICA_HOST else None
+)
 
 # Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, poolclass=TimedQueuePool, **engine_options("primary"))
+register_pool_metrics(engine.pool)
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and session factory used by the routes, the sync ones above are kept for scripts like db_seed.py
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, poolclass=TimedAsyncAdaptedQueuePool, **engine_options("primary_async")
+)
+register_pool_metrics(async_engine.pool)
+# Objects stay loaded after commit, reading them must not trigger I/O outside of an await
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# Sessions of the read-only routes, on the primary if there is no replica
+async_replica_engine = None
+AsyncReadSessionLocal = AsyncSessionLocal
+if ASYNC_REPLICA_DATABASE_URL:
+    async_replica_engine = create_async_engine(
+        ASYNC_REPLICA_DATABASE_URL, poolclass=TimedAsyncAdaptedQueuePool, **engine_options("replica_async")
+    )
+    register_pool_metrics(async_replica_engine.pool)
+    AsyncReadSessionLocal = async_sessionmaker(bind=async_replica_engine, autoflush=False, expire_on_commit=False)
+
+
+class ReadYourWritesTracker:
+    """Remembers who wrote to the primary within the last window_seconds"""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        # Oldest write first, expired entries are dropped from the front
+        self._last_writes: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            self._last_writes[key] = now
+            self._last_writes.move_to_end(key)
+            while self._last_writes:
+                oldest_key, written_at = next(iter(self._last_writes.items()))
+                if now - written_at < self.window_seconds:
+                    break
+                del self._last_writes[oldest_key]
+
+    def wrote_recently(self, key: str) -> bool:
+        with self._lock:
+            written_at = self._last_writes.get(key)
+        return written_at is not None and time.monotonic() - written_at < self.window_seconds
+
+    def clear(self):
+        with self._lock:
+            self._last_writes.clear()
+
+
+read_your_writes = ReadYourWritesTracker(DB_READ_YOUR_WRITES_SECONDS)
+
+# Key of the session's writes in read_your_writes, set with track_writes
+READ_YOUR_WRITES_KEY = "read_your_writes_key"
+
+
+def track_writes(db: AsyncSession | Session, key: str):
+    """Route the reads of key to the primary for a while once this session commits a write"""
+    db.info[READ_YOUR_WRITES_KEY] = key
+
+
+@event.listens_for(Session, "after_flush")
+def _remember_flush(session: Session, flush_context):
+    session.info["has_writes"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _remember_dml(orm_execute_state):
+    # Statements like INSERT ... ON CONFLICT don't go through a flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["has_writes"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _record_committed_writes(session: Session):
+    if session.info.pop("has_writes", False) and READ_YOUR_WRITES_KEY in session.info:
+        read_your_writes.record(session.info[READ_YOUR_WRITES_KEY])
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_writes(session: Session):
+    session.info.pop("has_writes", None)
+
+
+def read_session_factory(key: str | None) -> async_sessionmaker:
+    """Replica sessions, unless key has written to the primary within the read-your-writes window"""
+    if key is not None and read_your_writes.wrote_recently(key):
+        return AsyncSessionLocal
+    return AsyncReadSessionLocal
+
 # Function to get database session
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Function to get async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -6,6 +6,7 @@ To run this script, execute the following command in the terminal:
 > python db_seed.py
 '''
 
+import os
 from datetime import date, time, timedelta
 from decimal import Decimal
 
@@ -13,6 +14,9 @@ import dotenv
 
 dotenv.load_dotenv()
 
+from alembic import command
+from alembic.config import Config
+
 from database import SessionLocal, engine
 from models.currencies import Currency
 from models.db_models import Base, Booking, BookingStatus, Car, User, UserRole
@@ -23,6 +27,8 @@ def init_db():
     Base.metadata.drop_all(bind=engine)
     print("Existing tables dropped!")
     Base.metadata.create_all(bind=engine)
+    # The new tables match the latest migration, later ones are applied with alembic upgrade head
+    command.stamp(Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")), "head", purge=True)
     print("Database created!")
 
 # Seed the database with sample data
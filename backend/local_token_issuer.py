@@ -0,0 +1,147 @@
+'''
+Local stand-in for the Cognito token issuer, to run and load test the authentication
+without AWS. It signs RS256 tokens with Cognito-shaped claims, the backend verifies them
+with the same code path as real tokens when COGNITO_JWKS_FILE points to the generated JWKS.
+This is only for development purposes and should not be used in production environments
+
+Create a signing key and the JWKS file (once):
+> python local_token_issuer.py init
+
+Start the backend with the JWKS file:
+> COGNITO_JWKS_FILE=local_jwks.json uvicorn main:app
+
+Issue tokens, one per line (e.g. for the users created by db_seed.py):
+> python local_token_issuer.py token --sub cognito_sample_id_1 --email john.doe@example.com
+> python local_token_issuer.py token --sub cognito_sample_id_2 --email jane.smith@example.com --count 100
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import dotenv
+
+dotenv.load_dotenv()
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+DEFAULT_KEY_FILE = "local_issuer_key.pem"
+DEFAULT_JWKS_FILE = "local_jwks.json"
+
+# Offline mode, the issuer and client id must match the ones the backend verifies
+os.environ.setdefault("COGNITO_JWKS_FILE", DEFAULT_JWKS_FILE)
+
+from services.cognito_service import COGNITO_CLIENT_ID, COGNITO_ISSUER
+
+
+def generate_signing_key(key_file: str = DEFAULT_KEY_FILE, jwks_file: str = DEFAULT_JWKS_FILE) -> str:
+    """Write a new RSA private key and the JWKS with its public key, returns the key id"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(key_file, "wb") as file:
+        file.write(private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        ))
+
+    kid = uuid.uuid4().hex
+    jwk = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+    with open(jwks_file, "w") as file:
+        json.dump({"keys": [jwk]}, file, indent=2)
+    return kid
+
+
+def load_signing_key(key_file: str = DEFAULT_KEY_FILE, jwks_file: str = DEFAULT_JWKS_FILE):
+    """Private key and its key id, as written by generate_signing_key"""
+    with open(key_file, "rb") as file:
+        private_key = serialization.load_pem_private_key(file.read(), password=None)
+    with open(jwks_file) as file:
+        kid = json.load(file)["keys"][0]["kid"]
+    return private_key, kid
+
+
+def phone_number_for(sub: str) -> str:
+    """Stable phone number of the sub, users.phone_number is unique so every local user needs their own"""
+    digits = int(hashlib.sha256(sub.encode()).hexdigest(), 16) % 10**10
+    return f"+1{digits:010d}"
+
+
+def issue_token(
+    private_key,
+    kid: str,
+    sub: str,
+    email: str,
+    given_name: str = "Load",
+    family_name: str = "Test",
+    phone_number: str | None = None,
+    groups: list[str] | None = None,
+    expires_in: int = 3600
+) -> str:
+    """ID token with the claims Cognito puts into it"""
+    now = int(time.time())
+    claims = {
+        "sub": sub,
+        "iss": COGNITO_ISSUER,
+        "aud": COGNITO_CLIENT_ID,
+        "token_use": "id",
+        "auth_time": now,
+        "iat": now,
+        "exp": now + expires_in,
+        "jti": str(uuid.uuid4()),
+        "cognito:username": sub,
+        "email": email,
+        "email_verified": True,
+        "given_name": given_name,
+        "family_name": family_name,
+        "phone_number": phone_number or phone_number_for(sub),
+    }
+    if groups:
+        claims["cognito:groups"] = groups
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Cognito token issuer for development and load tests")
+    parser.add_argument("--key-file", default=DEFAULT_KEY_FILE)
+    parser.add_argument("--jwks-file", default=DEFAULT_JWKS_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("init", help="Create the signing key and the JWKS file")
+
+    token_parser = commands.add_parser("token", help="Print signed tokens, one per line")
+    token_parser.add_argument("--sub", required=True, help="Cognito ID of the user")
+    token_parser.add_argument("--email", required=True)
+    token_parser.add_argument("--given-name", default="Load")
+    token_parser.add_argument("--family-name", default="Test")
+    token_parser.add_argument("--phone-number", help="Derived from the sub by default")
+    token_parser.add_argument("--groups", nargs="*", default=[], help="Cognito groups, e.g. admin")
+    token_parser.add_argument("--expires-in", type=int, default=3600, help="Lifetime in seconds")
+    token_parser.add_argument("--count", type=int, default=1, help="Number of distinct tokens")
+
+    args = parser.parse_args()
+
+    if args.command == "init":
+        kid = generate_signing_key(args.key_file, args.jwks_file)
+        print(f"Signing key '{kid}' written to {args.key_file}, JWKS to {args.jwks_file}")
+        return
+
+    private_key, kid = load_signing_key(args.key_file, args.jwks_file)
+    for _ in range(args.count):
+        print(issue_token(
+            private_key, kid, args.sub, args.email,
+            given_name=args.given_name,
+            family_name=args.family_name,
+            phone_number=args.phone_number,
+            groups=args.groups,
+            expires_in=args.expires_in
+        ))
+
+
+if __name__ == "__main__":
+    main()
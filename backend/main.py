@@ -1,20 +1,88 @@
+import asyncio
+import logging
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 import dotenv
 
 dotenv.load_dotenv()
 
-from fastapi import FastAPI
+from anyio import to_thread
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
 
+from currency_converter.async_client import get_async_currency_converter_client_instance
+from currency_converter.client import currency_converter_circuit_breaker
+from database import async_engine, async_replica_engine
+from exceptions.currencies import CurrencyServiceUnavailableException
 from routes.v1 import auth_routes, booking_routes, car_routes, user_routes
+from services.cognito_service import jwks_key_cache
+from services.exchange_rate_service import run_exchange_rate_refresher
+
+# How late the event loop wakes up a sleeping task, blocking calls in async code show up here
+EVENT_LOOP_LAG_MONITOR_INTERVAL_SECONDS = float(os.getenv("EVENT_LOOP_LAG_MONITOR_INTERVAL_SECONDS", "0.5"))
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay of the event loop in resuming a task after its sleep ended",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+async def monitor_event_loop_lag(interval_seconds: float = EVENT_LOOP_LAG_MONITOR_INTERVAL_SECONDS):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval_seconds)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval_seconds))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the currency converter client (token, WSDL) before the worker takes traffic
+    if os.getenv("CURRENCY_CONVERTER_PRELOAD", "True").lower() == "true":
+        try:
+            await get_async_currency_converter_client_instance()
+            logging.info("Currency converter client preloaded")
+        except CurrencyServiceUnavailableException as e:
+            # Not fatal, the client is created on first use
+            logging.warning(f"Failed to preload currency converter client: {e}")
+    
+    # Fetch the Cognito signing keys before the first request has to wait for them
+    if os.getenv("COGNITO_JWKS_PRELOAD", "True").lower() == "true":
+        try:
+            await to_thread.run_sync(jwks_key_cache.refresh)
+            logging.info("Cognito signing keys preloaded")
+        except Exception as e:
+            # Not fatal, the keys are fetched on first use
+            logging.warning(f"Failed to preload Cognito signing keys: {e}")
+        jwks_key_cache.start_background_refresh()
+    
+    # Keep the exchange rate snapshot used by new bookings up to date
+    refresher_task = None
+    if os.getenv("EXCHANGE_RATE_REFRESHER_ENABLED", "True").lower() == "true":
+        refresher_task = asyncio.create_task(run_exchange_rate_refresher())
+    
+    lag_monitor_task = None
+    if EVENT_LOOP_LAG_MONITOR_INTERVAL_SECONDS > 0:
+        lag_monitor_task = asyncio.create_task(monitor_event_loop_lag())
+    
+    yield
+    
+    if refresher_task is not None:
+        refresher_task.cancel()
+    if lag_monitor_task is not None:
+        lag_monitor_task.cancel()
+    jwks_key_cache.stop_background_refresh()
+    await async_engine.dispose()
+    if async_replica_engine is not None:
+        await async_replica_engine.dispose()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Car Rental API",
     description="Backend API for Car Rental Application",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Get frontend URL from environment variable with a default fallback
@@ -34,6 +102,16 @@ app.add_middleware(
 async def health_check():
     return {"status": "healthy"}
 
+# Circuit breaker state of the currency converter, for monitoring
+@app.get("/health/currency-converter")
+async def currency_converter_health():
+    return currency_converter_circuit_breaker.get_status()
+
+# Prometheus metrics of this worker (currency converter latency, errors and cache usage, event loop lag)
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Include versioned routers for API endpoints
 app.include_router(car_routes.router, prefix="/api/v1")
 app.include_router(user_routes.router, prefix="/api/v1")
@@ -0,0 +1,54 @@
+'''
+Alembic environment of the car rental database.
+The schema is described by the models in models/db_models.py, new revisions can be generated from them:
+> alembic revision --autogenerate -m "describe the change"
+'''
+
+from logging.config import fileConfig
+
+import dotenv
+
+dotenv.load_dotenv()
+
+from alembic import context
+from sqlalchemy import create_engine
+
+from database import DATABASE_URL
+from models.db_models import Base
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Print the SQL of the migrations instead of running them (alembic upgrade head --sql)"""
+    context.configure(url=DATABASE_URL, target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # Callers like the tests can pass their own connection
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
+    engine = create_engine(DATABASE_URL)
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+    engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
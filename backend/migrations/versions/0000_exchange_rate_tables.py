@@ -0,0 +1,70 @@
+"""Exchange rate snapshots and materialized car prices
+
+Revision ID: 0000
+Revises:
+Create Date: 2026-10-17
+
+Databases created before the exchange rate snapshots only have the users, cars and bookings tables.
+Tables and columns that db_seed.py already created on newer databases are left as they are.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0000"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Created with the bookings table, only referenced here
+CURRENCY = postgresql.ENUM(name="currency", create_type=False)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+
+    if "exchange_rate_snapshots" not in tables:
+        op.create_table(
+            "exchange_rate_snapshots",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("fetched_at", sa.DateTime(timezone=True), nullable=False)
+        )
+        op.create_index("ix_exchange_rate_snapshots_id", "exchange_rate_snapshots", ["id"])
+
+    if "exchange_rates" not in tables:
+        op.create_table(
+            "exchange_rates",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("snapshot_id", sa.Integer(), sa.ForeignKey("exchange_rate_snapshots.id"), nullable=False),
+            sa.Column("currency_code", CURRENCY, nullable=False),
+            sa.Column("rate", sa.Numeric(18, 8), nullable=False),
+            sa.UniqueConstraint("snapshot_id", "currency_code")
+        )
+        op.create_index("ix_exchange_rates_id", "exchange_rates", ["id"])
+
+    if "car_prices" not in tables:
+        op.create_table(
+            "car_prices",
+            sa.Column("car_id", sa.Integer(), sa.ForeignKey("cars.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("currency_code", CURRENCY, primary_key=True),
+            sa.Column("snapshot_id", sa.Integer(), sa.ForeignKey("exchange_rate_snapshots.id"), nullable=False),
+            sa.Column("price_per_day", sa.Numeric(10, 2), nullable=False)
+        )
+        op.create_index("ix_car_prices_currency_price", "car_prices", ["currency_code", "price_per_day"])
+
+    if "exchange_rate_snapshot_id" not in {column["name"] for column in inspector.get_columns("bookings")}:
+        op.add_column("bookings", sa.Column("exchange_rate_snapshot_id", sa.Integer(), nullable=True))
+        op.create_foreign_key(
+            "bookings_exchange_rate_snapshot_id_fkey", "bookings", "exchange_rate_snapshots",
+            ["exchange_rate_snapshot_id"], ["id"]
+        )
+
+
+def downgrade():
+    op.drop_column("bookings", "exchange_rate_snapshot_id")
+    op.drop_table("car_prices")
+    op.drop_table("exchange_rates")
+    op.drop_table("exchange_rate_snapshots")
@@ -0,0 +1,44 @@
+"""Indexes for the overlap check and the booking listings
+
+Revision ID: 0001
+Revises: 0000
+Create Date: 2026-10-17
+
+Databases created before the migrations (db_seed.py) only had indexes on the primary keys
+and unique columns, so these queries scanned the whole bookings table.
+The indexes are built concurrently, bookings can still be made while they are created.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = "0000"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # does_bookings_overlap, only bookings that still block the car
+    ("ix_bookings_car_id_dates_open", ["car_id", "start_date", "end_date"], sa.text("status IN ('PLANNED', 'ACTIVE')")),
+    # /bookings/my and the car filter of the admin listing, in the default order by id
+    ("ix_bookings_user_id_id", ["user_id", "id"], None),
+    ("ix_bookings_car_id_id", ["car_id", "id"], None),
+    # Status and date range filters of the admin listing
+    ("ix_bookings_status_start_date", ["status", "start_date"], None),
+    ("ix_bookings_start_date", ["start_date"], None),
+    ("ix_bookings_end_date", ["end_date"], None),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, columns, where in INDEXES:
+            op.create_index(name, "bookings", columns, postgresql_where=where, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in INDEXES:
+            op.drop_index(name, table_name="bookings", postgresql_concurrently=True)
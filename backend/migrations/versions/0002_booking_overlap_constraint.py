@@ -0,0 +1,46 @@
+"""Exclusion constraint against overlapping bookings of a car
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+Planned and active bookings of the same car with overlapping dates are rejected by the database,
+so concurrent requests can't double-book a car. The GiST index of the constraint replaces the
+partial overlap index of 0001.
+
+Adding the constraint fails if overlapping bookings exist, they can be listed with:
+    SELECT a.id, b.id FROM bookings a JOIN bookings b ON a.car_id = b.car_id AND a.id < b.id
+    WHERE a.status IN ('PLANNED', 'ACTIVE') AND b.status IN ('PLANNED', 'ACTIVE')
+    AND a.start_date <= b.end_date AND a.end_date >= b.start_date;
+The table is locked for writes while the index of the constraint is built.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+OPEN_BOOKINGS = "status IN ('PLANNED', 'ACTIVE')"
+
+
+def upgrade():
+    # GiST support for the = on car_id
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    # op.create_exclude_constraint only takes plain columns, not the daterange expression
+    op.execute(
+        "ALTER TABLE bookings ADD CONSTRAINT ex_bookings_car_id_dates_open EXCLUDE USING gist "
+        "(car_id WITH =, daterange(start_date, end_date, '[]') WITH &&) "
+        f"WHERE ({OPEN_BOOKINGS})"
+    )
+    op.drop_index("ix_bookings_car_id_dates_open", table_name="bookings")
+
+
+def downgrade():
+    op.create_index(
+        "ix_bookings_car_id_dates_open", "bookings", ["car_id", "start_date", "end_date"], postgresql_where=sa.text(OPEN_BOOKINGS)
+    )
+    op.drop_constraint("ex_bookings_car_id_dates_open", "bookings")
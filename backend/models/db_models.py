@@ -6,7 +6,8 @@ They are used to interact with the database and perform CRUD operations.
 
 import enum
 
-from sqlalchemy import Boolean, Column, Date, Enum, Float, ForeignKey, Integer, Numeric, String, Time
+from sqlalchemy import DDL, Boolean, Column, Date, DateTime, Enum, Float, ForeignKey, Index, Integer, Numeric, String, Time, UniqueConstraint, event, text
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
 from sqlalchemy.orm import declarative_base, relationship
 
 from models.currencies import Currency
@@ -58,8 +59,29 @@ class Car(Base):
     def __repr__(self):
         return f"<Car(id={self.id}, name={self.name}, model={self.model})>"
 
+# Planned and active bookings of a car can't overlap, the database rejects them with this constraint
+BOOKING_OVERLAP_CONSTRAINT = "ex_bookings_car_id_dates_open"
+
 class Booking(Base):
     __tablename__ = "bookings"
+    # Changes to the indexes and constraints need a migration in migrations/versions
+    __table_args__ = (
+        # Inclusive date ranges like does_bookings_overlap, its GiST index also serves the overlap checks
+        ExcludeConstraint(
+            ("car_id", "="),
+            (text("daterange(start_date, end_date, '[]')"), "&&"),
+            name=BOOKING_OVERLAP_CONSTRAINT,
+            using="gist",
+            where=text("status IN ('PLANNED', 'ACTIVE')")
+        ),
+        # Bookings of a user and of a car, in the default order of the listings
+        Index("ix_bookings_user_id_id", "user_id", "id"),
+        Index("ix_bookings_car_id_id", "car_id", "id"),
+        # Admin listings filtered by status and date ranges
+        Index("ix_bookings_status_start_date", "status", "start_date"),
+        Index("ix_bookings_start_date", "start_date"),
+        Index("ix_bookings_end_date", "end_date"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -73,11 +95,58 @@ class Booking(Base):
     total_cost = Column(Numeric(10, 2)) # total cost in USD
     currency_code = Column(Enum(Currency), nullable=False)
     exchange_rate = Column(Numeric(10, 2), nullable=False)
+    # Snapshot the exchange rate was taken from, NULL if it came from the currency converter directly
+    exchange_rate_snapshot_id = Column(Integer, ForeignKey("exchange_rate_snapshots.id"), nullable=True)
     status = Column(Enum(BookingStatus))
     
     # Relationships
     user = relationship("User", back_populates="bookings")
     car = relationship("Car", back_populates="bookings")
+    exchange_rate_snapshot = relationship("ExchangeRateSnapshot")
+    
+    def __repr__(self):
+        return f"<Booking(id={self.id}, user_id={self.user_id}, car_id={self.car_id})>"
+
+# The exclusion constraint compares car_id with a GiST index, which needs the btree_gist extension
+event.listen(Booking.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+
+class ExchangeRateSnapshot(Base):
+    __tablename__ = "exchange_rate_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    # Last time the rates of this snapshot were confirmed by the currency converter (UTC)
+    fetched_at = Column(DateTime(timezone=True), nullable=False)
+    
+    # Relationship to rates
+    rates = relationship("ExchangeRate", back_populates="snapshot")
+    
+    def __repr__(self):
+        return f"<ExchangeRateSnapshot(id={self.id}, fetched_at={self.fetched_at})>"
+
+class ExchangeRate(Base):
+    __tablename__ = "exchange_rates"
+    __table_args__ = (UniqueConstraint("snapshot_id", "currency_code"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    snapshot_id = Column(Integer, ForeignKey("exchange_rate_snapshots.id"), nullable=False)
+    currency_code = Column(Enum(Currency), nullable=False)
+    rate = Column(Numeric(18, 8), nullable=False) # units of currency_code per 1 USD
+    
+    # Relationships
+    snapshot = relationship("ExchangeRateSnapshot", back_populates="rates")
+    
+    def __repr__(self):
+        return f"<ExchangeRate(snapshot_id={self.snapshot_id}, currency_code={self.currency_code}, rate={self.rate})>"
+
+# Price of every car in every currency, rebuilt from the latest exchange rate snapshot
+class CarPrice(Base):
+    __tablename__ = "car_prices"
+    __table_args__ = (Index("ix_car_prices_currency_price", "currency_code", "price_per_day"),)
+    
+    car_id = Column(Integer, ForeignKey("cars.id", ondelete="CASCADE"), primary_key=True)
+    currency_code = Column(Enum(Currency), primary_key=True)
+    snapshot_id = Column(Integer, ForeignKey("exchange_rate_snapshots.id"), nullable=False)
+    price_per_day = Column(Numeric(10, 2), nullable=False) # price in currency_code, rounded down to cents
     
     def __repr__(self):
-        return f"<Booking(id={self.id}, user_id={self.user_id}, car_id={self.car_id})>"
\ No newline at end of file
+        return f"<CarPrice(car_id={self.car_id}, currency_code={self.currency_code}, price_per_day={self.price_per_day})>"
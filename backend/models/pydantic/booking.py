@@ -28,6 +28,7 @@ class Booking(BaseModel):
     total_cost: Decimal = Field(description="Total cost of the booking", gt=0)
     currency_code: Currency = Field(description="Currency code of the booking")
     exchange_rate: Decimal = Field(description="Exchange rate of the booking")
+    exchange_rate_snapshot_id: int | None = Field(None, description="ID of the exchange rate snapshot the rate was taken from")
     status: BookingStatus = Field(description="Current status of the booking")
     
     # Optional nested objects for full data retrieval using Union Syntax (|)
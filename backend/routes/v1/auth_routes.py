@@ -1,13 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 
-from database import get_db
+from database import get_async_db, track_writes
 from models.db_models import User
 from models.pydantic.user import UserRegister
-from services.auth_service import get_current_user
-from services.cognito_service import verify_cognito_jwt
+from services.auth_service import get_current_user, upsert_user, user_identity_cache, verify_token
 from exceptions.auth import UnauthorizedException, ForbiddenException
 
 router = APIRouter(
@@ -21,7 +20,7 @@ security = HTTPBearer()
 async def register_cognito_user(
     user_data: UserRegister, 
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Create a user record after successful Cognito registration.
@@ -30,7 +29,7 @@ async def register_cognito_user(
     # Verify the token first
     try:
         token = credentials.credentials
-        payload = verify_cognito_jwt(token)
+        payload = await verify_token(token)
         token_cognito_id = payload.get("sub")
         
         # Verify token cognito_id matches the one in registration data
@@ -47,30 +46,23 @@ async def register_cognito_user(
             detail=f"Invalid token: {str(e)}"
         )
     
-    # Check if user already exists
-    existing_user = db.query(User).filter(User.cognito_id == user_data.cognito_id).first()
-    if existing_user:
-        # Update existing user instead of error
-        existing_user.first_name = user_data.first_name
-        existing_user.last_name = user_data.last_name
-        existing_user.phone_number = user_data.phone_number
-        db.commit()
-        db.refresh(existing_user)
-        return {"id": existing_user.id, "message": "User profile updated successfully"}
-    
-    # Create new user
-    db_user = User(
-        first_name=user_data.first_name,
-        last_name=user_data.last_name,
-        email=user_data.email,
-        phone_number=user_data.phone_number,
-        cognito_id=user_data.cognito_id,
+    # Create the user or update the profile of an existing one in a single statement
+    track_writes(db, user_data.cognito_id)
+    user, created = await upsert_user(
+        db,
+        {
+            "first_name": user_data.first_name,
+            "last_name": user_data.last_name,
+            "email": user_data.email,
+            "phone_number": user_data.phone_number,
+            "cognito_id": user_data.cognito_id,
+        },
+        update_columns=("first_name", "last_name", "phone_number")
     )
-    
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return {"id": db_user.id, "message": "User registered successfully"}
+    user_identity_cache.invalidate(user.cognito_id)
+    if created:
+        return {"id": user.id, "message": "User registered successfully"}
+    return {"id": user.id, "message": "User profile updated successfully"}
 
 # Public endpoint that doesn't require authentication - for testing
 @router.get("/public")
@@ -96,5 +88,5 @@ if os.getenv("DEVELOPMENT_MODE", "False").lower() == "true":
     ):
         """Debug endpoint to check token information"""
         token = credentials.credentials
-        payload = verify_cognito_jwt(token)
+        payload = await verify_token(token)
         return {"token_info": payload}
\ No newline at end of file
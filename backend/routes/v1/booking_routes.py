@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Body, Depends, HTTPException, Query, status as api_status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
+from database import get_async_db
 from exceptions.bookings import *
 from exceptions.currencies import CurrencyServiceUnavailableException
 from models.db_models import Booking as BookingDB
@@ -9,7 +9,7 @@ from models.db_models import User, UserRole
 from models.pydantic.booking import Booking, BookingCreate, BookingUpdate
 from models.pydantic.pagination import PaginationParams, BookingFilterParams, SortParams, PaginatedResponse
 from services import booking_service
-from services.auth_service import get_current_user, require_role
+from services.auth_service import get_async_read_db, get_current_user, require_role
 from services.booking_service import get_booking_with_permission_check
 
 router = APIRouter(
@@ -30,7 +30,7 @@ async def get_bookings(
     end_date_to: str | None = Query(None, description="Filter bookings with end date to"),
     sort_by: str = Query("id", description="Field to sort by"),
     sort_order: str = Query("asc", description="Sort order (asc or desc)"),
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_async_read_db), 
     _=Depends(require_role([UserRole.ADMIN]))
 ):
     """
@@ -49,7 +49,7 @@ async def get_bookings(
     sort_params = SortParams(sort_by=sort_by, sort_order=sort_order)
     
     try:
-        return booking_service.get_filtered_bookings(db, pagination, filters, sort_params=sort_params)
+        return await booking_service.get_filtered_bookings(db, pagination, filters, sort_params=sort_params)
     except InvalidDateFormatException as e:
         raise HTTPException(
             status_code=api_status.HTTP_400_BAD_REQUEST, 
@@ -69,7 +69,7 @@ async def get_my_bookings(
     end_date_to: str | None = Query(None, description="Filter bookings with end date to"),
     sort_by: str = Query("id", description="Field to sort by"),
     sort_order: str = Query("asc", description="Sort order (asc or desc)"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -87,7 +87,7 @@ async def get_my_bookings(
     sort_params = SortParams(sort_by=sort_by, sort_order=sort_order)
     
     try:
-        return booking_service.get_filtered_bookings(
+        return await booking_service.get_filtered_bookings(
             db, pagination, filters, user_id=current_user.id, sort_params=sort_params
         )
     except InvalidDateFormatException as e:
@@ -106,12 +106,12 @@ async def get_booking(
 @router.post("/", response_model=Booking, status_code=api_status.HTTP_201_CREATED)
 async def create_booking(
     booking_data: BookingCreate, 
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_async_db), 
     current_user: User = Depends(get_current_user)
 ):
     
     try:
-        return booking_service.create_booking(booking_data, current_user.id, db)
+        return await booking_service.create_booking(booking_data, current_user.id, db)
     except NoCarFoundException as e:
         raise HTTPException(
             status_code=api_status.HTTP_404_NOT_FOUND,
@@ -135,12 +135,12 @@ async def create_booking(
 async def update_booking(
     booking: BookingDB = Depends(get_booking_with_permission_check),
     booking_update: BookingUpdate = Body(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update a booking. Users can only update their own bookings unless they are admins."""
     try:
         # Pass the booking ID from the retrieved booking object
-        return booking_service.update_booking(booking.id, booking_update, db)
+        return await booking_service.update_booking(booking.id, booking_update, db)
     except (
         BookingStateException,
         DateRangeException, 
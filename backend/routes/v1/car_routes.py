@@ -1,29 +1,41 @@
+from decimal import Decimal
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
 from exceptions.cars import CarNotFoundException
 from exceptions.currencies import CurrencyServiceUnavailableException, InvalidCurrencyException
 from models.currencies import Currency
 from models.pydantic.car import Car
 from models.pydantic.pagination import PaginationParams, SortParams, PaginatedResponse
 from services import car_service
-from services.auth_service import get_current_user
+from services.auth_service import get_async_read_db, get_current_user
 
 router = APIRouter(
     prefix="/cars",
     tags=["cars"]
 )
 
+EXCHANGE_RATE_AGE_HEADER = "X-Exchange-Rate-Age"
+
+
+async def set_exchange_rate_age_header(response: Response, db: AsyncSession, currency_code: str):
+    # Rates can be served stale while the currency converter is slow or down, report how old they are
+    age = await car_service.get_exchange_rate_age(db, currency_code)
+    if age is not None:
+        response.headers[EXCHANGE_RATE_AGE_HEADER] = str(int(age))
+
 # Get all cars endpoint with pagination, filtering and sorting
 @router.get("/", response_model=PaginatedResponse[Car])
 async def get_cars(
+    response: Response,
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(10, ge=1, le=100, description="Number of items per page"),
     name: str | None = Query(None, description="Filter by car name or model"),
     available_only: bool = Query(False, description="Show only available cars"),
+    min_price: Decimal | None = Query(None, ge=0, description="Minimum price per day in the requested currency"),
+    max_price: Decimal | None = Query(None, ge=0, description="Maximum price per day in the requested currency"),
     sort_by: str = Query("id", description="Field to sort by"),
     sort_order: str = Query("asc", description="Sort order (asc or desc)"),
     currency_code: Annotated[
@@ -33,7 +45,7 @@ async def get_cars(
             enum=[currency.value for currency in Currency]
         )
     ] = Currency.USD.value,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     _=Depends(get_current_user)  # Require authentication
 ):
     """
@@ -43,10 +55,13 @@ async def get_cars(
         pagination = PaginationParams(page=page, page_size=page_size)
         sort_params = SortParams(sort_by=sort_by, sort_order=sort_order)
         
-        return car_service.get_filtered_cars(
+        cars = await car_service.get_filtered_cars(
             db, pagination, name_filter=name, available_only=available_only, 
-            currency_code=currency_code, sort_params=sort_params
+            currency_code=currency_code, sort_params=sort_params,
+            min_price=min_price, max_price=max_price
         )
+        await set_exchange_rate_age_header(response, db, currency_code)
+        return cars
     except InvalidCurrencyException as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -62,6 +77,7 @@ async def get_cars(
 @router.get("/{car_id}", response_model=Car)
 async def get_car(
     car_id: int, 
+    response: Response,
     currency_code: Annotated[
         str, 
         Query(
@@ -69,11 +85,13 @@ async def get_car(
             enum=[currency.value for currency in Currency]
         )
     ] = Currency.USD.value,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     _=Depends(get_current_user)  # Require authentication
 ):
     try:
-        return car_service.get_car_by_id(car_id, db, currency_code)
+        car = await car_service.get_car_by_id(car_id, db, currency_code)
+        await set_exchange_rate_age_header(response, db, currency_code)
+        return car
     except CarNotFoundException as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1,10 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
 from models.db_models import User as UserModel, UserRole
 from models.pydantic.user import User
-from services.auth_service import get_current_user, require_role
+from services.auth_service import get_async_read_db, get_current_user, require_role
 
 router = APIRouter(
     prefix="/users",
@@ -14,17 +14,17 @@ router = APIRouter(
 # Get all users endpoint - restricted to admin role
 @router.get("/", response_model=list[User])
 async def get_users(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     _=Depends(require_role([UserRole.ADMIN]))  # Only admins can list all users
 ):
-    users = db.query(UserModel).all()
+    users = (await db.scalars(select(UserModel))).all()
     return users
 
 # Get user by ID endpoint - users can only access their own data
 @router.get("/{user_id}", response_model=User)
 async def get_user(
     user_id: int, 
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_async_read_db), 
     current_user: UserModel = Depends(get_current_user)
 ):
     # If user is trying to access someone else's data and is not an admin,
@@ -35,7 +35,7 @@ async def get_user(
             detail="You can only access your own user data"
         )
     
-    user = db.query(UserModel).filter(UserModel.id == user_id).first()
+    user = await db.get(UserModel, user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1,23 +1,250 @@
 import logging
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
 
+from anyio import to_thread
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jwt import PyJWTError
+from prometheus_client import Counter
+from sqlalchemy import event, literal_column, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from database import get_db
-from exceptions.auth import IncompleteUserDataException, InvalidTokenException, MissingUserIdentifierException, UserNotRegisteredException
-from models.db_models import User
-from services.cognito_service import verify_cognito_jwt
+from database import AsyncSessionLocal, async_replica_engine, get_async_db, read_session_factory, track_writes
+from exceptions.auth import ConfigurationError, IncompleteUserDataException, InvalidTokenException, MissingUserIdentifierException, UserNotRegisteredException
+from models.db_models import User, UserRole
+from services.cognito_service import jwt_verify_limiter, verified_token_cache, verify_cognito_jwt
+
+try:
+    import fcntl
+except ImportError:  # Windows, generation bumps are not serialized between workers
+    fcntl = None
 
 # Security scheme for JWT Bearer tokens
 security = HTTPBearer()
+# Same without requiring the header, for dependencies that only use the token if there is one
+optional_security = HTTPBearer(auto_error=False)
 
 logger = logging.getLogger(__name__)
 
+# Authenticated users are looked up by cognito_id at most once per TTL
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+# File shared by the workers on the host, an invalidation in one worker clears the caches of all of them
+USER_CACHE_SHARED_GENERATION_PATH = os.getenv("USER_CACHE_SHARED_GENERATION_PATH", "")
+
+
+def parse_group_roles(mapping: str) -> dict[str, UserRole]:
+    """Parse 'group:ROLE,group:ROLE' into a dict from Cognito group to UserRole"""
+    group_roles = {}
+    for entry in filter(None, (entry.strip() for entry in mapping.split(","))):
+        group, _, role = entry.partition(":")
+        try:
+            group_roles[group.strip()] = UserRole[role.strip().upper()]
+        except KeyError:
+            raise ConfigurationError(f"Invalid role in COGNITO_GROUP_ROLES: '{entry}'")
+    return group_roles
+
+# Cognito groups granting a role, e.g. "admin:ADMIN". When set, the roles come from the cognito:groups
+# claim of the token and require_role doesn't load the user. Empty keeps the roles stored in the database.
+COGNITO_GROUP_ROLES = parse_group_roles(os.getenv("COGNITO_GROUP_ROLES", ""))
+# A token in several mapped groups gets the first of these roles
+ROLES_BY_PRIVILEGE = [UserRole.ADMIN, UserRole.USER]
+
+USER_CACHE_LOOKUPS = Counter(
+    "user_identity_cache_lookups_total",
+    "Lookups of authenticated users by cognito_id, a miss means the user was loaded from the database",
+    ["result"]
+)
+
+# Columns kept per cached user, enough to rebuild the User for the routes and role checks
+USER_CACHE_COLUMNS = [column.key for column in User.__table__.columns]
+
+
+class SharedCacheGeneration:
+    """
+    Invalidation counter in a memory-mapped file. Workers compare it with the value they last saw
+    and drop their cache when it changed, so reading it costs a single memory load per lookup.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < 8:
+            os.ftruncate(self._fd, 8)
+        self._mmap = mmap.mmap(self._fd, 8)
+        self._counter = memoryview(self._mmap).cast("Q")
+
+    def get(self) -> int:
+        return self._counter[0]
+
+    def bump(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            self._counter[0] = (self._counter[0] + 1) % 2**64
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class UserIdentityCache:
+    """
+    TTL-bounded LRU from cognito_id to the column values of the user. Hits are returned as
+    new transient User objects, they are not attached to the request's session.
+    """
+    def __init__(
+        self,
+        ttl_seconds: float = USER_CACHE_TTL_SECONDS,
+        max_size: int = USER_CACHE_MAX_SIZE,
+        shared_generation: SharedCacheGeneration | None = None
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.shared_generation = shared_generation
+        self._entries: OrderedDict[str, tuple[float, tuple]] = OrderedDict()
+        self._seen_generation = self._get_generation()
+        self._lock = threading.Lock()
+
+    def get(self, cognito_id: str) -> User | None:
+        with self._lock:
+            self._sync_generation()
+            entry = self._entries.get(cognito_id)
+            if entry is not None and time.monotonic() - entry[0] >= self.ttl_seconds:
+                del self._entries[cognito_id]
+                entry = None
+            if entry is None:
+                USER_CACHE_LOOKUPS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(cognito_id)
+        USER_CACHE_LOOKUPS.labels("hit").inc()
+        return User(**dict(zip(USER_CACHE_COLUMNS, entry[1])))
+
+    def get_generation(self) -> int:
+        """Generation to pass to set(), read it before loading the user"""
+        with self._lock:
+            self._sync_generation()
+            return self._seen_generation
+
+    def set(self, user: User, generation: int):
+        if self.max_size <= 0:
+            return
+
+        values = tuple(getattr(user, column) for column in USER_CACHE_COLUMNS)
+        with self._lock:
+            self._sync_generation()
+            if generation != self._seen_generation:
+                # Invalidated while the user was loaded, the values may be outdated
+                return
+            self._entries[user.cognito_id] = (time.monotonic(), values)
+            self._entries.move_to_end(user.cognito_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, cognito_id: str):
+        with self._lock:
+            self._entries.pop(cognito_id, None)
+            self._seen_generation += 1
+        if self.shared_generation is not None:
+            self.shared_generation.bump()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get_generation(self) -> int:
+        return self.shared_generation.get() if self.shared_generation is not None else 0
+
+    def _sync_generation(self):
+        # Must be called with the lock held
+        if self.shared_generation is None:
+            return
+        generation = self.shared_generation.get()
+        if generation != self._seen_generation:
+            self._entries.clear()
+            self._seen_generation = generation
+
+
+user_identity_cache = UserIdentityCache(
+    shared_generation=(
+        SharedCacheGeneration(USER_CACHE_SHARED_GENERATION_PATH) if USER_CACHE_SHARED_GENERATION_PATH else None
+    )
+)
+
+
+# Changed users (e.g. a new role) are dropped from the cache once the change is committed,
+# so no worker can load and cache the old row in between
+@event.listens_for(User, "after_update")
+def _remember_updated_user(mapper, connection, target: User):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("updated_cognito_ids", set()).add(target.cognito_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_updated_users(session: Session):
+    for cognito_id in session.info.pop("updated_cognito_ids", ()):
+        user_identity_cache.invalidate(cognito_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_updated_users(session: Session):
+    session.info.pop("updated_cognito_ids", None)
+
+async def upsert_user(db: AsyncSession, values: dict, update_columns: tuple[str, ...] = ()) -> tuple[User, bool]:
+    """
+    Insert the user or return the existing one with the same cognito_id in a single statement,
+    so concurrent requests of a new user cannot fail on the unique constraint.
+    update_columns are overwritten on an existing user.
+    Returns the detached user and whether it was created.
+    """
+    stmt = insert(User).values(**values)
+    # Updating cognito_id to itself changes nothing but makes RETURNING include the existing row
+    set_ = {column: stmt.excluded[column] for column in update_columns} or {"cognito_id": stmt.excluded.cognito_id}
+    stmt = stmt.on_conflict_do_update(index_elements=[User.cognito_id], set_=set_).returning(
+        User,
+        # xmax is only set on rows that were updated
+        literal_column("xmax = 0").label("created")
+    )
+    user, created = (await db.execute(stmt, execution_options={"populate_existing": True})).one()
+    # Detached like the cached users, reading it afterwards must not reload the row
+    db.expunge(user)
+    await db.commit()
+    return user, created
+
+def resolve_token_role(payload: dict) -> UserRole:
+    """Most privileged role granted by the token's Cognito groups, tokens without a mapped group are regular users"""
+    roles = {COGNITO_GROUP_ROLES[group] for group in payload.get("cognito:groups") or [] if group in COGNITO_GROUP_ROLES}
+    return next((role for role in ROLES_BY_PRIVILEGE if role in roles), UserRole.USER)
+
+async def verify_token(token: str) -> dict:
+    """
+    verify_cognito_jwt without blocking the event loop. Cached tokens are returned right away,
+    the others are verified in the bounded thread pool since key fetches and RS256 checks block.
+    """
+    payload = verified_token_cache.get(token, count_miss=False)
+    if payload is not None:
+        return payload
+    return await to_thread.run_sync(verify_cognito_jwt, token, limiter=jwt_verify_limiter)
+
+async def get_token_role(credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserRole:
+    """Role of the authenticated user from the token alone, without loading the user record"""
+    try:
+        payload = await verify_token(credentials.credentials)
+    except (PyJWTError, InvalidTokenException):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token"
+        )
+    return resolve_token_role(payload)
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get the current authenticated user based on the JWT token.
@@ -26,15 +253,23 @@ async def get_current_user(
     """
     try:
         token = credentials.credentials
-        payload = verify_cognito_jwt(token)
+        payload = await verify_token(token)
         
         # Get user info from payload
         cognito_id = payload.get("sub")
         if not cognito_id:
             raise MissingUserIdentifierException()
         
-        # Find user by Cognito ID
-        user = db.query(User).filter(User.cognito_id == cognito_id).first()
+        # The user's writes in this request send their next reads to the primary
+        track_writes(db, cognito_id)
+        
+        # Find user by Cognito ID, the cache spares the database round trip on most requests
+        user = user_identity_cache.get(cognito_id)
+        if user is not None:
+            return user
+        
+        generation = user_identity_cache.get_generation()
+        user = await db.scalar(select(User).where(User.cognito_id == cognito_id))
         if not user:
             # Extract email from payload
             email = payload.get("email")
@@ -58,18 +293,17 @@ async def get_current_user(
             if not phone or len(phone) < 8:
                 raise IncompleteUserDataException("phone_number")
             
-            # Create new user entry with validated data
-            user = User(
-                email=email,
-                first_name=given_name,
-                last_name=family_name,
-                phone_number=phone,
-                cognito_id=cognito_id
-            )
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-            
+            # Create new user entry with validated data, concurrent first requests get the same row
+            user, _ = await upsert_user(db, {
+                "email": email,
+                "first_name": given_name,
+                "last_name": family_name,
+                "phone_number": phone,
+                "cognito_id": cognito_id,
+                "role": resolve_token_role(payload)
+            })
+        
+        user_identity_cache.set(user, generation)
         return user
     except HTTPException:
         raise
@@ -96,22 +330,54 @@ async def get_current_user(
         )
 
 # Role-based access control
+async def get_async_read_db(
+    credentials: HTTPAuthorizationCredentials | None = Depends(optional_security),
+    primary_db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Session for read-only routes, on the read replica if there is one.
+    Users who wrote within the read-your-writes window read from the primary to see their changes.
+    """
+    cognito_id = None
+    if credentials is not None and async_replica_engine is not None:
+        try:
+            cognito_id = (await verify_token(credentials.credentials)).get("sub")
+        except (PyJWTError, InvalidTokenException):
+            # Rejected by the route's authentication
+            pass
+    sessions = read_session_factory(cognito_id)
+    # Reads on the primary share the request's session with get_current_user, one pool connection per request
+    if sessions is AsyncSessionLocal:
+        yield primary_db
+        return
+    async with sessions() as db:
+        yield db
+
+def check_role(role: UserRole, allowed_roles):
+    # If no roles provided, any authenticated user is allowed
+    if not allowed_roles:
+        return True
+    
+    # Check if user has one of the allowed roles
+    if role in allowed_roles:
+        return True
+    
+    # Convert each enum to its string value for a clearer error message
+    role_names = [r.value for r in allowed_roles]
+    
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail=f"Access denied. Required role: {', '.join(role_names)}"
+    )
+
 def require_role(allowed_roles):
     """Check if user has one of the required roles"""
+    if COGNITO_GROUP_ROLES:
+        # The token carries the role, routes that don't use the user record skip the database
+        async def token_role_checker(role: UserRole = Depends(get_token_role)):
+            return check_role(role, allowed_roles)
+        return token_role_checker
+    
     async def role_checker(user: User = Depends(get_current_user)):
-        # If no roles provided, any authenticated user is allowed
-        if not allowed_roles:
-            return True
-        
-        # Check if user has one of the allowed roles
-        if user.role in allowed_roles:
-            return True
-        
-        # Convert each enum to its string value for a clearer error message
-        role_names = [r.value for r in allowed_roles]
-        
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"Access denied. Required role: {', '.join(role_names)}"
-        )
+        return check_role(user.role, allowed_roles)
     return role_checker
@@ -1,15 +1,18 @@
 from datetime import date
-from decimal import Decimal
+from decimal import ROUND_DOWN, Decimal
 import logging
 
 from fastapi import Depends, HTTPException, status
-from sqlalchemy import and_, or_, desc, func
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, desc, func, literal_column, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 import exceptions.bookings as booking_exceptions
-from currency_converter.client import get_currency_converter_client_instance
-from database import get_db
+from currency_converter.async_client import get_async_currency_converter_client_instance
+from database import get_async_db
 from exceptions.currencies import CurrencyServiceUnavailableException
+from models.db_models import BOOKING_OVERLAP_CONSTRAINT
 from models.db_models import Booking as BookingDB
 from models.db_models import BookingStatus
 from models.db_models import Car as CarDB
@@ -19,10 +22,14 @@ from models.pydantic.booking import Booking, BookingCreate, BookingUpdate
 from models.pydantic.pagination import PaginationParams, BookingFilterParams, SortParams, PaginatedResponse
 from models.pydantic.user import User
 from services.auth_service import get_current_user
+from services.exchange_rate_service import get_latest_exchange_rate
 
+# Bookings are returned with their user and car, which can't be lazy loaded with an AsyncSession
+BOOKING_RELATIONSHIPS = (selectinload(BookingDB.user), selectinload(BookingDB.car))
 
-def get_all_bookings(db: Session) -> list[Booking]:
-    bookings_db = db.query(BookingDB).all()
+
+async def get_all_bookings(db: AsyncSession) -> list[Booking]:
+    bookings_db = (await db.scalars(select(BookingDB).options(*BOOKING_RELATIONSHIPS))).all()
     bookings = []
     
     for booking_db in bookings_db:
@@ -34,14 +41,14 @@ def get_all_bookings(db: Session) -> list[Booking]:
 
 async def get_booking_with_permission_check(
     booking_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user_db: UserDB = Depends(get_current_user)
 ):
     """Check if the user has permission to access the specified booking"""
     from models.db_models import Booking as BookingDB
     
     try:
-        booking_db = get_booking_by_id(booking_id, db)
+        booking_db = await get_booking_by_id(booking_id, db)
     except booking_exceptions.BookingNotFoundException as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -59,8 +66,10 @@ async def get_booking_with_permission_check(
     
     return booking
 
-def get_booking_by_id(booking_id: int, db: Session) -> Booking:
-    booking_db = db.query(BookingDB).filter(BookingDB.id == booking_id).first()
+async def get_booking_by_id(booking_id: int, db: AsyncSession) -> Booking:
+    booking_db = await db.scalar(
+        select(BookingDB).options(*BOOKING_RELATIONSHIPS).where(BookingDB.id == booking_id)
+    )
     
     if booking_db is None:
         raise booking_exceptions.BookingNotFoundException(booking_id)
@@ -74,11 +83,11 @@ def convert_booking_currency(total_cost_in_usd: Decimal, exchange_rate: Decimal)
     return (total_cost_in_usd * exchange_rate).quantize(Decimal('0.00'))
 
 
-def create_booking(booking: BookingCreate, user_id: int, db: Session) -> BookingDB:
+async def create_booking(booking: BookingCreate, user_id: int, db: AsyncSession) -> BookingDB:
     logging.info(f"Creating booking for user_id={user_id}, car_id={booking.car_id}, " +
                 f"dates={booking.start_date} to {booking.end_date}")
      
-    car = db.query(CarDB).filter(CarDB.id == booking.car_id).first()
+    car = await db.get(CarDB, booking.car_id)
     if not car:
         logging.warning(f"Car with ID {booking.car_id} not found when creating booking")
         raise booking_exceptions.NoCarFoundException(booking.car_id)
@@ -87,24 +96,28 @@ def create_booking(booking: BookingCreate, user_id: int, db: Session) -> Booking
         logging.warning(f"Car with ID {booking.car_id} is not available for booking")
         raise booking_exceptions.CarNotAvailableException(booking.car_id)
     
-    if does_bookings_overlap(booking.car_id, booking.start_date, booking.end_date, db):
-        logging.warning(f"Car with ID {booking.car_id} has overlapping bookings for dates " +
-                      f"{booking.start_date} to {booking.end_date}")
-        raise booking_exceptions.BookingOverlapException(booking.car_id)
-    
     total_cost = calculate_total_cost(car.price_per_day, booking.start_date, booking.end_date)
     
-    try:
-        # Exception will be raised if the currency converter service is unavailable
-        currency_converter_client = get_currency_converter_client_instance()
-        exchange_rate = currency_converter_client.get_currency_rate('USD', booking.currency_code.value)
-        logging.info(f"Got exchange rate for {booking.currency_code.value}: {exchange_rate}")
-    except ValueError as ve:
-        logging.warning(f"Invalid currency code '{booking.currency_code.value}': {ve}")
-        raise
-    except Exception as e:
-        logging.error(f"Currency service error: {e}")
-        raise
+    # Prefer the local exchange rate snapshot, the currency converter is only asked if there is none
+    exchange_rate_snapshot_id = None
+    snapshot_rate = await get_latest_exchange_rate(db, booking.currency_code)
+    if snapshot_rate is not None:
+        exchange_rate = snapshot_rate.rate.quantize(Decimal('0.00'), rounding=ROUND_DOWN)
+        exchange_rate_snapshot_id = snapshot_rate.snapshot_id
+        logging.info(f"Got exchange rate for {booking.currency_code.value} from snapshot " +
+                    f"{exchange_rate_snapshot_id}: {exchange_rate}")
+    else:
+        try:
+            # Exception will be raised if the currency converter service is unavailable
+            currency_converter_client = await get_async_currency_converter_client_instance()
+            exchange_rate = await currency_converter_client.get_currency_rate('USD', booking.currency_code.value)
+            logging.info(f"Got exchange rate for {booking.currency_code.value}: {exchange_rate}")
+        except ValueError as ve:
+            logging.warning(f"Invalid currency code '{booking.currency_code.value}': {ve}")
+            raise
+        except Exception as e:
+            logging.error(f"Currency service error: {e}")
+            raise
     
     new_booking = BookingDB(
         user_id=user_id,
@@ -115,21 +128,33 @@ def create_booking(booking: BookingCreate, user_id: int, db: Session) -> Booking
         total_cost=total_cost,
         currency_code=booking.currency_code,
         exchange_rate=exchange_rate,
+        exchange_rate_snapshot_id=exchange_rate_snapshot_id,
         status=BookingStatus.PLANNED
     )
 
     db.add(new_booking)
-    db.commit()
-    db.refresh(new_booking)
+    # Overlapping bookings are rejected by the database, also when they are made at the same time
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        if is_booking_overlap_violation(e):
+            logging.warning(f"Car with ID {booking.car_id} has overlapping bookings for dates " +
+                          f"{booking.start_date} to {booking.end_date}")
+            raise booking_exceptions.BookingOverlapException(booking.car_id)
+        raise
+    await db.refresh(new_booking, ["user", "car"])
     
     logging.info(f"Booking created with ID {new_booking.id}, total cost: {total_cost} USD")
     return new_booking
 
-def update_booking(booking_id: int, booking_update: BookingUpdate, db: Session):
+async def update_booking(booking_id: int, booking_update: BookingUpdate, db: AsyncSession):
     logging.info(f"Updating booking {booking_id} with {booking_update.model_dump(exclude_unset=True)}")
     
     # Get and validate booking
-    booking = db.query(BookingDB).filter(BookingDB.id == booking_id).first()
+    booking = await db.scalar(
+        select(BookingDB).options(*BOOKING_RELATIONSHIPS).where(BookingDB.id == booking_id)
+    )
     if booking is None:
         logging.warning(f"Booking {booking_id} not found during update")
         raise booking_exceptions.BookingNotFoundException(booking_id)
@@ -149,11 +174,11 @@ def update_booking(booking_id: int, booking_update: BookingUpdate, db: Session):
         logging.warning(f"Invalid date ordering in booking {booking_id}: {start_date} -> {end_date}")
         raise booking_exceptions.DateRangeException()
 
-    if does_bookings_overlap(booking.car_id, start_date, end_date, db, booking.id):
+    if await does_bookings_overlap(booking.car_id, start_date, end_date, db, booking.id):
         logging.warning(f"Booking {booking_id} update would cause overlap for car {booking.car_id}")
         raise booking_exceptions.BookingOverlapUpdateException()
 
-    price_per_day = db.query(CarDB.price_per_day).filter(CarDB.id == booking.car_id).scalar()
+    price_per_day = await db.scalar(select(CarDB.price_per_day).where(CarDB.id == booking.car_id))
     update_data['total_cost'] = calculate_total_cost(price_per_day, start_date, end_date)
     logging.info(f"Recalculated total cost for booking {booking_id}: {update_data['total_cost']} USD")
 
@@ -166,34 +191,43 @@ def update_booking(booking_id: int, booking_update: BookingUpdate, db: Session):
     handle_return_date_validations(booking, update_data)
     
     # Update booking
-    result = apply_booking_updates(booking, update_data, db)
+    result = await apply_booking_updates(booking, update_data, db)
     logging.info(f"Successfully updated booking {booking_id}")
     return result
 
-def does_bookings_overlap(car_id: int, start_date: date, end_date: date, db: Session, exclude_booking_id: int = None):
+def booking_period(start_date, end_date):
+    """Inclusive date range of a booking, as compared by the overlap constraint"""
+    return func.daterange(start_date, end_date, literal_column("'[]'"))
+
+def is_booking_overlap_violation(error: IntegrityError) -> bool:
+    """Whether the database rejected a booking because it overlaps with another one of the car"""
+    diag = getattr(error.orig, "diag", None)
+    return diag is not None and diag.constraint_name == BOOKING_OVERLAP_CONSTRAINT
+
+async def does_bookings_overlap(car_id: int, start_date: date, end_date: date, db: AsyncSession, exclude_booking_id: int = None):
     """Check if the booking overlaps with existing bookings"""
 
     filters = [
         BookingDB.car_id == car_id,
         BookingDB.status.in_([BookingStatus.PLANNED, BookingStatus.ACTIVE]),
-        BookingDB.start_date <= end_date,
-        BookingDB.end_date >= start_date
+        # Same expression as the overlap constraint, so the check runs through its index
+        booking_period(BookingDB.start_date, BookingDB.end_date).op("&&")(booking_period(start_date, end_date))
     ]
 
     if exclude_booking_id:
         filters.append(BookingDB.id != exclude_booking_id)
     
-    overlapping_bookings = db.query(BookingDB).filter(*filters).first()    
+    overlapping_bookings = await db.scalar(select(BookingDB.id).where(*filters).limit(1))
     return overlapping_bookings is not None
 
 def calculate_booking_duration(start_date: date, end_date: date):
     """Calculate booking duration in days"""
     return (end_date - start_date).days + 1
 
-def get_car_price_in_currency(car_price: Decimal, to_currency: str) -> Decimal:
+async def get_car_price_in_currency(car_price: Decimal, to_currency: str) -> Decimal:
     try:
-        currency_converter_client = get_currency_converter_client_instance()
-        converted_price = currency_converter_client.convert('USD', to_currency, car_price)
+        currency_converter_client = await get_async_currency_converter_client_instance()
+        converted_price = await currency_converter_client.convert('USD', to_currency, car_price)
         logging.info(f"Converted price from USD to {to_currency}: {car_price} -> {converted_price}")
         return converted_price
     except ValueError as ve:
@@ -320,17 +354,24 @@ def is_date_within_period(date_value: date, start_date: date, end_date: date, al
     """Validate that a date is within a period, with optional exception"""
     return date_value >= start_date and (date_value <= end_date or allow_outside)
 
-def apply_booking_updates(booking: BookingDB, update_data: dict, db: Session):
+async def apply_booking_updates(booking: BookingDB, update_data: dict, db: AsyncSession):
     """Apply updates and save to the database"""
     for key, value in update_data.items():
         setattr(booking, key, value)
     
-    db.commit()
-    db.refresh(booking)
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        # Another booking of the car was made for these dates since the overlap check
+        if is_booking_overlap_violation(e):
+            raise booking_exceptions.BookingOverlapUpdateException()
+        raise
+    await db.refresh(booking, ["user", "car"])
     return booking
 
-def get_filtered_bookings(
-    db: Session,
+async def get_filtered_bookings(
+    db: AsyncSession,
     pagination: PaginationParams,
     filters: BookingFilterParams | None = None,
     user_id: int | None = None,
@@ -353,11 +394,11 @@ def get_filtered_bookings(
                 f"user_id={user_id}, filters={filters}, sort={sort_params}")
                 
     # Start with base query
-    query = db.query(BookingDB)
+    query = select(BookingDB)
     
     # Apply user filter if provided (for "my bookings")
     if user_id is not None:
-        query = query.filter(BookingDB.user_id == user_id)
+        query = query.where(BookingDB.user_id == user_id)
     
     # Apply filters if provided
     if filters:
@@ -365,19 +406,19 @@ def get_filtered_bookings(
             try:
                 # Try to match with BookingStatus enum
                 status = BookingStatus(filters.status)
-                query = query.filter(BookingDB.status == status)
+                query = query.where(BookingDB.status == status)
             except ValueError:
                 logging.warning(f"Invalid status filter value: {filters.status}")
                 # If not a valid enum value, filter will return empty result
                 pass
                 
         if filters.car_id:
-            query = query.filter(BookingDB.car_id == filters.car_id)
+            query = query.where(BookingDB.car_id == filters.car_id)
             
         if filters.start_date_from:
             try:
                 start_date_from = date.fromisoformat(filters.start_date_from)
-                query = query.filter(BookingDB.start_date >= start_date_from)
+                query = query.where(BookingDB.start_date >= start_date_from)
             except ValueError:
                 logging.warning(f"Invalid date format for start_date_from: {filters.start_date_from}")
                 raise booking_exceptions.InvalidDateFormatException("start_date_from")
@@ -385,7 +426,7 @@ def get_filtered_bookings(
         if filters.start_date_to:
             try:
                 start_date_to = date.fromisoformat(filters.start_date_to)
-                query = query.filter(BookingDB.start_date <= start_date_to)
+                query = query.where(BookingDB.start_date <= start_date_to)
             except ValueError:
                 logging.warning(f"Invalid date format for start_date_to: {filters.start_date_to}")
                 raise booking_exceptions.InvalidDateFormatException("start_date_to")
@@ -393,7 +434,7 @@ def get_filtered_bookings(
         if filters.end_date_from:
             try:
                 end_date_from = date.fromisoformat(filters.end_date_from)
-                query = query.filter(BookingDB.end_date >= end_date_from)
+                query = query.where(BookingDB.end_date >= end_date_from)
             except ValueError:
                 logging.warning(f"Invalid date format for end_date_from: {filters.end_date_from}")
                 raise booking_exceptions.InvalidDateFormatException("end_date_from")
@@ -401,7 +442,7 @@ def get_filtered_bookings(
         if filters.end_date_to:
             try:
                 end_date_to = date.fromisoformat(filters.end_date_to)
-                query = query.filter(BookingDB.end_date <= end_date_to)
+                query = query.where(BookingDB.end_date <= end_date_to)
             except ValueError:
                 logging.warning(f"Invalid date format for end_date_to: {filters.end_date_to}")
                 raise booking_exceptions.InvalidDateFormatException("end_date_to")
@@ -425,7 +466,7 @@ def get_filtered_bookings(
         query = query.order_by(BookingDB.id)
     
     # Count total items for pagination metadata
-    total_items = query.count()
+    total_items = await db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
     
     # Calculate total pages
     total_pages = (total_items + pagination.page_size - 1) // pagination.page_size if total_items > 0 else 0
@@ -435,7 +476,7 @@ def get_filtered_bookings(
     query = query.offset(offset).limit(pagination.page_size)
     
     # Execute query
-    bookings_db = query.all()
+    bookings_db = (await db.scalars(query.options(*BOOKING_RELATIONSHIPS))).all()
     logging.info(f"Found {len(bookings_db)} bookings matching criteria. Total: {total_items}")
     
     # Convert to Pydantic models
@@ -1,19 +1,24 @@
 import logging
+from datetime import datetime, timezone
+from decimal import Decimal
 
-from sqlalchemy import desc
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, desc, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from currency_converter.client import get_currency_converter_client_instance
+from currency_converter.async_client import get_async_currency_converter_client_instance
 from exceptions.cars import CarNotFoundException
 from exceptions.currencies import InvalidCurrencyException, CurrencyServiceUnavailableException
 from models.currencies import Currency
 from models.db_models import Car as CarDB
+from models.db_models import CarPrice as CarPriceDB
+from models.db_models import ExchangeRate as ExchangeRateDB
 from models.pydantic.car import Car
 from models.pydantic.pagination import PaginationParams, SortParams, PaginatedResponse
+from services.exchange_rate_service import convert_price, get_latest_snapshot
 
 
-def get_all_cars(db: Session, currency_code: str | None = Currency.USD.value) -> list[Car]:
-    cars_db = db.query(CarDB).all()
+async def get_all_cars(db: AsyncSession, currency_code: str | None = Currency.USD.value) -> list[Car]:
+    cars_db = (await db.scalars(select(CarDB))).all()
     cars = [Car.model_validate(car) for car in cars_db]
     
     if not currency_code or currency_code == Currency.USD:
@@ -24,17 +29,30 @@ def get_all_cars(db: Session, currency_code: str | None = Currency.USD.value) ->
     except ValueError:
         raise InvalidCurrencyException(currency_code)
     
-    currency_converter = get_currency_converter_client_instance()
+    currency_converter = await get_async_currency_converter_client_instance()
+    converted_prices = await currency_converter.convert_many("USD", currency.value, [car.price_per_day for car in cars])
     
-    for car in cars:
-        converted_price = currency_converter.convert("USD", currency.value, car.price_per_day)
+    for car, converted_price in zip(cars, converted_prices):
         car.price_per_day = converted_price
     
     return cars
 
 
-def get_car_by_id(car_id: int, db: Session, currency_code: str | None = Currency.USD.value) -> Car:
-    car_db = db.query(CarDB).filter(CarDB.id == car_id).first()
+async def get_exchange_rate_age(db: AsyncSession, currency_code: str) -> float | None:
+    """Age in seconds of the rate used to convert USD prices to the currency, None if no rate is involved"""
+    if currency_code == Currency.USD.value:
+        return None
+
+    snapshot = await get_latest_snapshot(db, Currency(currency_code))
+    if snapshot is not None:
+        return (datetime.now(timezone.utc) - snapshot.fetched_at).total_seconds()
+
+    currency_converter = await get_async_currency_converter_client_instance()
+    return currency_converter.get_rate_age(Currency.USD.value, currency_code)
+
+
+async def get_car_by_id(car_id: int, db: AsyncSession, currency_code: str | None = Currency.USD.value) -> Car:
+    car_db = await db.get(CarDB, car_id)
     
     if car_db is None:
         raise CarNotFoundException(car_id)
@@ -49,24 +67,61 @@ def get_car_by_id(car_id: int, db: Session, currency_code: str | None = Currency
     except ValueError:
         raise InvalidCurrencyException(currency_code)
     
-    currency_converter = get_currency_converter_client_instance()
-    converted_price = currency_converter.convert("USD", currency.value, car.price_per_day)
-    car.price_per_day = converted_price
+    # Same price as in the listings if there is a recent snapshot
+    snapshot = await get_latest_snapshot(db, currency)
+    car_price = None
+    if snapshot is not None:
+        price_join, price_column = snapshot_price(snapshot.id, currency)
+        car_price = await db.scalar(
+            select(price_column).select_from(CarDB).outerjoin(CarPriceDB, price_join).where(CarDB.id == car_id)
+        )
+    
+    if car_price is not None:
+        car.price_per_day = car_price
+    else:
+        currency_converter = await get_async_currency_converter_client_instance()
+        converted_price = await currency_converter.convert("USD", currency.value, car.price_per_day)
+        car.price_per_day = converted_price
     
     return car
 
 
-def get_filtered_cars(
-    db: Session,
+def snapshot_price(snapshot_id: int, currency: Currency):
+    """
+    Join condition of the car_prices rows of the snapshot and the price of a car in the currency.
+    Cars without a row, e.g. ones changed outside of the ORM since the last rebuild, are converted with the snapshot's rate.
+    """
+    price_join = and_(
+        CarPriceDB.car_id == CarDB.id,
+        CarPriceDB.currency_code == currency,
+        CarPriceDB.snapshot_id == snapshot_id
+    )
+    snapshot_rate = select(ExchangeRateDB.rate).where(
+        ExchangeRateDB.snapshot_id == snapshot_id,
+        ExchangeRateDB.currency_code == currency
+    ).scalar_subquery()
+    price_column = func.coalesce(CarPriceDB.price_per_day, convert_price(CarDB.price_per_day, snapshot_rate))
+    return price_join, price_column
+
+
+async def get_filtered_cars(
+    db: AsyncSession,
     pagination: PaginationParams,
     name_filter: str | None = None,
     available_only: bool = False,
     currency_code: str = Currency.USD.value,
-    sort_params: SortParams | None = None
+    sort_params: SortParams | None = None,
+    min_price: Decimal | None = None,
+    max_price: Decimal | None = None
 ) -> PaginatedResponse[Car]:
     """
     Get cars with filtering, sorting, and pagination.
     
+    Prices in other currencies come from the car_prices table of the latest exchange rate
+    snapshot with a rate for the currency, so sorting and price filters use the converted price inside the database.
+    Cars missing from car_prices are converted with the rate of the same snapshot.
+    Without a recent snapshot the page is converted with the currency converter instead.
+    
     Args:
         db: Database session
         pagination: Pagination parameters
@@ -74,32 +129,73 @@ def get_filtered_cars(
         available_only: If True, return only available cars
         currency_code: Currency code for pricing
         sort_params: Optional sorting parameters
+        min_price: Optional lower bound of the price per day in the requested currency
+        max_price: Optional upper bound of the price per day in the requested currency
         
     Returns:
         PaginatedResponse containing cars and pagination metadata
     """
+    # Check currency code first before processing cars
+    if currency_code != Currency.USD.value:
+        try:
+            currency = Currency(currency_code)
+        except ValueError as ve:
+            # Raise InvalidCurrencyException instead of just logging
+            logging.warning(f"Invalid currency code '{currency_code}': {ve}")
+            raise InvalidCurrencyException(currency_code)
+    
     # Start with base query
-    query = db.query(CarDB)
+    query = select(CarDB)
     
     # Apply filters
     if name_filter:
         # Search both name and model fields
-        query = query.filter(
+        query = query.where(
             (CarDB.name.ilike(f'%{name_filter}%')) | (CarDB.model.ilike(f'%{name_filter}%'))
         )
     
     if available_only:
-        query = query.filter(CarDB.is_available == True)
+        query = query.where(CarDB.is_available == True)
+    
+    # Column holding the price in the requested currency
+    price_column = CarDB.price_per_day
+    converter = None
+    materialized = False
+    if currency_code != Currency.USD.value:
+        snapshot = await get_latest_snapshot(db, currency)
+        if snapshot is not None:
+            price_join, price_column = snapshot_price(snapshot.id, currency)
+            query = query.outerjoin(CarPriceDB, price_join).add_columns(price_column)
+            materialized = True
+        else:
+            try:
+                converter = await get_async_currency_converter_client_instance()
+                if min_price is not None or max_price is not None:
+                    # Bounds are in the requested currency, compare against the converted USD price
+                    rates = await converter.get_exchange_rates('USD', [currency.value])
+                    price_column = convert_price(CarDB.price_per_day, rates[currency.value])
+            except Exception as e:
+                logging.error(f"Failed to initialize currency converter for '{currency_code}': {e}")
+                raise CurrencyServiceUnavailableException(str(e))
+    
+    if min_price is not None:
+        query = query.where(price_column >= min_price)
+    if max_price is not None:
+        query = query.where(price_column <= max_price)
     
     # Apply sorting
     if sort_params:
         if hasattr(CarDB, sort_params.sort_by):
-            sort_column = getattr(CarDB, sort_params.sort_by)
+            if sort_params.sort_by == "price_per_day":
+                sort_column = price_column
+            else:
+                sort_column = getattr(CarDB, sort_params.sort_by)
             
             if sort_params.sort_order == "desc":
                 sort_column = desc(sort_column)
-                
-            query = query.order_by(sort_column)
+            
+            # Ties are broken by ID so pages do not overlap
+            query = query.order_by(sort_column, CarDB.id)
         else:
             # Default to sorting by ID if column doesn't exist
             query = query.order_by(CarDB.id)
@@ -108,7 +204,7 @@ def get_filtered_cars(
         query = query.order_by(CarDB.id)
     
     # Count total items for pagination metadata
-    total_items = query.count()
+    total_items = await db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
     
     # Calculate total pages
     total_pages = (total_items + pagination.page_size - 1) // pagination.page_size if total_items > 0 else 0
@@ -117,42 +213,26 @@ def get_filtered_cars(
     offset = (pagination.page - 1) * pagination.page_size
     query = query.offset(offset).limit(pagination.page_size)
     
-    # Execute query
-    cars_db = query.all()
-    
-    # Check currency code first before processing cars
-    if currency_code != Currency.USD.value:
-        try:
-            Currency(currency_code)
-        except ValueError as ve:
-            # Raise InvalidCurrencyException instead of just logging
-            logging.warning(f"Invalid currency code '{currency_code}': {ve}")
-            raise InvalidCurrencyException(currency_code)
+    # Execute query and convert to Pydantic models
+    if materialized:
+        cars = []
+        for car_db, converted_price in (await db.execute(query)).all():
+            car = Car.model_validate(car_db)
+            car.price_per_day = converted_price
+            cars.append(car)
+    else:
+        cars = [Car.model_validate(car_db) for car_db in (await db.scalars(query)).all()]
     
-    # Convert to Pydantic models with currency conversion if needed
-    cars = []
-    converter = None
-    if currency_code != Currency.USD.value:
+    # Convert the prices of the whole page in one call
+    if converter and cars:
         try:
-            currency = Currency(currency_code)  # This is already checked above, but kept for clarity
-            converter = get_currency_converter_client_instance()
+            converted_prices = await converter.convert_many('USD', currency.value, [car.price_per_day for car in cars])
         except Exception as e:
-            logging.error(f"Failed to initialize currency converter for '{currency_code}': {e}")
+            logging.error(f"Currency conversion failed for '{currency_code}': {e}")
             raise CurrencyServiceUnavailableException(str(e))
-
-    # Now use the converter in the loop
-    for car_db in cars_db:
-        car = Car.model_validate(car_db)
         
-        # Convert pricing if needed
-        if converter:
-            try:
-                car.price_per_day = converter.convert('USD', currency.value, car.price_per_day)
-            except Exception as e:
-                logging.error(f"Currency conversion failed for '{currency_code}': {e}")
-                raise CurrencyServiceUnavailableException(str(e))
-                
-        cars.append(car)
+        for car, converted_price in zip(cars, converted_prices):
+            car.price_per_day = converted_price
     
     # Return paginated response
     return PaginatedResponse[Car](
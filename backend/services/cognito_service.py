@@ -1,14 +1,28 @@
+import hashlib
+import json
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+
 import jwt
-from jwt import PyJWKClient
+from anyio import CapacityLimiter
+from jwt import PyJWK, PyJWKClient
+from prometheus_client import Counter
 
 from exceptions.auth import ConfigurationError, InvalidTokenException
 
+# Offline mode: the signing keys are read from this JWKS file instead of AWS, see local_token_issuer.py
+COGNITO_JWKS_FILE = os.getenv("COGNITO_JWKS_FILE", "")
+# Pool and client used by the local token issuer when no real pool is configured
+LOCAL_USER_POOL_ID = "local-pool"
+LOCAL_CLIENT_ID = "local-client"
+
 # Cognito configuration
 COGNITO_REGION = os.getenv("COGNITO_REGION", "eu-north-1")
-COGNITO_USER_POOL_ID = os.getenv("COGNITO_USER_POOL_ID")
-COGNITO_CLIENT_ID = os.getenv("COGNITO_CLIENT_ID")
+COGNITO_USER_POOL_ID = os.getenv("COGNITO_USER_POOL_ID", LOCAL_USER_POOL_ID if COGNITO_JWKS_FILE else None)
+COGNITO_CLIENT_ID = os.getenv("COGNITO_CLIENT_ID", LOCAL_CLIENT_ID if COGNITO_JWKS_FILE else None)
 
 if not COGNITO_USER_POOL_ID:
     raise ConfigurationError("Missing required environment variable: COGNITO_USER_POOL_ID")
@@ -17,23 +31,204 @@ if not COGNITO_CLIENT_ID:
     raise ConfigurationError("Missing required environment variable: COGNITO_CLIENT_ID")
 
 
-# JWKS URL
-JWKS_URL = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_USER_POOL_ID}/.well-known/jwks.json"
+# Issuer of the tokens and JWKS URL of the user pool
+COGNITO_ISSUER = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_USER_POOL_ID}"
+JWKS_URL = f"{COGNITO_ISSUER}/.well-known/jwks.json"
+
+# How long the signing keys are used before they are fetched again (refreshed in the background at half of it)
+COGNITO_JWKS_CACHE_TTL_SECONDS = float(os.getenv("COGNITO_JWKS_CACHE_TTL_SECONDS", "3600"))
+# Tokens with an unknown kid trigger a refetch at most this often, so bad tokens cannot cause fetch storms
+COGNITO_JWKS_MIN_REFETCH_INTERVAL_SECONDS = float(os.getenv("COGNITO_JWKS_MIN_REFETCH_INTERVAL_SECONDS", "60"))
+# Threads verifying tokens off the event loop per worker, bounds the CPU spent on RS256 checks and JWKS fetches
+COGNITO_VERIFY_MAX_THREADS = int(os.getenv("COGNITO_VERIFY_MAX_THREADS", "4"))
+# Verified tokens kept in memory, repeat requests with the same token skip the signature check
+COGNITO_VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("COGNITO_VERIFIED_TOKEN_CACHE_SIZE", "1024"))
+
+JWKS_FETCHES = Counter("cognito_jwks_fetches_total", "Fetches of the Cognito JWKS", ["reason", "result"])
+VERIFIED_TOKEN_CACHE_LOOKUPS = Counter(
+    "cognito_verified_token_cache_lookups_total",
+    "Lookups of verified token payloads, a miss means the token was verified from scratch",
+    ["result"]
+)
+
+logger = logging.getLogger(__name__)
+
+
+class FileJwksClient(PyJWKClient):
+    """Reads the key set from a local JWKS file, for offline development and load tests"""
+    def fetch_data(self):
+        try:
+            with open(self.uri) as jwks_file:
+                return json.load(jwks_file)
+        except (OSError, ValueError) as e:
+            raise jwt.exceptions.PyJWKClientError(f'Failed to read JWKS file "{self.uri}": {e}') from e
+
+
+class JwksKeyCache:
+    """
+    Process-wide cache of the Cognito signing keys, indexed by kid.
+    Keys are refreshed after the TTL (in the background once started) and refetched
+    right away when a token presents an unknown kid, at most once per minimum refetch interval.
+    """
+    def __init__(
+        self,
+        jwks_url: str = JWKS_URL,
+        ttl_seconds: float = COGNITO_JWKS_CACHE_TTL_SECONDS,
+        min_refetch_interval_seconds: float = COGNITO_JWKS_MIN_REFETCH_INTERVAL_SECONDS,
+        jwks_file: str = COGNITO_JWKS_FILE
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.min_refetch_interval_seconds = min_refetch_interval_seconds
+        # Only used to load and parse the key set, the caching happens here
+        if jwks_file:
+            self._client = FileJwksClient(jwks_file, cache_jwk_set=False, cache_keys=False)
+        else:
+            self._client = PyJWKClient(jwks_url, cache_jwk_set=False, cache_keys=False, timeout=10)
+        self._keys: dict[str, PyJWK] = {}
+        self._fetched_at: float | None = None
+        self._last_fetch_attempt: float | None = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._refresh_thread: threading.Thread | None = None
+
+    def get_signing_key_from_jwt(self, token: str) -> PyJWK:
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get("kid"))
+
+    def get_signing_key(self, kid: str) -> PyJWK:
+        with self._lock:
+            if self._fetched_at is None or time.monotonic() - self._fetched_at >= self.ttl_seconds:
+                self._fetch("expired")
+
+            key = self._keys.get(kid)
+            if key is None and self._may_refetch():
+                # The pool may have rotated its keys
+                self._fetch("unknown_kid")
+                key = self._keys.get(kid)
+
+        if key is None:
+            raise jwt.exceptions.PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+    def refresh(self):
+        with self._lock:
+            self._fetch("refresh")
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_fetch_attempt = None
+
+    def start_background_refresh(self):
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name="cognito-jwks-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop_event.set()
+
+    def _refresh_loop(self):
+        while not self._stop_event.wait(self.ttl_seconds / 2):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Failed to refresh Cognito JWKS: {e}")
+
+    def _may_refetch(self) -> bool:
+        return (
+            self._last_fetch_attempt is None
+            or time.monotonic() - self._last_fetch_attempt >= self.min_refetch_interval_seconds
+        )
+
+    def _fetch(self, reason: str):
+        # Must be called with the lock held
+        self._last_fetch_attempt = time.monotonic()
+        try:
+            signing_keys = self._client.get_signing_keys()
+        except Exception:
+            JWKS_FETCHES.labels(reason, "failure").inc()
+            if not self._keys:
+                raise
+            # Keep verifying with the known keys, try again after the minimum refetch interval
+            logger.warning("Failed to fetch Cognito JWKS, keeping the cached keys", exc_info=True)
+            self._fetched_at = time.monotonic() - self.ttl_seconds + self.min_refetch_interval_seconds
+            return
+
+        JWKS_FETCHES.labels(reason, "success").inc()
+        self._keys = {key.key_id: key for key in signing_keys}
+        self._fetched_at = time.monotonic()
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of verified token payloads keyed by the SHA-256 digest of the token,
+    so raw tokens are not kept in memory. Entries expire together with the token (exp claim).
+    """
+    def __init__(self, max_size: int = COGNITO_VERIFIED_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str, count_miss: bool = True) -> dict | None:
+        """Cached payload, count_miss=False if a miss is followed by verify_cognito_jwt which counts it"""
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[digest]
+                entry = None
+            if entry is None:
+                if count_miss:
+                    VERIFIED_TOKEN_CACHE_LOOKUPS.labels("miss").inc()
+                return None
+            self._entries.move_to_end(digest)
+        VERIFIED_TOKEN_CACHE_LOOKUPS.labels("hit").inc()
+        # Callers get their own copy, the cached payload must not change
+        return dict(entry[1])
+
+    def set(self, token: str, payload: dict):
+        expires_at = payload.get("exp")
+        if self.max_size <= 0 or not isinstance(expires_at, (int, float)):
+            return
+
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (expires_at, dict(payload))
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+
+jwks_key_cache = JwksKeyCache()
+verified_token_cache = VerifiedTokenCache()
+jwt_verify_limiter = CapacityLimiter(COGNITO_VERIFY_MAX_THREADS)
 
 def verify_cognito_jwt(token: str):
     """Verify a JWT token from AWS Cognito"""
+    payload = verified_token_cache.get(token)
+    if payload is not None:
+        return payload
+    
     try:
         # Log token information for debugging (header only, not the full token)
         header = jwt.get_unverified_header(token)
         logging.info(f"Verifying token with kid: {header.get('kid')}, alg: {header.get('alg')}")
-        logging.info(f"Using JWKS URL: {JWKS_URL}")
-        
-        # Create JWKS client with proper timeout
-        jwk_client = PyJWKClient(JWKS_URL, timeout=10)
         
         # Get signing key
         try:
-            signing_key = jwk_client.get_signing_key_from_jwt(token)
+            signing_key = jwks_key_cache.get_signing_key_from_jwt(token)
         except jwt.exceptions.PyJWKClientError as e:
             logging.error(f"JWKS key error: {str(e)}")
             raise InvalidTokenException(f"Token verification failed: {str(e)}")
@@ -49,8 +244,9 @@ def verify_cognito_jwt(token: str):
                 "verify_iss": True,   # But do verify issuer
             },
             # Issuer should match your Cognito user pool
-            issuer=f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_USER_POOL_ID}"
+            issuer=COGNITO_ISSUER
         )
+        verified_token_cache.set(token, payload)
         return payload
     except Exception as e:
         logging.error(f"Token verification error: {str(e)}")
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from anyio import to_thread
+from sqlalchemy import Numeric, cast, delete, event, func, insert, inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from currency_converter.async_client import get_async_currency_converter_client_instance
+from database import SessionLocal
+from models.currencies import Currency
+from models.db_models import Car as CarDB
+from models.db_models import CarPrice as CarPriceDB
+from models.db_models import ExchangeRate as ExchangeRateDB
+from models.db_models import ExchangeRateSnapshot as ExchangeRateSnapshotDB
+
+# How often the refresher asks the currency converter for new rates
+EXCHANGE_RATE_REFRESH_INTERVAL_SECONDS = float(os.getenv("EXCHANGE_RATE_REFRESH_INTERVAL_SECONDS", "3600"))
+# Snapshots that were not confirmed for longer than this are not used for new bookings
+EXCHANGE_RATE_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("EXCHANGE_RATE_SNAPSHOT_MAX_AGE_SECONDS", "172800"))
+
+# Postgres advisory lock key, only one worker writes a snapshot at a time
+SNAPSHOT_ADVISORY_LOCK_ID = 7_001
+RATE_PRECISION = Decimal('0.00000001')
+
+
+async def get_latest_snapshot(db: AsyncSession, currency: Currency | None = None) -> ExchangeRateSnapshotDB | None:
+    """
+    Newest snapshot, None if it is older than the maximum age.
+    With a currency only snapshots that have a rate for it are considered.
+    """
+    query = select(ExchangeRateSnapshotDB).where(ExchangeRateSnapshotDB.fetched_at >= _min_fetched_at())
+    if currency is not None:
+        query = query.where(ExchangeRateSnapshotDB.rates.any(ExchangeRateDB.currency_code == currency))
+    return await db.scalar(query.order_by(ExchangeRateSnapshotDB.id.desc()).limit(1))
+
+
+async def get_latest_exchange_rate(db: AsyncSession, currency: Currency) -> ExchangeRateDB | None:
+    """Rate of the currency in the newest snapshot, None if there is no recent snapshot"""
+    min_fetched_at = _min_fetched_at()
+    return await db.scalar(
+        select(ExchangeRateDB)
+        .join(ExchangeRateSnapshotDB)
+        .where(
+            ExchangeRateDB.currency_code == currency,
+            ExchangeRateSnapshotDB.fetched_at >= min_fetched_at
+        )
+        .order_by(ExchangeRateDB.snapshot_id.desc())
+        .limit(1)
+    )
+
+
+def save_exchange_rate_snapshot(db: Session, rates: dict[Currency, Decimal]) -> ExchangeRateSnapshotDB | None:
+    """
+    Store the rates as a new snapshot. If they did not change since the newest snapshot,
+    that snapshot is only marked as confirmed. Returns None if another worker is writing.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        locked = db.execute(text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": SNAPSHOT_ADVISORY_LOCK_ID}).scalar()
+        if not locked:
+            logging.info("Exchange rate snapshot is being written by another worker, skipping")
+            return None
+
+    rates = {currency: rate.quantize(RATE_PRECISION) for currency, rate in rates.items()}
+    now = datetime.now(timezone.utc)
+
+    latest_snapshot = db.query(ExchangeRateSnapshotDB).order_by(ExchangeRateSnapshotDB.id.desc()).first()
+    if latest_snapshot is not None:
+        latest_rates = {rate.currency_code: rate.rate for rate in latest_snapshot.rates}
+        if latest_rates == rates:
+            latest_snapshot.fetched_at = now
+            # Cars may have changed since the last refresh
+            rebuild_car_prices(db, latest_snapshot.id)
+            db.commit()
+            return latest_snapshot
+
+    snapshot = ExchangeRateSnapshotDB(
+        fetched_at=now,
+        rates=[ExchangeRateDB(currency_code=currency, rate=rate) for currency, rate in rates.items()]
+    )
+    db.add(snapshot)
+    db.flush()
+    rebuild_car_prices(db, snapshot.id)
+    db.commit()
+    db.refresh(snapshot)
+
+    logging.info(f"Stored exchange rate snapshot {snapshot.id} with {len(rates)} rates")
+    return snapshot
+
+
+def convert_price(price_per_day, rate):
+    """SQL expression of a USD price converted with a rate, rounded down to cents like the currency converter"""
+    return cast(func.floor(price_per_day * rate * 100) / 100, Numeric(10, 2))
+
+
+def rebuild_car_prices(db: Session, snapshot_id: int):
+    """
+    Replace the car_prices table with the prices of all cars in all currencies of the snapshot,
+    so listings can filter, sort and paginate by converted price in SQL. Runs in the caller's transaction.
+    """
+    db.execute(delete(CarPriceDB))
+    db.execute(_insert_car_prices(snapshot_id))
+
+
+def _insert_car_prices(snapshot_id, *where):
+    prices = (
+        select(
+            CarDB.id, ExchangeRateDB.currency_code, ExchangeRateDB.snapshot_id,
+            convert_price(CarDB.price_per_day, ExchangeRateDB.rate)
+        )
+        .join(ExchangeRateDB, ExchangeRateDB.snapshot_id == snapshot_id)
+        .where(CarDB.price_per_day.is_not(None), *where)
+    )
+    return insert(CarPriceDB).from_select(
+        [CarPriceDB.car_id, CarPriceDB.currency_code, CarPriceDB.snapshot_id, CarPriceDB.price_per_day],
+        prices
+    )
+
+
+@event.listens_for(CarDB, "after_insert")
+@event.listens_for(CarDB, "after_update")
+def _reprice_car(mapper, connection, car: CarDB):
+    """Keep the car_prices of a new or repriced car in line with the newest snapshot, in the same flush"""
+    if not inspect(car).attrs.price_per_day.history.has_changes():
+        return
+    newest_snapshot_id = select(func.max(ExchangeRateSnapshotDB.id)).scalar_subquery()
+    connection.execute(delete(CarPriceDB).where(CarPriceDB.car_id == car.id))
+    connection.execute(_insert_car_prices(newest_snapshot_id, CarDB.id == car.id))
+
+
+async def fetch_exchange_rates() -> dict[Currency, Decimal]:
+    """
+    Rates from USD to the supported currencies, fetched now so they are as fresh as the snapshot claims.
+    Currencies whose rate cannot be fetched, e.g. ones missing from the provider's feed, are left out.
+    """
+    converter = await get_async_currency_converter_client_instance()
+    rates = {}
+    for currency in Currency:
+        try:
+            currency_rates = await converter.get_exchange_rates(Currency.USD.value, [currency.value], refetch=True)
+        except Exception as e:
+            logging.warning(f"Failed to fetch exchange rate for '{currency.value}', leaving it out of the snapshot: {e}")
+            continue
+        rates[currency] = currency_rates[currency.value]
+    return rates
+
+
+async def refresh_exchange_rates():
+    rates = await fetch_exchange_rates()
+    if not rates:
+        logging.warning("No exchange rate could be fetched, keeping the last snapshot")
+        return
+    await to_thread.run_sync(_save_exchange_rate_snapshot_in_new_session, rates)
+
+
+async def run_exchange_rate_refresher(interval_seconds: float = EXCHANGE_RATE_REFRESH_INTERVAL_SECONDS):
+    """Refresh the exchange rate snapshot periodically, meant to run as a background task"""
+    while True:
+        try:
+            await refresh_exchange_rates()
+        except Exception as e:
+            # Bookings keep using the last snapshot until it is too old
+            logging.warning(f"Failed to refresh exchange rate snapshot: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+def _save_exchange_rate_snapshot_in_new_session(rates: dict[Currency, Decimal]):
+    db = SessionLocal()
+    try:
+        save_exchange_rate_snapshot(db, rates)
+    finally:
+        db.close()
+
+
+def _min_fetched_at() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=EXCHANGE_RATE_SNAPSHOT_MAX_AGE_SECONDS)
@@ -2,22 +2,40 @@ import os
 from datetime import date, time
 from decimal import Decimal
 
+# The tests mock the currency converter, don't use the real one on app startup
+os.environ["CURRENCY_CONVERTER_PRELOAD"] = "False"
+os.environ["EXCHANGE_RATE_REFRESHER_ENABLED"] = "False"
+# Tokens are mocked as well, don't fetch the Cognito signing keys
+os.environ["COGNITO_JWKS_PRELOAD"] = "False"
+
 import pytest
+import pytest_asyncio
 from fastapi import Depends, HTTPException
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from testcontainers.postgres import PostgresContainer
 
-from database import get_db
+from database import get_async_db, read_your_writes
 from main import app
 from models.currencies import Currency
 from models.db_models import Base, Booking, BookingStatus, Car, User, UserRole
-from services.auth_service import get_current_user, require_role
+from services.auth_service import get_async_read_db, get_current_user, require_role, user_identity_cache
+from services.cognito_service import verified_token_cache
 
 # Create test database
 
 
+# Every test starts without cached users, tokens and recent writes, the test database is recreated per test
+@pytest.fixture(autouse=True)
+def clear_auth_caches():
+    user_identity_cache.clear()
+    verified_token_cache.clear()
+    read_your_writes.clear()
+    yield
+
 # PostgreSQL container fixture
 @pytest.fixture(scope="session")
 def postgres_container():
@@ -70,6 +88,21 @@ def test_db(postgres_container):
         # Clean up after test
         Base.metadata.drop_all(bind=engine)
 
+# Async sessions on the test database, like the ones the routes get from get_async_db
+@pytest.fixture
+def test_async_session_local(test_db, postgres_container):
+    # No pool, connections must not outlive the event loop that opened them
+    engine = create_async_engine(
+        postgres_container.replace("postgresql://", "postgresql+psycopg://", 1),
+        poolclass=NullPool
+    )
+    return async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+@pytest_asyncio.fixture
+async def async_test_db(test_async_session_local):
+    async with test_async_session_local() as db:
+        yield db
+
 # Create test data
 @pytest.fixture
 def test_data(test_db):
@@ -165,19 +198,18 @@ def test_data(test_db):
 
 # Override the dependency for testing
 @pytest.fixture
-def client(test_db):
-    # Override the get_db dependency
-    def override_get_db():
-        try:
-            yield test_db
-        finally:
-            pass
+def client(test_db, test_async_session_local):
+    # Override the get_async_db dependency, every request gets its own session on the test database
+    async def override_get_async_db():
+        async with test_async_session_local() as db:
+            yield db
     
     # Store the original dependency overrides
     original_overrides = app.dependency_overrides.copy()
     
     # Set up dependency overrides
-    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_async_read_db] = override_get_async_db
     
     # Create the test client
     with TestClient(app) as c:
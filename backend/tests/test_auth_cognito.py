@@ -4,7 +4,7 @@ from datetime import date, time, timedelta
 from decimal import Decimal
 from time import time as time_func
 from unittest import mock
-from unittest.mock import Mock, MagicMock, patch
+from unittest.mock import AsyncMock, Mock, MagicMock, patch
 
 import jwt
 import pytest
@@ -14,7 +14,7 @@ from fastapi.security import HTTPAuthorizationCredentials
 from exceptions.auth import InvalidTokenException
 from models.currencies import Currency
 from models.db_models import Booking, BookingStatus, User, UserRole
-from services.auth_service import get_current_user, require_role
+from services.auth_service import get_current_user, require_role, user_identity_cache
 from services.booking_service import get_booking_with_permission_check
 from services.cognito_service import verify_cognito_jwt
 from exceptions.auth import ConfigurationError
@@ -26,7 +26,7 @@ class TestAdvancedAuthScenarios:
     @pytest.mark.asyncio
     @patch('services.auth_service.logger')
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_db_error_during_user_lookup(self, mock_verify_jwt, mock_logger, test_db):
+    async def test_db_error_during_user_lookup(self, mock_verify_jwt, mock_logger, async_test_db):
         """Test handling of database errors during user lookup"""
         # Mock valid JWT payload
         mock_verify_jwt.return_value = {
@@ -42,10 +42,10 @@ class TestAdvancedAuthScenarios:
         db_error_message = "Database connection error"
 
         # Simulate database error during query
-        with patch.object(test_db, 'query', side_effect=Exception(db_error_message)):
+        with patch.object(async_test_db, 'scalar', side_effect=Exception(db_error_message)):
             # Expect HTTPException 500
             with pytest.raises(HTTPException) as exc_info:
-                await get_current_user(mock_credentials, test_db)
+                await get_current_user(mock_credentials, async_test_db)
 
             # Assert status code 500 and detail
             assert exc_info.value.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -62,7 +62,7 @@ class TestAdvancedAuthScenarios:
     @pytest.mark.asyncio
     @patch('services.auth_service.logger')
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_db_commit_error_handling(self, mock_verify_jwt, mock_logger, test_db): 
+    async def test_db_commit_error_handling(self, mock_verify_jwt, mock_logger, async_test_db): 
         """Test handling of database commit error during user creation"""
         # Set up mock for new user creation that fails on commit
         mock_verify_jwt.return_value = {
@@ -77,10 +77,10 @@ class TestAdvancedAuthScenarios:
         commit_error_message = "Commit failed"
 
         # Patch db.commit to raise exception
-        with patch.object(test_db, 'commit', side_effect=Exception(commit_error_message)):
+        with patch.object(async_test_db, 'commit', side_effect=Exception(commit_error_message)):
             # Expect HTTPException 500
             with pytest.raises(HTTPException) as exc_info:
-                await get_current_user(mock_credentials, test_db)
+                await get_current_user(mock_credentials, async_test_db)
 
             # Assert status code 500 and detail
             assert exc_info.value.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -102,11 +102,11 @@ class TestAdvancedAuthScenarios:
         (binascii.Error("Invalid base64"), "Invalid or expired token")
     ])
     @pytest.mark.asyncio
-    @patch('services.cognito_service.PyJWKClient')
-    async def test_jwt_specific_errors(self, mock_jwk_client, jwt_error, expected_detail, test_db):
+    @patch('services.cognito_service.jwks_key_cache')
+    async def test_jwt_specific_errors(self, mock_jwk_client, jwt_error, expected_detail, async_test_db):
         """Test handling of specific JWT validation errors"""
         # Mock JWT client to raise specific exception
-        mock_jwk_instance = mock_jwk_client.return_value
+        mock_jwk_instance = mock_jwk_client
         mock_jwk_instance.get_signing_key_from_jwt.side_effect = jwt_error
 
         mock_credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="bad.token")
@@ -114,7 +114,7 @@ class TestAdvancedAuthScenarios:
         # Should raise HTTPException
         with pytest.raises(HTTPException) as exc_info:
             # We call get_current_user, which internally calls verify_cognito_jwt
-            await get_current_user(mock_credentials, test_db)
+            await get_current_user(mock_credentials, async_test_db)
 
         assert exc_info.value.status_code == 401
         # Check if the expected detail is present in the actual detail
@@ -122,7 +122,7 @@ class TestAdvancedAuthScenarios:
 
     @pytest.mark.asyncio
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_validation_with_minimally_valid_token(self, mock_verify_jwt, test_db):
+    async def test_validation_with_minimally_valid_token(self, mock_verify_jwt, test_db, async_test_db):
         """Test user creation with a token containing minimal valid data"""
         # Set up mock with precise minimum valid data
         mock_verify_jwt.return_value = {
@@ -136,7 +136,7 @@ class TestAdvancedAuthScenarios:
         mock_credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid.jwt.token")
         
         # Should succeed with minimally valid data
-        user = await get_current_user(mock_credentials, test_db)
+        user = await get_current_user(mock_credentials, async_test_db)
         assert user is not None
         assert user.email == "minimal@example.com"
         assert user.first_name == "A"
@@ -179,7 +179,7 @@ class TestAdvancedAuthScenarios:
     
     @pytest.mark.asyncio
     @patch('services.auth_service.get_current_user')
-    async def test_get_booking_with_permission_check_complex(self, mock_get_current_user, test_db):
+    async def test_get_booking_with_permission_check_complex(self, mock_get_current_user, async_test_db):
         """Test complex permission scenarios with booking access"""
         # Create test users
         admin = User(
@@ -224,23 +224,22 @@ class TestAdvancedAuthScenarios:
             total_cost=Decimal('100.00')
         )
         
-        with patch.object(test_db, 'query') as mock_query:
-            mock_query.return_value.filter.return_value.first.return_value = booking
+        with patch.object(async_test_db, 'scalar', return_value=booking):
             
             # Admin should have access
             mock_get_current_user.return_value = admin
-            result1 = await get_booking_with_permission_check(booking.id, test_db, admin)
+            result1 = await get_booking_with_permission_check(booking.id, async_test_db, admin)
             assert result1.id == booking.id
             
             # Owner should have access
             mock_get_current_user.return_value = owner
-            result2 = await get_booking_with_permission_check(booking.id, test_db, owner)
+            result2 = await get_booking_with_permission_check(booking.id, async_test_db, owner)
             assert result2.id == booking.id
             
             # Other user should be denied
             mock_get_current_user.return_value = other_user
             with pytest.raises(HTTPException) as exc_info:
-                await get_booking_with_permission_check(booking.id, test_db, other_user)
+                await get_booking_with_permission_check(booking.id, async_test_db, other_user)
             
             assert exc_info.value.status_code == 403
             assert "You can only access your own bookings" in exc_info.value.detail
@@ -271,10 +270,13 @@ class TestAdvancedAuthScenarios:
 
         async def auth_attempt():
             db_mock = MagicMock()
-            db_mock.query.return_value.filter.return_value.first.return_value = None
-            db_mock.add = MagicMock()
-            db_mock.commit = MagicMock()
-            db_mock.refresh = MagicMock()
+            db_mock.scalar = AsyncMock(return_value=None)
+            # The upsert returns the created user and whether it was inserted
+            db_mock.execute = AsyncMock(return_value=MagicMock())
+            db_mock.execute.return_value.one.return_value = (
+                User(cognito_id="test-user", email="test@example.com"), True
+            )
+            db_mock.commit = AsyncMock()
 
             # Remove the patch context manager for get_db
             # with patch('services.auth_service.get_db', return_value=db_mock):
@@ -331,10 +333,13 @@ class TestAdvancedAuthScenarios:
         # Now define the helper functions that use them
         def create_db_mock():
             db_mock = MagicMock()
-            db_mock.query.return_value.filter.return_value.first.return_value = None
-            db_mock.add = MagicMock()
-            db_mock.commit = MagicMock()
-            db_mock.refresh = MagicMock()
+            db_mock.scalar = AsyncMock(return_value=None)
+            # The upsert returns the created user and whether it was inserted
+            db_mock.execute = AsyncMock(return_value=MagicMock())
+            db_mock.execute.return_value.one.return_value = (
+                User(cognito_id="test-user", email="test@example.com"), True
+            )
+            db_mock.commit = AsyncMock()
             return db_mock
 
         async def success_attempt():
@@ -385,11 +390,11 @@ class TestAdvancedAuthScenarios:
 
     @patch('services.cognito_service.jwt.get_unverified_header')  
     @patch('services.cognito_service.jwt.decode')
-    @patch('services.cognito_service.PyJWKClient')
+    @patch('services.cognito_service.jwks_key_cache')
     def test_verify_cognito_jwt_invalid(self, mock_jwk_client, mock_jwt_decode, test_db):
         """Test JWT verification with an invalid token"""
         # Mock JWT verification to fail
-        mock_jwk_client.return_value.get_signing_key_from_jwt.side_effect = jwt.exceptions.PyJWTError("Invalid token")
+        mock_jwk_client.get_signing_key_from_jwt.side_effect = jwt.exceptions.PyJWTError("Invalid token")
         
         # Verify invalid JWT should raise InvalidTokenException
         with pytest.raises(InvalidTokenException) as exc_info:
@@ -399,12 +404,12 @@ class TestAdvancedAuthScenarios:
         assert "Invalid or expired token" in str(exc_info.value)
         
         # Verify JWT verification was called correctly
-        mock_jwk_client.return_value.get_signing_key_from_jwt.assert_called_once_with("invalid.jwt.token")
+        mock_jwk_client.get_signing_key_from_jwt.assert_called_once_with("invalid.jwt.token")
         mock_jwt_decode.assert_not_called()
 
     @pytest.mark.asyncio
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_get_current_user_existing_user(self, mock_verify_jwt, test_db, test_data):
+    async def test_get_current_user_existing_user(self, mock_verify_jwt, async_test_db, test_data):
         """Test getting existing user from token"""
         # Mock JWT verification to return a payload with matching cognito_id
         existing_user = test_data["users"][0]
@@ -417,7 +422,7 @@ class TestAdvancedAuthScenarios:
         mock_credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid.jwt.token")
         
         # Get current user
-        user = await get_current_user(mock_credentials, test_db)
+        user = await get_current_user(mock_credentials, async_test_db)
         
         # Assert returned user matches existing user
         assert user.id == existing_user.id
@@ -429,7 +434,7 @@ class TestAdvancedAuthScenarios:
 
     @pytest.mark.asyncio
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_get_current_user_new_user(self, mock_verify_jwt, test_db):
+    async def test_get_current_user_new_user(self, mock_verify_jwt, test_db, async_test_db):
         """Test auto-creation of new user from token"""
         # Mock JWT verification to return a payload with new cognito_id
         mock_verify_jwt.return_value = {
@@ -448,7 +453,7 @@ class TestAdvancedAuthScenarios:
         assert existing_user is None
         
         # Get current user (should create new user)
-        user = await get_current_user(mock_credentials, test_db)
+        user = await get_current_user(mock_credentials, async_test_db)
         
         # Assert new user was created with correct details
         assert user.cognito_id == "new-cognito-id"
@@ -466,7 +471,7 @@ class TestAdvancedAuthScenarios:
 
     @pytest.mark.asyncio
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_get_current_user_missing_email(self, mock_verify_jwt, test_db):
+    async def test_get_current_user_missing_email(self, mock_verify_jwt, async_test_db):
         """Test error when token doesn't contain required fields"""
         # Mock JWT verification to return a payload without email
         mock_verify_jwt.return_value = {
@@ -479,7 +484,7 @@ class TestAdvancedAuthScenarios:
         
         # Getting current user should fail
         with pytest.raises(HTTPException) as exc_info:
-            await get_current_user(mock_credentials, test_db)
+            await get_current_user(mock_credentials, async_test_db)
         
         # Check exception details
         assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
@@ -491,7 +496,7 @@ class TestAdvancedAuthScenarios:
 
     @pytest.mark.asyncio
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_get_current_user_missing_sub(self, mock_verify_jwt, test_db):
+    async def test_get_current_user_missing_sub(self, mock_verify_jwt, async_test_db):
         """Test error when token is missing the 'sub' (user identifier) claim"""
         mock_verify_jwt.return_value = {
             # No 'sub' field
@@ -502,12 +507,12 @@ class TestAdvancedAuthScenarios:
         }
         mock_credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid.jwt.token")
         with pytest.raises(Exception) as exc_info:
-            await get_current_user(mock_credentials, test_db)
+            await get_current_user(mock_credentials, async_test_db)
         assert "Missing user identifier" in str(exc_info.value)
 
     @pytest.mark.asyncio
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_get_current_user_incomplete_user_data(self, mock_verify_jwt, test_db):
+    async def test_get_current_user_incomplete_user_data(self, mock_verify_jwt, async_test_db):
         """Test error when token is missing required user fields for new user creation"""
         # Missing first_name
         mock_verify_jwt.return_value = {
@@ -518,7 +523,7 @@ class TestAdvancedAuthScenarios:
         }
         mock_credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid.jwt.token")
         with pytest.raises(Exception) as exc_info:
-            await get_current_user(mock_credentials, test_db)
+            await get_current_user(mock_credentials, async_test_db)
         assert "first_name is missing or invalid" in str(exc_info.value)
 
         # Missing last_name
@@ -529,7 +534,7 @@ class TestAdvancedAuthScenarios:
             'phone_number': '+1234567890'
         }
         with pytest.raises(Exception) as exc_info:
-            await get_current_user(mock_credentials, test_db)
+            await get_current_user(mock_credentials, async_test_db)
         assert "last_name is missing or invalid" in str(exc_info.value)
 
         # Missing phone_number
@@ -540,13 +545,13 @@ class TestAdvancedAuthScenarios:
             'family_name': 'User'
         }
         with pytest.raises(Exception) as exc_info:
-            await get_current_user(mock_credentials, test_db)
+            await get_current_user(mock_credentials, async_test_db)
         assert "phone_number is missing or invalid" in str(exc_info.value)
 
     @pytest.mark.asyncio
     @patch('services.auth_service.logger')
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_get_current_user_authentication_failed(self, mock_verify_jwt, mock_logger, test_db):
+    async def test_get_current_user_authentication_failed(self, mock_verify_jwt, mock_logger, async_test_db):
         """Test generic authentication failure (unexpected error)"""
         error_message = "Unexpected error"
         mock_verify_jwt.side_effect = Exception(error_message)
@@ -554,7 +559,7 @@ class TestAdvancedAuthScenarios:
 
         # Expect HTTPException 500
         with pytest.raises(HTTPException) as exc_info:
-            await get_current_user(mock_credentials, test_db)
+            await get_current_user(mock_credentials, async_test_db)
 
         # Assert status code 500 and detail
         assert exc_info.value.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -568,10 +573,10 @@ class TestAdvancedAuthScenarios:
         assert kwargs.get('exc_info') is True
 
     @patch('services.cognito_service.jwt.decode')
-    @patch('services.cognito_service.PyJWKClient')
+    @patch('services.cognito_service.jwks_key_cache')
     def test_verify_cognito_jwt_config_error(self, mock_jwk_client, mock_jwt_decode, test_db):
         """Test Cognito config/issuer error during JWT verification"""
-        mock_jwk_client.side_effect = Exception("Config error")
+        mock_jwk_client.get_signing_key_from_jwt.side_effect = Exception("Config error")
         with pytest.raises(InvalidTokenException) as exc_info:
             verify_cognito_jwt("any.jwt.token")
         assert "Invalid or expired token" in str(exc_info.value)
@@ -625,7 +630,7 @@ class TestAdvancedAuthScenarios:
 
     @pytest.mark.asyncio
     @patch('services.auth_service.verify_cognito_jwt')
-    async def test_cognito_jwt_missing_sub_raises_exception(self, mock_verify_jwt, test_db):
+    async def test_cognito_jwt_missing_sub_raises_exception(self, mock_verify_jwt, async_test_db):
         """Test that a Cognito JWT missing the 'sub' claim raises the correct exception."""
         mock_verify_jwt.return_value = {
             'email': 'user@example.com',
@@ -636,7 +641,7 @@ class TestAdvancedAuthScenarios:
         mock_credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid.jwt.token")
         
         with pytest.raises(HTTPException) as exc_info:
-            await get_current_user(mock_credentials, test_db)
+            await get_current_user(mock_credentials, async_test_db)
         
         # Should be HTTP 401 Unauthorized
         assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
@@ -651,11 +656,11 @@ class TestAdvancedAuthScenarios:
 class TestCognitoServiceEdgeCases:
     """Tests for edge cases in Cognito service"""
     
-    @mock.patch('services.cognito_service.PyJWKClient')
+    @mock.patch('services.cognito_service.jwks_key_cache')
     def test_jwks_client_error_with_message(self, mock_jwk_client):
         """Test handling of PyJWKClientError with specific error message"""
         # Arrange: Mock JWKS client to raise specific error
-        mock_jwk_client.return_value.get_signing_key_from_jwt.side_effect = jwt.exceptions.PyJWKClientError("JWKS endpoint not found")
+        mock_jwk_client.get_signing_key_from_jwt.side_effect = jwt.exceptions.PyJWKClientError("JWKS endpoint not found")
         
         # Act & Assert
         with pytest.raises(InvalidTokenException) as excinfo:
@@ -663,13 +668,13 @@ class TestCognitoServiceEdgeCases:
         
         assert "Invalid or expired token" in str(excinfo.value)
     
-    @mock.patch('services.cognito_service.PyJWKClient')
+    @mock.patch('services.cognito_service.jwks_key_cache')
     def test_jwt_decode_error(self, mock_jwk_client):
         """Test handling of JWT decode errors"""
         # Arrange: Mock JWKS client to succeed but JWT decode to fail
         mock_signing_key = Mock()
         mock_signing_key.key = "fake-key"
-        mock_jwk_client.return_value.get_signing_key_from_jwt.return_value = mock_signing_key
+        mock_jwk_client.get_signing_key_from_jwt.return_value = mock_signing_key
         
         # Mock jwt.decode to raise an exception
         with mock.patch('services.cognito_service.jwt.decode', side_effect=jwt.InvalidTokenError("Invalid token")):
@@ -679,7 +684,7 @@ class TestCognitoServiceEdgeCases:
             
             assert "Invalid or expired token" in str(excinfo.value)
     
-    @mock.patch('services.cognito_service.PyJWKClient')
+    @mock.patch('services.cognito_service.jwks_key_cache')
     def test_jwt_get_unverified_header_error(self, mock_jwk_client):
         """Test handling of errors when getting unverified header"""
         # Arrange: Mock jwt.get_unverified_header to raise an exception
@@ -690,11 +695,11 @@ class TestCognitoServiceEdgeCases:
             
             assert "Invalid or expired token" in str(excinfo.value)
     
-    @mock.patch('services.cognito_service.PyJWKClient')
-    def test_jwks_client_creation_error(self, mock_jwk_client):
-        """Test handling of errors when creating JWKS client"""
-        # Arrange: Mock PyJWKClient constructor to raise an exception
-        mock_jwk_client.side_effect = Exception("JWKS client creation failed")
+    @mock.patch('services.cognito_service.jwks_key_cache')
+    def test_jwks_fetch_error(self, mock_jwk_client):
+        """Test handling of errors when the JWKS cannot be fetched"""
+        # Arrange: Mock the key cache to fail like an unreachable JWKS endpoint
+        mock_jwk_client.get_signing_key_from_jwt.side_effect = Exception("JWKS fetch failed")
         
         # Act & Assert
         with pytest.raises(InvalidTokenException) as excinfo:
@@ -740,11 +745,11 @@ class TestCognitoServiceEdgeCases:
         
         assert "Missing required environment variable: COGNITO_CLIENT_ID" in str(excinfo.value)
     
-    @mock.patch('services.cognito_service.PyJWKClient')
+    @mock.patch('services.cognito_service.jwks_key_cache')
     def test_generic_exception_in_verify_cognito_jwt(self, mock_jwk_client):
         """Test handling of generic exceptions in verify_cognito_jwt"""
-        # Arrange: Mock PyJWKClient to raise a generic exception
-        mock_jwk_client.side_effect = Exception("Unexpected error")
+        # Arrange: Mock the key cache to raise a generic exception
+        mock_jwk_client.get_signing_key_from_jwt.side_effect = Exception("Unexpected error")
         
         # Act & Assert
         with pytest.raises(InvalidTokenException) as excinfo:
@@ -752,4 +757,402 @@ class TestCognitoServiceEdgeCases:
         
         # Should raise InvalidTokenException without specific message
         assert isinstance(excinfo.value, InvalidTokenException)
-       
\ No newline at end of file
+       
+
+class TestJwksKeyCache:
+    """Tests for the process-wide Cognito signing key cache"""
+    
+    @pytest.fixture
+    def key_cache(self):
+        from services.cognito_service import JwksKeyCache
+        
+        cache = JwksKeyCache("https://example.com/jwks.json", ttl_seconds=3600, min_refetch_interval_seconds=60)
+        cache._client = MagicMock()
+        cache._client.get_signing_keys.return_value = [Mock(key_id="kid-1"), Mock(key_id="kid-2")]
+        return cache
+    
+    def test_keys_fetched_once(self, key_cache):
+        """Test that known kids are served from the cache"""
+        assert key_cache.get_signing_key("kid-1").key_id == "kid-1"
+        assert key_cache.get_signing_key("kid-2").key_id == "kid-2"
+        assert key_cache.get_signing_key("kid-1").key_id == "kid-1"
+        
+        key_cache._client.get_signing_keys.assert_called_once()
+    
+    def test_unknown_kid_refetches_keys(self, key_cache):
+        """Test that an unknown kid refetches the keys, e.g. after a key rotation"""
+        key_cache.get_signing_key("kid-1")
+        key_cache._last_fetch_attempt -= 60
+        key_cache._client.get_signing_keys.return_value = [Mock(key_id="kid-3")]
+        
+        assert key_cache.get_signing_key("kid-3").key_id == "kid-3"
+        assert key_cache._client.get_signing_keys.call_count == 2
+    
+    def test_unknown_kid_refetch_is_rate_limited(self, key_cache):
+        """Test that tokens with unknown kids cannot trigger a fetch on every request"""
+        key_cache.get_signing_key("kid-1")
+        
+        for _ in range(3):
+            with pytest.raises(jwt.exceptions.PyJWKClientError):
+                key_cache.get_signing_key("unknown-kid")
+        
+        key_cache._client.get_signing_keys.assert_called_once()
+    
+    def test_expired_keys_refetched(self, key_cache):
+        """Test that the keys are fetched again after the TTL"""
+        key_cache.get_signing_key("kid-1")
+        key_cache._fetched_at -= 3600
+        
+        key_cache.get_signing_key("kid-1")
+        
+        assert key_cache._client.get_signing_keys.call_count == 2
+    
+    def test_failed_refresh_keeps_cached_keys(self, key_cache):
+        """Test that the known keys are still used if the JWKS endpoint is down"""
+        key_cache.get_signing_key("kid-1")
+        key_cache._client.get_signing_keys.side_effect = Exception("JWKS endpoint down")
+        
+        key_cache.refresh()
+        
+        assert key_cache.get_signing_key("kid-2").key_id == "kid-2"
+    
+    def test_failed_first_fetch_raises(self, key_cache):
+        """Test that the error is raised if there are no cached keys to fall back to"""
+        key_cache._client.get_signing_keys.side_effect = Exception("JWKS endpoint down")
+        
+        with pytest.raises(Exception, match="JWKS endpoint down"):
+            key_cache.get_signing_key("kid-1")
+
+
+class TestVerifiedTokenCache:
+    """Tests for the LRU of verified token payloads"""
+    
+    @pytest.fixture
+    def token_cache(self):
+        from services.cognito_service import VerifiedTokenCache
+        
+        return VerifiedTokenCache(max_size=2)
+    
+    def test_cached_payload_returned(self, token_cache):
+        """Test that a verified token is served from the cache until it expires"""
+        payload = {"sub": "user-1", "exp": time_func() + 3600}
+        token_cache.set("token-1", payload)
+        
+        assert token_cache.get("token-1") == payload
+        assert token_cache.get("token-2") is None
+    
+    def test_expired_token_not_returned(self, token_cache):
+        """Test that entries expire together with the token"""
+        token_cache.set("token-1", {"sub": "user-1", "exp": time_func() - 1})
+        
+        assert token_cache.get("token-1") is None
+    
+    def test_payload_without_exp_not_cached(self, token_cache):
+        """Test that tokens without expiry are always verified"""
+        token_cache.set("token-1", {"sub": "user-1"})
+        
+        assert token_cache.get("token-1") is None
+    
+    def test_least_recently_used_evicted(self, token_cache):
+        """Test that the cache is bounded and evicts the least recently used token"""
+        exp = time_func() + 3600
+        token_cache.set("token-1", {"sub": "user-1", "exp": exp})
+        token_cache.set("token-2", {"sub": "user-2", "exp": exp})
+        token_cache.get("token-1")
+        token_cache.set("token-3", {"sub": "user-3", "exp": exp})
+        
+        assert token_cache.get("token-1") is not None
+        assert token_cache.get("token-2") is None
+        assert token_cache.get("token-3") is not None
+    
+    def test_cached_payload_cannot_be_modified(self, token_cache):
+        """Test that callers get a copy of the cached payload"""
+        token_cache.set("token-1", {"sub": "user-1", "exp": time_func() + 3600})
+        
+        token_cache.get("token-1")["sub"] = "someone-else"
+        
+        assert token_cache.get("token-1")["sub"] == "user-1"
+    
+    @patch('services.cognito_service.jwt.get_unverified_header')
+    @patch('services.cognito_service.jwt.decode')
+    @patch('services.cognito_service.jwks_key_cache')
+    def test_repeat_verification_skips_signature_check(self, mock_jwk_client, mock_jwt_decode, mock_header, token_cache):
+        """Test that verify_cognito_jwt only verifies a token once"""
+        mock_header.return_value = {"kid": "kid-1", "alg": "RS256"}
+        mock_jwt_decode.return_value = {"sub": "user-1", "exp": time_func() + 3600}
+        
+        with patch('services.cognito_service.verified_token_cache', token_cache):
+            first = verify_cognito_jwt("header.payload.signature")
+            second = verify_cognito_jwt("header.payload.signature")
+        
+        assert first == second
+        mock_jwt_decode.assert_called_once()
+        mock_jwk_client.get_signing_key_from_jwt.assert_called_once()
+
+
+class TestUserIdentityCache:
+    """Tests for the cognito_id to user cache used by get_current_user"""
+    
+    @pytest.fixture
+    def user(self):
+        return User(
+            id=1,
+            first_name="Test",
+            last_name="User",
+            email="test@example.com",
+            phone_number="+1234567890",
+            cognito_id="cognito-1",
+            role=UserRole.USER
+        )
+    
+    def test_cached_user_returned_until_ttl(self, user):
+        """Test that a cached user is rebuilt from its values and expires after the TTL"""
+        from services.auth_service import UserIdentityCache
+        
+        cache = UserIdentityCache(ttl_seconds=60, max_size=10)
+        cache.set(user, cache.get_generation())
+        
+        cached = cache.get("cognito-1")
+        assert cached is not user
+        assert (cached.id, cached.email, cached.role) == (1, "test@example.com", UserRole.USER)
+        
+        with patch('services.auth_service.time.monotonic', return_value=time_func() + 10**9):
+            assert cache.get("cognito-1") is None
+    
+    def test_invalidate_removes_user(self, user):
+        """Test that invalidated users are loaded again"""
+        from services.auth_service import UserIdentityCache
+        
+        cache = UserIdentityCache(ttl_seconds=60, max_size=10)
+        cache.set(user, cache.get_generation())
+        cache.invalidate("cognito-1")
+        
+        assert cache.get("cognito-1") is None
+    
+    def test_user_loaded_before_invalidation_not_cached(self, user):
+        """Test that a user loaded while it was invalidated is not cached with outdated values"""
+        from services.auth_service import UserIdentityCache
+        
+        cache = UserIdentityCache(ttl_seconds=60, max_size=10)
+        generation = cache.get_generation()
+        cache.invalidate("cognito-1")
+        cache.set(user, generation)
+        
+        assert cache.get("cognito-1") is None
+    
+    def test_invalidation_shared_between_workers(self, user, tmp_path):
+        """Test that an invalidation in one worker clears the cache of the others"""
+        from services.auth_service import SharedCacheGeneration, UserIdentityCache
+        
+        path = str(tmp_path / "user-cache-generation")
+        worker1 = UserIdentityCache(ttl_seconds=60, max_size=10, shared_generation=SharedCacheGeneration(path))
+        worker2 = UserIdentityCache(ttl_seconds=60, max_size=10, shared_generation=SharedCacheGeneration(path))
+        worker1.set(user, worker1.get_generation())
+        
+        worker2.invalidate("cognito-1")
+        
+        assert worker1.get("cognito-1") is None
+    
+    @pytest.mark.asyncio
+    @patch('services.auth_service.verify_cognito_jwt')
+    async def test_get_current_user_skips_lookup_when_cached(self, mock_verify_jwt, user):
+        """Test that repeat requests of a user don't query the database"""
+        mock_verify_jwt.return_value = {"sub": "cognito-1", "email": "test@example.com"}
+        mock_db = MagicMock()
+        mock_db.scalar = AsyncMock(return_value=user)
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid.jwt.token")
+        
+        first = await get_current_user(credentials, mock_db)
+        second = await get_current_user(credentials, mock_db)
+        
+        assert first.id == second.id == 1
+        mock_db.scalar.assert_awaited_once()
+
+
+class TestOfflineJwks:
+    """Tests for verifying tokens of the local issuer against a JWKS file"""
+    
+    @pytest.fixture
+    def local_issuer(self, tmp_path):
+        with patch.dict("os.environ"):
+            import local_token_issuer
+        
+        key_file = str(tmp_path / "key.pem")
+        jwks_file = str(tmp_path / "jwks.json")
+        local_token_issuer.generate_signing_key(key_file, jwks_file)
+        private_key, kid = local_token_issuer.load_signing_key(key_file, jwks_file)
+        return local_token_issuer, private_key, kid, jwks_file
+    
+    def test_local_token_verified(self, local_issuer):
+        """Test that tokens of the local issuer pass the regular verification"""
+        from services.cognito_service import JwksKeyCache
+        
+        issuer, private_key, kid, jwks_file = local_issuer
+        token = issuer.issue_token(private_key, kid, "cognito-1", "test@example.com", groups=["admin"])
+        
+        with patch('services.cognito_service.jwks_key_cache', JwksKeyCache(jwks_file=jwks_file)):
+            payload = verify_cognito_jwt(token)
+        
+        assert payload["sub"] == "cognito-1"
+        assert payload["email"] == "test@example.com"
+        assert payload["cognito:groups"] == ["admin"]
+    
+    def test_local_tokens_of_different_users_have_different_phone_numbers(self, local_issuer):
+        """Test that auto-provisioned local users don't collide on the unique phone number"""
+        issuer, private_key, kid, _ = local_issuer
+        
+        def phone_number(sub):
+            token = issuer.issue_token(private_key, kid, sub, f"{sub}@example.com")
+            return jwt.decode(token, options={"verify_signature": False})["phone_number"]
+        
+        assert phone_number("cognito-1") == phone_number("cognito-1")
+        assert phone_number("cognito-1") != phone_number("cognito-2")
+    
+    def test_local_token_with_other_key_rejected(self, local_issuer, tmp_path):
+        """Test that the signature is checked against the keys in the JWKS file"""
+        from services.cognito_service import JwksKeyCache
+        
+        issuer, _, kid, jwks_file = local_issuer
+        issuer.generate_signing_key(str(tmp_path / "other.pem"), str(tmp_path / "other.json"))
+        other_key, _ = issuer.load_signing_key(str(tmp_path / "other.pem"), str(tmp_path / "other.json"))
+        token = issuer.issue_token(other_key, kid, "cognito-1", "test@example.com")
+        
+        with patch('services.cognito_service.jwks_key_cache', JwksKeyCache(jwks_file=jwks_file)):
+            with pytest.raises(InvalidTokenException):
+                verify_cognito_jwt(token)
+    
+    def test_missing_jwks_file(self, tmp_path):
+        """Test that a missing JWKS file is reported as a JWKS error"""
+        from services.cognito_service import JwksKeyCache
+        
+        key_cache = JwksKeyCache(jwks_file=str(tmp_path / "missing.json"))
+        
+        with pytest.raises(jwt.exceptions.PyJWKClientError):
+            key_cache.get_signing_key("kid-1")
+
+
+class TestTokenRoles:
+    """Tests for resolving roles from the Cognito groups of the token"""
+    
+    def test_parse_group_roles(self):
+        """Test parsing of the group to role mapping"""
+        from services.auth_service import parse_group_roles
+        
+        assert parse_group_roles("") == {}
+        assert parse_group_roles("admin:ADMIN, staff:admin,customers:USER") == {
+            "admin": UserRole.ADMIN,
+            "staff": UserRole.ADMIN,
+            "customers": UserRole.USER
+        }
+    
+    def test_parse_group_roles_invalid_role(self):
+        """Test that unknown roles are rejected as configuration errors"""
+        from services.auth_service import parse_group_roles
+        
+        with pytest.raises(ConfigurationError):
+            parse_group_roles("admin:SUPERUSER")
+    
+    @pytest.mark.parametrize("groups,expected_role", [
+        (None, UserRole.USER),
+        (["unmapped"], UserRole.USER),
+        (["customers"], UserRole.USER),
+        (["customers", "admin"], UserRole.ADMIN),
+    ])
+    def test_resolve_token_role(self, groups, expected_role):
+        """Test that the most privileged mapped group wins"""
+        from services.auth_service import resolve_token_role
+        
+        payload = {"sub": "cognito-1"}
+        if groups is not None:
+            payload["cognito:groups"] = groups
+        
+        with patch('services.auth_service.COGNITO_GROUP_ROLES', {"admin": UserRole.ADMIN, "customers": UserRole.USER}):
+            assert resolve_token_role(payload) == expected_role
+    
+    @pytest.mark.asyncio
+    @patch('services.auth_service.verify_cognito_jwt')
+    async def test_require_role_from_token(self, mock_verify_jwt):
+        """Test that require_role checks the token role without loading the user"""
+        from services.auth_service import get_token_role
+        
+        mock_verify_jwt.return_value = {"sub": "cognito-1", "cognito:groups": ["admin"]}
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid.jwt.token")
+        
+        with patch('services.auth_service.COGNITO_GROUP_ROLES', {"admin": UserRole.ADMIN}):
+            admin_role_dependency = require_role([UserRole.ADMIN])
+            role = await get_token_role(credentials)
+            
+            assert role == UserRole.ADMIN
+            assert await admin_role_dependency(role) is True
+            with pytest.raises(HTTPException) as exc_info:
+                await admin_role_dependency(UserRole.USER)
+        
+        assert exc_info.value.status_code == status.HTTP_403_FORBIDDEN
+    
+    @pytest.mark.asyncio
+    @patch('services.auth_service.verify_cognito_jwt')
+    async def test_get_token_role_invalid_token(self, mock_verify_jwt):
+        """Test that invalid tokens are rejected when only the role is resolved"""
+        from services.auth_service import get_token_role
+        
+        mock_verify_jwt.side_effect = jwt.ExpiredSignatureError("Expired")
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="expired.jwt.token")
+        
+        with pytest.raises(HTTPException) as exc_info:
+            await get_token_role(credentials)
+        
+        assert exc_info.value.status_code == status.HTTP_401_UNAUTHORIZED
+    
+    @pytest.mark.asyncio
+    @patch('services.auth_service.verify_cognito_jwt')
+    async def test_get_current_user_keeps_stored_role(self, mock_verify_jwt):
+        """Test that a token without a mapped group doesn't change the role stored in the database"""
+        user = User(id=1, cognito_id="cognito-1", role=UserRole.ADMIN)
+        user_identity_cache.set(user, user_identity_cache.get_generation())
+        mock_verify_jwt.return_value = {"sub": "cognito-1"}
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid.jwt.token")
+        mock_db = AsyncMock()
+        
+        with patch('services.auth_service.COGNITO_GROUP_ROLES', {"admin": UserRole.ADMIN}):
+            result = await get_current_user(credentials, mock_db)
+        
+        assert result.role == UserRole.ADMIN
+        mock_db.execute.assert_not_called()
+        mock_db.commit.assert_not_called()
+
+
+class TestVerifyTokenOffLoop:
+    """Tests for verifying tokens outside of the event loop thread"""
+    
+    @pytest.mark.asyncio
+    @patch('services.auth_service.verify_cognito_jwt')
+    async def test_uncached_token_verified_in_thread(self, mock_verify_jwt):
+        """Test that the blocking verification doesn't run on the event loop thread"""
+        import threading
+        from services.auth_service import verify_token
+        
+        loop_thread = threading.get_ident()
+        verify_threads = []
+        def verify(token):
+            verify_threads.append(threading.get_ident())
+            return {"sub": "cognito-1"}
+        mock_verify_jwt.side_effect = verify
+        
+        payload = await verify_token("valid.jwt.token")
+        
+        assert payload == {"sub": "cognito-1"}
+        assert verify_threads and verify_threads[0] != loop_thread
+    
+    @pytest.mark.asyncio
+    @patch('services.auth_service.verify_cognito_jwt')
+    async def test_cached_token_not_verified_again(self, mock_verify_jwt):
+        """Test that cached tokens are returned without a thread hop"""
+        from services.auth_service import verify_token
+        from services.cognito_service import verified_token_cache
+        
+        verified_token_cache.set("valid.jwt.token", {"sub": "cognito-1", "exp": time_func() + 3600})
+        
+        payload = await verify_token("valid.jwt.token")
+        
+        assert payload["sub"] == "cognito-1"
+        mock_verify_jwt.assert_not_called()
@@ -22,7 +22,7 @@ class TestBookingPagination:
                 user_id=1 if i % 2 == 0 else 2,  # Alternate between users
                 car_id=((i - 5) % 2) + 1,  # Cycle through cars 1-2
                 start_date=today + timedelta(days=i),
-                end_date=today + timedelta(days=i + 5),
+                end_date=today + timedelta(days=i + 1),  # Bookings of a car must not overlap
                 planned_pickup_time=time(12, 0),
                 total_cost=Decimal("300.00"),
                 currency_code=Currency.USD,
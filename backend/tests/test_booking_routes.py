@@ -1,14 +1,19 @@
-from datetime import date, timedelta
+import asyncio
+from datetime import date, datetime, time, timedelta, timezone
 from decimal import Decimal
 from unittest import mock
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, patch
 
 import pytest
 from fastapi import status
 
+from exceptions.bookings import BookingOverlapException
 from exceptions.currencies import CurrencyServiceUnavailableException
 from main import app
-from models.db_models import Booking, BookingStatus
+from models.currencies import Currency
+from models.db_models import Booking, BookingStatus, ExchangeRate, ExchangeRateSnapshot
+from models.pydantic.booking import BookingCreate
+from services import booking_service
 from services.booking_service import get_car_price_in_currency
 
 def fixed_today(today):
@@ -27,7 +32,7 @@ class TestBookingCreation:
     """Tests related to creating bookings"""
     
     @patch('models.pydantic.booking.date')
-    @patch('services.booking_service.get_currency_converter_client_instance')
+    @patch('services.booking_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
     def test_create_valid_booking(self, mock_currency_client, mock_date, auth_client, test_data):
         """Test successfully creating a booking"""
         # Mock today's date
@@ -38,7 +43,7 @@ class TestBookingCreation:
         mock_date.side_effect = lambda *args, **kw: date(*args, **kw)
 
         # Mock currency client
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client.get_currency_rate.return_value = Decimal("1.00")
         mock_currency_client.return_value = mock_client
 
@@ -80,7 +85,7 @@ class TestBookingCreation:
         assert float(created_booking["total_cost"]) == expected_total
 
 
-    @patch('services.booking_service.get_currency_converter_client_instance')
+    @patch('services.booking_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
     @patch('models.pydantic.booking.date')
     def test_create_booking_currency_service_unavailable(self, mock_date, mock_currency_converter_client, auth_client, test_data):
         """Test creating a booking when currency service is unavailable"""
@@ -113,13 +118,13 @@ class TestBookingCreation:
         assert "Currency service is unavailable" in error["detail"]
 
     
-    @patch('services.booking_service.get_currency_converter_client_instance')
+    @patch('services.booking_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
     def test_create_booking_car_not_found(self, mock_currency_client, auth_client):
         """Test creating a booking with non-existent car ID"""
 
         with fixed_today(date(2025, 8, 9)):
             # Mock currency service to return valid rate
-            mock_client = Mock()
+            mock_client = AsyncMock()
             mock_client.get_currency_rate.return_value = 1.0
             mock_currency_client.return_value = mock_client
 
@@ -141,13 +146,13 @@ class TestBookingCreation:
             assert "Car with ID 999 not found" in error["detail"]
 
 
-    @patch('services.booking_service.get_currency_converter_client_instance')
+    @patch('services.booking_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
     def test_create_booking_unavailable_car(self, mock_currency_client, auth_client, test_data):
         """Test creating a booking for an unavailable car"""
         
         with fixed_today(date(2025, 8, 9)):
             # Mock currency service to return valid rate
-            mock_client = Mock()
+            mock_client = AsyncMock()
             mock_client.get_currency_rate.return_value = 1.0
             mock_currency_client.return_value = mock_client
 
@@ -221,13 +226,19 @@ class TestBookingCreation:
         assert "Start date must be tomorrow or later" in str(error)
 
     @patch('models.pydantic.booking.date')
-    def test_create_booking_overlapping_dates(self, mock_date, auth_client, test_data):
+    @patch('services.booking_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    def test_create_booking_overlapping_dates(self, mock_currency_client, mock_date, auth_client, test_data):
         """Test creating a booking with dates that overlap with existing booking"""        
         # Setup mock for date.today()
         mock_today = date(2024, 3, 29)
         mock_date.today.return_value = mock_today
         mock_date.side_effect = lambda *args, **kw: date(*args, **kw)
         
+        # The overlap is only found by the database, after the exchange rate lookup
+        mock_client = AsyncMock()
+        mock_client.get_currency_rate.return_value = Decimal("1.00")
+        mock_currency_client.return_value = mock_client
+        
         # Get existing booking dates
         existing_booking = test_data["bookings"][0]
         
@@ -347,11 +358,11 @@ class TestBookingCreation:
         assert "planned_pickup_time" in str(error)  # Field should be mentioned
         assert "invalid" in str(error).lower()  # Should mention invalid format
 
-    @mock.patch('services.booking_service.get_currency_converter_client_instance')
+    @mock.patch('services.booking_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
     def test_create_booking_with_currency(self, mock_get_client, auth_client, test_data):
         """Test creating a booking with a different currency"""
         # Create properly structured mock with nested client
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client.get_currency_rate.return_value = Decimal("0.85")
         
         mock_get_client.return_value = mock_client
@@ -382,6 +393,59 @@ class TestBookingCreation:
         # Verify the conversion was called correctly
         mock_client.get_currency_rate.assert_called_once_with("USD", "GBP")
 
+    @mock.patch('services.booking_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    def test_create_booking_uses_exchange_rate_snapshot(self, mock_get_client, auth_client, test_data, test_db):
+        """Test that a booking takes its rate from the latest snapshot without calling the converter"""
+        snapshot = ExchangeRateSnapshot(
+            fetched_at=datetime.now(timezone.utc),
+            rates=[
+                ExchangeRate(currency_code=Currency.USD, rate=Decimal("1.00000000")),
+                ExchangeRate(currency_code=Currency.GBP, rate=Decimal("0.76543210")),
+            ]
+        )
+        test_db.add(snapshot)
+        test_db.commit()
+        
+        request_data = {
+            "car_id": test_data["cars"][0].id,
+            "start_date": str(date.today() + timedelta(days=1)),
+            "end_date": str(date.today() + timedelta(days=3)),
+            "planned_pickup_time": "10:00:00",
+            "currency_code": "GBP"
+        }
+        
+        response = auth_client.post("/api/v1/bookings/", json=request_data)
+        
+        assert response.status_code == status.HTTP_201_CREATED
+        booking = response.json()
+        assert booking["exchange_rate"] == "0.76"
+        assert booking["exchange_rate_snapshot_id"] == snapshot.id
+        mock_get_client.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch('services.booking_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    async def test_concurrent_overlapping_bookings(self, mock_currency_client, test_data, test_async_session_local):
+        """Test that only one of two simultaneous requests for the same car and dates gets the car"""
+        mock_client = AsyncMock()
+        mock_client.get_currency_rate.return_value = Decimal("1.00")
+        mock_currency_client.return_value = mock_client
+        booking_data = BookingCreate(
+            car_id=test_data["cars"][0].id,
+            start_date=date.today() + timedelta(days=1),
+            end_date=date.today() + timedelta(days=3),
+            planned_pickup_time=time(10, 0),
+            currency_code=Currency.USD
+        )
+        
+        async def book(user):
+            async with test_async_session_local() as db:
+                return await booking_service.create_booking(booking_data, user.id, db)
+        
+        results = await asyncio.gather(*(book(user) for user in test_data["users"]), return_exceptions=True)
+        
+        assert len([result for result in results if isinstance(result, Booking)]) == 1
+        assert len([result for result in results if isinstance(result, BookingOverlapException)]) == 1
+
 
 class TestBookingDateUpdates:
     """Tests related to updating booking dates"""
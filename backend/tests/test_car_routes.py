@@ -1,10 +1,15 @@
-from decimal import Decimal
+import asyncio
+from decimal import ROUND_DOWN, Decimal
 from unittest import mock
-from unittest.mock import Mock
+from unittest.mock import AsyncMock, Mock
 
 from fastapi import status
+from sqlalchemy import text
 
 from exceptions.currencies import CurrencyServiceUnavailableException
+from models.currencies import Currency
+from models.db_models import Car
+from services.exchange_rate_service import fetch_exchange_rates, save_exchange_rate_snapshot
 
 
 class TestCarRetrieval:
@@ -62,12 +67,13 @@ class TestCarRetrieval:
         assert cars[0]["price_per_day"] == "50.00"
         assert cars[1]["price_per_day"] == "75.00"
 
-    @mock.patch('services.car_service.get_currency_converter_client_instance')
+    @mock.patch('services.car_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
     def test_get_all_cars_with_currency(self, mock_get_client, auth_client, test_data):
         """Test getting all cars with currency conversion"""
         # Create properly structured mock with nested client
-        mock_client = Mock()
-        mock_client.convert.side_effect = lambda from_curr, to_curr, amount: amount * 2
+        mock_client = AsyncMock()
+        mock_client.convert_many.side_effect = lambda from_curr, to_curr, amounts: [amount * 2 for amount in amounts]
+        mock_client.get_rate_age = Mock(return_value=12.5)
         
         mock_get_client.return_value = mock_client
         
@@ -91,11 +97,14 @@ class TestCarRetrieval:
         assert cars[0]["price_per_day"] == "100.00"
         assert cars[1]["price_per_day"] == "150.00"
         
-        assert mock_client.convert.call_count == 2
-        mock_client.convert.assert_any_call("USD", "EUR", Decimal("50.00"))
-        mock_client.convert.assert_any_call("USD", "EUR", Decimal("75.00"))
+        # The whole page is converted in a single call
+        mock_client.convert_many.assert_called_once_with("USD", "EUR", [Decimal("50.00"), Decimal("75.00")])
+        mock_client.convert.assert_not_called()
+        
+        # The age of the rate is reported so clients can tell stale prices apart
+        assert response.headers["X-Exchange-Rate-Age"] == "12"
 
-    @mock.patch('services.car_service.get_currency_converter_client_instance')
+    @mock.patch('services.car_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
     def test_get_all_cars_with_currency_service_unavailable(self, mock_client_instance, auth_client, test_data):
         """Test getting all cars when currency service is unavailable"""
         # Mock the client to raise an exception
@@ -123,6 +132,98 @@ class TestCarRetrieval:
         assert "detail" in error
         assert "Invalid currency code: INVALID" in error["detail"]
 
+    @mock.patch('services.car_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    def test_get_all_cars_sorted_and_filtered_by_converted_price(self, mock_get_client, auth_client, test_data, test_db):
+        """Test that converted prices from the latest snapshot are sorted and filtered in the database"""
+        save_exchange_rate_snapshot(test_db, {Currency.USD: Decimal("1"), Currency.JPY: Decimal("150.3333")})
+        
+        response = auth_client.get("/api/v1/cars/?currency_code=JPY&sort_by=price_per_day&sort_order=desc")
+        assert response.status_code == status.HTTP_200_OK
+        assert [car["price_per_day"] for car in response.json()["items"]] == ["11274.99", "7516.66"]
+        
+        response = auth_client.get("/api/v1/cars/?currency_code=JPY&max_price=8000")
+        assert response.status_code == status.HTTP_200_OK
+        response_data = response.json()
+        assert response_data["total"] == 1
+        assert response_data["items"][0]["price_per_day"] == "7516.66"
+        
+        # Prices come from the car_prices table, the converter is not needed
+        mock_get_client.assert_not_called()
+
+    @mock.patch('services.car_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    def test_price_filter_without_snapshot_uses_displayed_price(self, mock_get_client, auth_client, test_data):
+        """Test that without a snapshot the price filters compare the converted price rounded down like the listing"""
+        mock_client = AsyncMock()
+        mock_client.get_exchange_rates.return_value = {"JPY": Decimal("150.3333")}
+        mock_client.convert_many.side_effect = lambda from_curr, to_curr, amounts: [
+            (amount * Decimal("150.3333")).quantize(Decimal("0.01"), rounding=ROUND_DOWN) for amount in amounts
+        ]
+        mock_client.get_rate_age = Mock(return_value=12.5)
+        mock_get_client.return_value = mock_client
+        
+        # 50.00 USD is 7516.665 JPY unrounded, listed as 7516.66
+        response = auth_client.get("/api/v1/cars/?currency_code=JPY&max_price=7516.66")
+        assert response.status_code == status.HTTP_200_OK
+        assert [car["price_per_day"] for car in response.json()["items"]] == ["7516.66"]
+
+    @mock.patch('services.car_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    def test_cars_changed_after_snapshot_have_current_prices(self, mock_get_client, auth_client, test_data, test_db):
+        """Test that cars added or repriced after the car_prices rebuild are listed with their current price"""
+        save_exchange_rate_snapshot(test_db, {Currency.USD: Decimal("1"), Currency.JPY: Decimal("150.3333")})
+        
+        # Changes through the ORM update car_prices in the same flush
+        test_data["cars"][0].price_per_day = Decimal("100.00")
+        test_db.add(Car(name="TestCar3", model="Model3", price_per_day=Decimal("10.00"), is_available=True))
+        test_db.commit()
+        # Plain SQL leaves the car without a car_prices row
+        car_id = test_db.execute(text(
+            "INSERT INTO cars (name, model, price_per_day, is_available) "
+            "VALUES ('TestCar4', 'Model4', 20.00, true) RETURNING id"
+        )).scalar()
+        test_db.commit()
+        
+        response = auth_client.get("/api/v1/cars/?currency_code=JPY&sort_by=price_per_day")
+        assert response.status_code == status.HTTP_200_OK
+        assert [(car["name"], car["price_per_day"]) for car in response.json()["items"]] == [
+            ("TestCar3", "1503.33"), ("TestCar4", "3006.66"), ("TestCar2", "11274.99"), ("TestCar1", "15033.33")
+        ]
+        
+        response = auth_client.get(f"/api/v1/cars/{car_id}?currency_code=JPY")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["price_per_day"] == "3006.66"
+        mock_get_client.assert_not_called()
+
+    @mock.patch('services.car_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    @mock.patch('services.exchange_rate_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    def test_snapshot_leaves_out_currency_that_fails(self, mock_refresh_client, mock_get_client, auth_client, test_data, test_db):
+        """Test that a currency the provider cannot fetch is left out of the snapshot instead of failing it"""
+        async def get_exchange_rates(from_currency, to_currencies, refetch=False):
+            if to_currencies == [Currency.BGN.value]:
+                raise CurrencyServiceUnavailableException("BGN is missing from the feed")
+            return {to_currencies[0]: Decimal("150.3333") if to_currencies == [Currency.JPY.value] else Decimal("1")}
+        mock_refresh_client.return_value.get_exchange_rates.side_effect = get_exchange_rates
+        
+        rates = asyncio.run(fetch_exchange_rates())
+        assert Currency.BGN not in rates
+        assert len(rates) == len(Currency) - 1
+        save_exchange_rate_snapshot(test_db, rates)
+        
+        response = auth_client.get("/api/v1/cars/?currency_code=JPY")
+        assert response.status_code == status.HTTP_200_OK
+        assert [car["price_per_day"] for car in response.json()["items"]] == ["7516.66", "11274.99"]
+        mock_get_client.assert_not_called()
+        
+        # Without a rate in the snapshot the currency converter is asked instead
+        mock_client = AsyncMock()
+        mock_client.convert_many.side_effect = lambda from_curr, to_curr, amounts: [amount * 2 for amount in amounts]
+        mock_client.get_rate_age = Mock(return_value=12.5)
+        mock_get_client.return_value = mock_client
+        
+        response = auth_client.get("/api/v1/cars/?currency_code=BGN")
+        assert response.status_code == status.HTTP_200_OK
+        assert [car["price_per_day"] for car in response.json()["items"]] == ["100.00", "150.00"]
+        mock_client.convert_many.assert_called_once_with("USD", "BGN", [Decimal("50.00"), Decimal("75.00")])
+
     def test_get_car_by_id(self, auth_client, test_data):
         """Test getting a car by ID"""
         car_id = test_data["cars"][0].id
@@ -151,12 +252,13 @@ class TestCarRetrieval:
         car = response.json()
         assert car["price_per_day"] == "50.00"  # Should be in USD
 
-    @mock.patch('services.car_service.get_currency_converter_client_instance')
+    @mock.patch('services.car_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
     def test_get_car_by_id_with_currency(self, mock_get_client, auth_client, test_data):
         """Test getting a car by ID with currency conversion"""
         # Create mock client
-        mock_client = Mock()
+        mock_client = AsyncMock()
         mock_client.convert.return_value = Decimal("45.00")  # EUR value for USD 50.00
+        mock_client.get_rate_age = Mock(return_value=0.5)
         mock_get_client.return_value = mock_client
         
         car_id = test_data["cars"][0].id
@@ -171,8 +273,9 @@ class TestCarRetrieval:
         
         # Verify the convert method was called with correct parameters
         mock_client.convert.assert_called_once_with("USD", "EUR", Decimal("50.00"))
+        assert response.headers["X-Exchange-Rate-Age"] == "0"
 
-    @mock.patch('services.car_service.get_currency_converter_client_instance')
+    @mock.patch('services.car_service.get_async_currency_converter_client_instance', new_callable=AsyncMock)
     def test_get_car_by_id_with_currency_service_unavailable(self, mock_client_instance, auth_client, test_data):
         mock_client_instance.side_effect = CurrencyServiceUnavailableException("Currency service unavailable")
         
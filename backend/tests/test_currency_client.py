@@ -0,0 +1,555 @@
+import asyncio
+import time
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from zeep.cache import SqliteCache
+
+import currency_converter.async_client as async_client
+from currency_converter.async_client import (
+    AsyncCurrencyConverterClient,
+    AsyncSoapRateProvider,
+    get_async_currency_converter_client_instance,
+)
+from currency_converter.circuit_breaker import CircuitBreaker, CircuitState
+from currency_converter.client import (
+    CurrencyConverterClient,
+    ExchangeRateCache,
+    JwtTokenManager,
+    RateProvider,
+    SoapRateProvider,
+    currency_converter_circuit_breaker,
+    get_currency_converter_client_instance,
+    get_wsdl_cache,
+)
+from currency_converter.ecb_provider import EcbXmlRateProvider, parse_ecb_rates
+from currency_converter.rate_matrix import CrossRateMatrix
+from currency_converter.shared_rates import AsyncSharedRateProvider, SharedRateProvider, SharedRateTable
+from exceptions.currencies import CurrencyServiceUnavailableException
+from main import app
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breaker():
+    # Failures recorded by one test must not open the shared circuit for the next one
+    currency_converter_circuit_breaker.reset()
+    yield
+    currency_converter_circuit_breaker.reset()
+
+
+class TestExchangeRateCache:
+    """Tests for the in-memory exchange rate table"""
+
+    def test_rate_is_fetched_once(self):
+        fetch_rate = Mock(return_value=Decimal("1.10"))
+        cache = ExchangeRateCache(fetch_rate, ttl_seconds=60)
+
+        assert cache.get_rate("USD") == Decimal("1.10")
+        assert cache.get_rate("USD") == Decimal("1.10")
+
+        fetch_rate.assert_called_once_with("USD")
+
+    def test_base_currency_is_never_fetched(self):
+        fetch_rate = Mock()
+        cache = ExchangeRateCache(fetch_rate, ttl_seconds=60)
+
+        assert cache.get_rate("EUR") == Decimal(1)
+        fetch_rate.assert_not_called()
+
+    def test_expired_rate_is_fetched_again(self):
+        fetch_rate = Mock(side_effect=[Decimal("1.10"), Decimal("1.20")])
+        cache = ExchangeRateCache(fetch_rate, ttl_seconds=0)
+
+        assert cache.get_rate("USD") == Decimal("1.10")
+        assert cache.get_rate("USD") == Decimal("1.20")
+
+    def test_refresh_keeps_old_rate_on_failure(self):
+        fetch_rate = Mock(side_effect=[Decimal("1.10"), CurrencyServiceUnavailableException("down")])
+        cache = ExchangeRateCache(fetch_rate, ttl_seconds=60)
+        cache.get_rate("USD")
+
+        cache.refresh()
+
+        assert cache.get_rate("USD") == Decimal("1.10")
+        assert fetch_rate.call_count == 2
+
+
+class TestCurrencyConverterClientWithCache:
+    """Tests for local conversions on top of the cached rate table"""
+
+    @pytest.fixture
+    def converter(self):
+        # Build the client without contacting Auth0 or downloading the WSDL
+        provider = SoapRateProvider.__new__(SoapRateProvider)
+        provider.client = MagicMock()
+        rates = {"USD": 110_000_000, "JPY": 16_000_000_000}
+        provider.client.service.convert.side_effect = lambda from_curr, to_curr, amount: rates[to_curr]
+        converter = CurrencyConverterClient.__new__(CurrencyConverterClient)
+        converter.rate_provider = provider
+        converter.rate_cache = ExchangeRateCache(provider.fetch_rate, ttl_seconds=60)
+        return converter
+
+    def test_convert_uses_cached_rates(self, converter):
+        assert converter.convert("USD", "EUR", Decimal("110.00")) == Decimal("100.00")
+        assert converter.convert("USD", "JPY", Decimal("11.00")) == Decimal("1600.00")
+
+        # One call per currency, none for EUR
+        assert converter.rate_provider.client.service.convert.call_count == 2
+
+    def test_convert_many_keeps_order(self, converter):
+        amounts = [Decimal("11.00"), Decimal("0.55"), Decimal("110.00")]
+
+        assert converter.convert_many("USD", "JPY", amounts) == [
+            Decimal("1600.00"), Decimal("80.00"), Decimal("16000.00")
+        ]
+        assert converter.convert_many("USD", "JPY", amounts) == [
+            converter.convert("USD", "JPY", amount) for amount in amounts
+        ]
+        assert converter.rate_provider.client.service.convert.call_count == 2
+
+    def test_get_currency_rate_uses_cached_rates(self, converter):
+        assert converter.get_currency_rate("USD", "EUR") == Decimal("0.90")
+        assert converter.get_currency_rate("EUR", "USD") == Decimal("1.10")
+
+        converter.rate_provider.client.service.convert.assert_called_once_with("EUR", "USD", 100_000_000)
+
+    def test_fetch_error_raises_currency_service_unavailable(self, converter):
+        converter.rate_provider.client.service.convert.side_effect = Exception("connection refused")
+
+        with pytest.raises(CurrencyServiceUnavailableException):
+            converter.convert("USD", "GBP", Decimal("10.00"))
+
+
+class TestJwtTokenManager:
+    """Tests for the Auth0 token lifecycle of the currency client"""
+
+    @patch('currency_converter.client.get_jwt_token_with_expiry')
+    def test_refresh_swaps_session_header(self, mock_get_token):
+        mock_get_token.side_effect = [("token-1", 3600), ("token-2", 3600)]
+        session = requests.Session()
+
+        token_manager = JwtTokenManager()
+        token_manager.attach(session)
+        assert session.headers["Authorization"] == "Bearer token-1"
+
+        token_manager.refresh()
+
+        assert token_manager.token == "token-2"
+        assert session.headers["Authorization"] == "Bearer token-2"
+
+    @patch('currency_converter.client.get_jwt_token_with_expiry')
+    def test_refresh_is_scheduled_before_expiry(self, mock_get_token):
+        mock_get_token.return_value = ("token", 3600)
+
+        token_manager = JwtTokenManager(refresh_margin_seconds=300)
+
+        assert 3290 < token_manager._seconds_until_refresh() <= 3300
+
+    @patch('currency_converter.client.get_jwt_token_with_expiry')
+    def test_background_refresh_renews_expiring_token(self, mock_get_token):
+        mock_get_token.side_effect = [("token-1", 1), ("token-2", 3600)]
+        session = requests.Session()
+
+        token_manager = JwtTokenManager(refresh_margin_seconds=1)
+        token_manager.attach(session)
+        token_manager.start_background_refresh()
+        try:
+            deadline = time.monotonic() + 2
+            while token_manager.token != "token-2" and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            token_manager.stop_background_refresh()
+
+        assert session.headers["Authorization"] == "Bearer token-2"
+
+
+class TestCrossRateMatrix:
+    """Tests for the vectorized conversions on the precomputed cross rates"""
+
+    RATES = {"EUR": Decimal(1), "USD": Decimal("1.1"), "JPY": Decimal("160"), "GBP": Decimal("0.85")}
+
+    def test_matches_converter_service_truncation(self):
+        matrix = CrossRateMatrix(self.RATES)
+
+        assert matrix.convert("USD", "EUR", Decimal("110.00")) == Decimal("100.00")
+        assert matrix.convert_many("USD", "GBP", [Decimal("110.00"), Decimal("22.00"), Decimal("0.01")]) == [
+            Decimal("85.00"), Decimal("17.00"), Decimal("0.00")
+        ]
+        assert matrix.convert("EUR", "USD", Decimal("1")) == Decimal("1.10")
+
+    def test_missing_rate_raises(self):
+        matrix = CrossRateMatrix(self.RATES)
+
+        with pytest.raises(KeyError):
+            matrix.convert("USD", "CHF", Decimal("10.00"))
+
+    def test_cache_rebuilds_matrix_only_after_rate_change(self):
+        cache = ExchangeRateCache(ttl_seconds=60)
+        cache.set_rate("USD", Decimal("1.1"))
+        matrix = cache.get_matrix()
+
+        cache.set_rate("USD", Decimal("1.1"))
+        assert cache.get_matrix() is matrix
+
+        cache.set_rate("USD", Decimal("1.2"))
+        assert cache.get_matrix() is not matrix
+        assert cache.get_matrix().convert("EUR", "USD", Decimal("10.00")) == Decimal("12.00")
+
+
+class TestAsyncCurrencyConverterClient:
+    """Tests for the async client used by the route handlers"""
+
+    @pytest.fixture
+    def async_converter(self):
+        provider = AsyncSoapRateProvider.__new__(AsyncSoapRateProvider)
+        provider.client = MagicMock()
+        rates = {"USD": 110_000_000, "GBP": 85_000_000}
+        provider.client.service.convert = AsyncMock(side_effect=lambda from_curr, to_curr, amount: rates[to_curr])
+        converter = AsyncCurrencyConverterClient.__new__(AsyncCurrencyConverterClient)
+        converter.rate_provider = provider
+        converter.rate_cache = ExchangeRateCache(ttl_seconds=60, max_staleness_seconds=3600)
+        converter._refresh_tasks = {}
+        return converter
+
+    @pytest.mark.asyncio
+    async def test_convert_many_fetches_missing_rates_once(self, async_converter):
+        converted = await async_converter.convert_many("USD", "GBP", [Decimal("110.00"), Decimal("22.00")])
+        rate = await async_converter.get_currency_rate("USD", "GBP")
+
+        assert converted == [Decimal("85.00"), Decimal("17.00")]
+        assert rate == Decimal("0.77")
+        assert async_converter.rate_provider.client.service.convert.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_fetch_error_raises_currency_service_unavailable(self, async_converter):
+        async_converter.rate_provider.client.service.convert.side_effect = Exception("timeout")
+
+        with pytest.raises(CurrencyServiceUnavailableException):
+            await async_converter.convert("USD", "EUR", Decimal("10.00"))
+
+    @pytest.mark.asyncio
+    async def test_expired_rate_is_served_while_refreshing(self, async_converter):
+        convert = async_converter.rate_provider.client.service.convert
+        await async_converter.convert("USD", "EUR", Decimal("10.00"))
+        async_converter.rate_cache.ttl_seconds = 0
+        convert.side_effect = Exception("timeout")
+
+        # Both lookups see the expired rate, only one background refresh is started
+        assert await async_converter.convert("EUR", "USD", Decimal("100.00")) == Decimal("110.00")
+        assert await async_converter.convert("EUR", "USD", Decimal("100.00")) == Decimal("110.00")
+        await asyncio.gather(*async_converter._refresh_tasks.values())
+
+        assert convert.await_count == 2
+        assert async_converter.get_rate_age("USD", "EUR") > 0
+
+    @pytest.mark.asyncio
+    async def test_rate_older_than_max_staleness_is_fetched(self, async_converter):
+        await async_converter.convert("USD", "EUR", Decimal("10.00"))
+        async_converter.rate_cache.ttl_seconds = 0
+        async_converter.rate_cache.max_staleness_seconds = 0
+        async_converter.rate_provider.client.service.convert.side_effect = Exception("timeout")
+
+        with pytest.raises(CurrencyServiceUnavailableException):
+            await async_converter.convert("USD", "EUR", Decimal("10.00"))
+
+    @pytest.mark.asyncio
+    @patch('currency_converter.async_client.AsyncCurrencyConverterClient')
+    async def test_concurrent_first_calls_build_one_client(self, mock_client_class, monkeypatch):
+        monkeypatch.setattr(async_client, "_async_currency_converter_client_instance", None)
+        # A lock of this test's event loop, the module's lock is left unbound
+        monkeypatch.setattr(async_client, "_async_currency_converter_client_lock", asyncio.Lock())
+        mock_client_class.side_effect = lambda: time.sleep(0.05) or Mock()
+
+        clients = await asyncio.gather(*(get_async_currency_converter_client_instance() for _ in range(5)))
+
+        assert mock_client_class.call_count == 1
+        assert all(client is clients[0] for client in clients)
+
+    @pytest.mark.asyncio
+    async def test_refetch_ignores_cached_rates(self, async_converter):
+        convert = async_converter.rate_provider.client.service.convert
+        await async_converter.convert("USD", "GBP", Decimal("10.00"))
+
+        rates = await async_converter.get_exchange_rates("USD", ["USD", "GBP"], refetch=True)
+
+        assert rates["GBP"].quantize(Decimal("0.0001")) == Decimal("0.7727")
+        assert convert.await_count == 4
+
+        # An expired rate is not served in place of a failed fetch
+        async_converter.rate_cache.ttl_seconds = 0
+        convert.side_effect = Exception("timeout")
+        with pytest.raises(CurrencyServiceUnavailableException):
+            await async_converter.get_exchange_rates("USD", ["GBP"], refetch=True)
+
+
+ECB_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01" xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref">
+    <gesmes:subject>Reference rates</gesmes:subject>
+    <Cube>
+        <Cube time="2025-05-16">
+            <Cube currency="USD" rate="1.1000"/>
+            <Cube currency="JPY" rate="160.00"/>
+        </Cube>
+        <Cube time="2025-05-15">
+            <Cube currency="USD" rate="1.2000"/>
+        </Cube>
+    </Cube>
+</gesmes:Envelope>
+"""
+
+
+class TestEcbXmlRateProvider:
+    """Tests for the in-process provider reading the ECB reference rates"""
+
+    def test_parse_uses_newest_day(self):
+        assert parse_ecb_rates(ECB_XML) == {"EUR": Decimal(1), "USD": Decimal("1.1000"), "JPY": Decimal("160.00")}
+
+    def test_converts_without_currency_service(self, tmp_path):
+        rates_file = tmp_path / "eurofxref.xml"
+        rates_file.write_bytes(ECB_XML)
+        converter = CurrencyConverterClient.__new__(CurrencyConverterClient)
+        converter.rate_provider = EcbXmlRateProvider(str(rates_file))
+        converter.rate_cache = ExchangeRateCache(converter.rate_provider.fetch_rate, ttl_seconds=60)
+
+        assert converter.convert("USD", "JPY", Decimal("11.00")) == Decimal("1600.00")
+        assert sorted(converter.get_available_currencies()) == ["EUR", "JPY", "USD"]
+
+    def test_keeps_rates_when_reload_fails(self, tmp_path):
+        rates_file = tmp_path / "eurofxref.xml"
+        rates_file.write_bytes(ECB_XML)
+        provider = EcbXmlRateProvider(str(rates_file), reload_interval_seconds=0)
+        assert provider.fetch_rate("USD") == Decimal("1.1000")
+
+        rates_file.write_bytes(b"not xml")
+
+        assert provider.fetch_rate("USD") == Decimal("1.1000")
+        with pytest.raises(CurrencyServiceUnavailableException):
+            provider.fetch_rate("GBP")
+
+    def test_missing_source_raises_currency_service_unavailable(self, tmp_path):
+        provider = EcbXmlRateProvider(str(tmp_path / "missing.xml"))
+
+        with pytest.raises(CurrencyServiceUnavailableException):
+            provider.fetch_rate("USD")
+
+
+class TestSharedRateTable:
+    """Tests for the memory-mapped rate table shared by the workers"""
+
+    @pytest.fixture
+    def tables(self, tmp_path):
+        path = str(tmp_path / "rates.bin")
+        writer = SharedRateTable(path)
+        assert writer.try_become_writer()
+        return writer, SharedRateTable(path)
+
+    def test_reader_sees_rates_of_writer(self, tables):
+        writer, reader = tables
+        assert not reader.try_become_writer()
+
+        writer.write_rates({"USD": Decimal("1.1"), "GBP": Decimal("0.85")})
+
+        assert reader.get_rate("USD", max_age_seconds=60) == Decimal("1.1")
+        assert reader.get_rate("GBP", max_age_seconds=60) == Decimal("0.85")
+        assert reader.get_rate("JPY", max_age_seconds=60) is None
+        assert reader.get_rate("USD", max_age_seconds=0) is None
+
+    def test_reader_skips_table_while_it_is_written(self, tables):
+        writer, reader = tables
+        writer.write_rates({"USD": Decimal("1.1")})
+
+        # Odd sequence number, the writer is in the middle of an update
+        writer._header[1] += 1
+
+        assert reader.get_rate("USD", max_age_seconds=60) is None
+
+    def test_provider_falls_back_for_missing_rates(self, tables):
+        writer, reader = tables
+        writer.write_rates({"USD": Decimal("1.1")})
+        fallback = Mock()
+        fallback.fetch_rate.return_value = Decimal("160")
+        create_fallback = Mock(return_value=fallback)
+        provider = SharedRateProvider(reader, create_fallback, max_age_seconds=60)
+
+        assert provider.fetch_rate("USD") == Decimal("1.1")
+        create_fallback.assert_not_called()
+
+        assert provider.fetch_rate("JPY") == Decimal("160")
+        assert provider.fetch_rate("JPY") == Decimal("160")
+        create_fallback.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_async_provider_falls_back_to_async_provider(self, tables):
+        writer, reader = tables
+        writer.write_rates({"USD": Decimal("1.1")})
+        fallback = Mock(spec=AsyncSoapRateProvider)
+        fallback.fetch_rate_async = AsyncMock(return_value=Decimal("160"))
+        provider = AsyncSharedRateProvider(reader, Mock(return_value=fallback), max_age_seconds=60)
+
+        assert await provider.fetch_rate_async("USD") == Decimal("1.1")
+        assert await provider.fetch_rate_async("JPY") == Decimal("160")
+        # The async client's providers don't offer sync fetches
+        assert not isinstance(provider, RateProvider)
+        assert not hasattr(fallback, "fetch_rate")
+
+
+class TestCurrencyMetrics:
+    """Tests for the instrumentation of the currency layer"""
+
+    @staticmethod
+    def sample(name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_conversions_record_latency_and_cache_usage(self):
+        converter = CurrencyConverterClient.__new__(CurrencyConverterClient)
+        converter.rate_cache = ExchangeRateCache(Mock(return_value=Decimal("1.1")), ttl_seconds=60)
+        convert_count = self.sample("currency_converter_operation_seconds_count", operation="convert")
+        hits = self.sample("currency_rate_cache_lookups_total", result="hit")
+        misses = self.sample("currency_rate_cache_lookups_total", result="miss")
+
+        converter.convert("USD", "EUR", Decimal("11.00"))
+        converter.convert("USD", "EUR", Decimal("11.00"))
+
+        assert self.sample("currency_converter_operation_seconds_count", operation="convert") == convert_count + 2
+        assert self.sample("currency_rate_cache_lookups_total", result="miss") == misses + 1
+        assert self.sample("currency_rate_cache_lookups_total", result="hit") == hits + 1
+        assert self.sample("currency_rate_fetched_timestamp_seconds", currency="USD") > 0
+
+    def test_errors_are_counted_by_exception_type(self):
+        converter = CurrencyConverterClient.__new__(CurrencyConverterClient)
+        converter.rate_cache = ExchangeRateCache(Mock(side_effect=CurrencyServiceUnavailableException("down")))
+        labels = {"operation": "convert", "exception": "CurrencyServiceUnavailableException"}
+        errors = self.sample("currency_converter_operation_errors_total", **labels)
+
+        with pytest.raises(CurrencyServiceUnavailableException):
+            converter.convert("USD", "GBP", Decimal("10.00"))
+
+        assert self.sample("currency_converter_operation_errors_total", **labels) == errors + 1
+
+    @patch('currency_converter.client.get_jwt_token_with_expiry')
+    def test_token_refreshes_are_counted(self, mock_get_token):
+        mock_get_token.side_effect = [("token-1", 3600), CurrencyServiceUnavailableException("down")]
+        token_manager = JwtTokenManager()
+        failures = self.sample("currency_converter_token_refreshes_total", result="failure")
+
+        with pytest.raises(CurrencyServiceUnavailableException):
+            token_manager.refresh()
+
+        assert self.sample("currency_converter_token_refreshes_total", result="failure") == failures + 1
+
+    def test_metrics_endpoint(self):
+        response = TestClient(app).get("/metrics")
+
+        assert response.status_code == 200
+        assert "currency_converter_operation_seconds" in response.text
+
+
+class TestCircuitBreaker:
+    """Tests for failing fast while the currency converter is down"""
+
+    def test_opens_after_failure_threshold(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, cooldown_seconds=60)
+        failing_call = Mock(side_effect=Exception("connection refused"))
+
+        for _ in range(2):
+            with pytest.raises(Exception, match="connection refused"):
+                breaker.call(failing_call)
+
+        assert breaker.state == CircuitState.OPEN
+        with pytest.raises(CurrencyServiceUnavailableException):
+            breaker.call(failing_call)
+        # The open circuit does not call the upstream at all
+        assert failing_call.call_count == 2
+
+    def test_half_open_trial_call_closes_circuit(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, cooldown_seconds=0)
+        with pytest.raises(Exception):
+            breaker.call(Mock(side_effect=Exception("timeout")))
+
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert breaker.call(Mock(return_value="ok")) == "ok"
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.get_status()["failure_count"] == 0
+
+    def test_failed_trial_call_reopens_circuit(self):
+        breaker = CircuitBreaker("test", failure_threshold=3, cooldown_seconds=60)
+        for _ in range(3):
+            breaker.record_failure(Exception("timeout"))
+        breaker._opened_at -= 60
+
+        assert breaker.state == CircuitState.HALF_OPEN
+        with pytest.raises(Exception):
+            breaker.call(Mock(side_effect=Exception("still down")))
+
+        assert breaker.state == CircuitState.OPEN
+        assert breaker.get_status()["last_error"] == "still down"
+
+    @pytest.mark.asyncio
+    async def test_cancelled_trial_call_frees_trial(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, cooldown_seconds=0)
+        breaker.record_failure(Exception("timeout"))
+        trial_started = asyncio.Event()
+
+        async def hanging_call():
+            trial_started.set()
+            await asyncio.sleep(60)
+
+        trial = asyncio.create_task(breaker.call_async(hanging_call))
+        await trial_started.wait()
+        # Only one trial call at a time
+        with pytest.raises(CurrencyServiceUnavailableException):
+            await breaker.call_async(AsyncMock(return_value="ok"))
+
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert await breaker.call_async(AsyncMock(return_value="ok")) == "ok"
+        assert breaker.state == CircuitState.CLOSED
+
+    @patch('currency_converter.client.CurrencyConverterClient')
+    def test_client_construction_fails_fast_while_open(self, mock_client_class):
+        mock_client_class.side_effect = CurrencyServiceUnavailableException("Error getting JWT token")
+        for _ in range(currency_converter_circuit_breaker.failure_threshold):
+            with pytest.raises(CurrencyServiceUnavailableException):
+                get_currency_converter_client_instance()
+
+        with pytest.raises(CurrencyServiceUnavailableException, match="circuit is open"):
+            get_currency_converter_client_instance()
+
+        assert mock_client_class.call_count == currency_converter_circuit_breaker.failure_threshold
+
+
+class TestStartupPreload:
+    """Tests for building the currency client before the worker takes traffic"""
+
+    @patch('main.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    def test_client_is_built_on_startup(self, mock_get_client, monkeypatch):
+        monkeypatch.setenv("CURRENCY_CONVERTER_PRELOAD", "True")
+
+        with TestClient(app):
+            mock_get_client.assert_awaited_once()
+
+    @patch('main.get_async_currency_converter_client_instance', new_callable=AsyncMock)
+    def test_startup_survives_unavailable_converter(self, mock_get_client, monkeypatch):
+        monkeypatch.setenv("CURRENCY_CONVERTER_PRELOAD", "True")
+        mock_get_client.side_effect = CurrencyServiceUnavailableException("connection refused")
+
+        with TestClient(app) as client:
+            assert client.get("/health").status_code == 200
+
+    def test_wsdl_cache_is_persistent(self, tmp_path, monkeypatch):
+        cache_path = tmp_path / "wsdl-cache.db"
+        monkeypatch.setattr('currency_converter.client.CURRENCY_CONVERTER_WSDL_CACHE_PATH', str(cache_path))
+
+        get_wsdl_cache().add("http://converter/ws/currencies.wsdl", b"<definitions/>")
+
+        # A new cache on the same file, as in a restarted or second worker
+        cache = get_wsdl_cache()
+        assert isinstance(cache, SqliteCache)
+        assert cache.get("http://converter/ws/currencies.wsdl") == b"<definitions/>"
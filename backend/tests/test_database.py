@@ -2,7 +2,8 @@ import os
 from datetime import date, time
 from decimal import Decimal
 
-from sqlalchemy import create_engine, select, text
+import pytest
+from sqlalchemy import create_engine, select, text, update
 from sqlalchemy.orm import sessionmaker
 
 from db_seed import init_db, seed_data
@@ -41,4 +42,105 @@ def test_seed_and_query(test_db, test_data):
     # Verify bookings were inserted
     stmt = select(Booking)
     bookings = test_db.scalars(stmt).all()
-    assert len(bookings) >= 2  # At least 2 bookings should be inserted
\ No newline at end of file
+    assert len(bookings) >= 2  # At least 2 bookings should be inserted
+
+def test_pool_metrics(postgres_container):
+    """Test that the pool reports its connections and checkout waits"""
+    from prometheus_client import REGISTRY
+    from database import TimedQueuePool, register_pool_metrics
+    
+    test_engine = create_engine(
+        postgres_container, poolclass=TimedQueuePool, pool_size=1, max_overflow=1, pool_logging_name="test"
+    )
+    register_pool_metrics(test_engine.pool)
+    
+    def connections(state):
+        return REGISTRY.get_sample_value("db_pool_connections", {"pool": "test", "state": state})
+    
+    waits_before = REGISTRY.get_sample_value("db_pool_checkout_wait_seconds_count", {"pool": "test"}) or 0
+    with test_engine.connect(), test_engine.connect():
+        assert connections("checked_out") == 2
+        assert connections("overflow") == 1
+    
+    assert connections("checked_out") == 0
+    assert connections("idle") == 1
+    assert REGISTRY.get_sample_value("db_pool_checkout_wait_seconds_count", {"pool": "test"}) == waits_before + 2
+    test_engine.dispose()
+
+
+def test_statement_timeout_and_application_name(postgres_container, monkeypatch):
+    """Test that the configured connection settings reach the server"""
+    import database
+    
+    monkeypatch.setattr(database, "DB_STATEMENT_TIMEOUT_MS", 1500)
+    options = database.engine_options("test")
+    test_engine = create_engine(postgres_container, connect_args=options["connect_args"])
+    
+    with test_engine.connect() as connection:
+        assert connection.execute(text("SHOW statement_timeout")).scalar() == "1500ms"
+        assert connection.execute(text("SHOW application_name")).scalar() == database.DB_APPLICATION_NAME
+    test_engine.dispose()
+
+
+def test_read_your_writes_window():
+    """Test that writers are remembered for the read-your-writes window only"""
+    from database import ReadYourWritesTracker
+    
+    tracker = ReadYourWritesTracker(window_seconds=60)
+    tracker.record("writer")
+    assert tracker.wrote_recently("writer")
+    assert not tracker.wrote_recently("reader")
+    
+    expired = ReadYourWritesTracker(window_seconds=0)
+    expired.record("writer")
+    assert not expired.wrote_recently("writer")
+
+
+def test_read_sessions_of_recent_writers_use_primary(monkeypatch):
+    """Test that reads go to the replica unless the user just wrote to the primary"""
+    import database
+    
+    replica_sessions = object()
+    monkeypatch.setattr(database, "AsyncReadSessionLocal", replica_sessions)
+    database.read_your_writes.record("writer")
+    
+    assert database.read_session_factory("writer") is database.AsyncSessionLocal
+    assert database.read_session_factory("reader") is replica_sessions
+    assert database.read_session_factory(None) is replica_sessions
+
+
+@pytest.mark.asyncio
+async def test_read_db_on_primary_shares_request_session(monkeypatch):
+    """Test that read routes reuse the primary session of get_current_user unless they read from the replica"""
+    import database
+    from services.auth_service import get_async_read_db
+    
+    primary_db = object()
+    read_db = get_async_read_db(credentials=None, primary_db=primary_db)
+    assert await anext(read_db) is primary_db
+    
+    class ReplicaSession:
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, *exc_info):
+            return False
+    
+    monkeypatch.setattr(database, "AsyncReadSessionLocal", ReplicaSession)
+    read_db = get_async_read_db(credentials=None, primary_db=primary_db)
+    assert isinstance(await anext(read_db), ReplicaSession)
+
+
+@pytest.mark.asyncio
+async def test_committed_writes_are_tracked(test_data, async_test_db):
+    """Test that only sessions which committed a write start the read-your-writes window"""
+    from database import read_your_writes, track_writes
+    
+    track_writes(async_test_db, "cognito2")
+    await async_test_db.scalar(select(User).where(User.cognito_id == "cognito2"))
+    await async_test_db.commit()
+    assert not read_your_writes.wrote_recently("cognito2")
+    
+    track_writes(async_test_db, "cognito1")
+    await async_test_db.execute(update(User).where(User.cognito_id == "cognito1").values(first_name="Changed"))
+    await async_test_db.commit()
+    assert read_your_writes.wrote_recently("cognito1")
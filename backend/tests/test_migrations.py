@@ -0,0 +1,102 @@
+import os
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import Boolean, Column, Date, Enum, Float, ForeignKey, Integer, MetaData, Numeric, String, Table, Time, inspect, text
+
+from models.currencies import Currency
+from models.db_models import BOOKING_OVERLAP_CONSTRAINT, Base, Booking, BookingStatus, UserRole
+
+ALEMBIC_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+# Tables as db_seed.py created them before the first migration, kept as they were then
+pre_migration_metadata = MetaData()
+Table(
+    "users", pre_migration_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("first_name", String(50)),
+    Column("last_name", String(50)),
+    Column("email", String(150), unique=True, index=True),
+    Column("phone_number", String(20), unique=True),
+    Column("cognito_id", String(255), unique=True, nullable=False),
+    Column("role", Enum(UserRole), nullable=False)
+)
+Table(
+    "cars", pre_migration_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String(50)),
+    Column("model", String(50)),
+    Column("price_per_day", Numeric(10, 2)),
+    Column("is_available", Boolean),
+    Column("latitude", Float, nullable=True),
+    Column("longitude", Float, nullable=True)
+)
+Table(
+    "bookings", pre_migration_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("car_id", Integer, ForeignKey("cars.id")),
+    Column("start_date", Date),
+    Column("end_date", Date),
+    Column("pickup_date", Date, nullable=True),
+    Column("return_date", Date, nullable=True),
+    Column("planned_pickup_time", Time(timezone=False), nullable=False),
+    Column("total_cost", Numeric(10, 2)),
+    Column("currency_code", Enum(Currency), nullable=False),
+    Column("exchange_rate", Numeric(10, 2), nullable=False),
+    Column("status", Enum(BookingStatus))
+)
+
+
+def run_alembic(connection, operation, revision):
+    config = Config(ALEMBIC_CONFIG)
+    config.attributes["connection"] = connection
+    operation(config, revision)
+
+
+def test_migrations_bring_pre_migration_schema_up_to_date(test_db):
+    """Test that a database created before the migrations ends up with the schema of the models"""
+    engine = test_db.get_bind()
+    test_db.close()
+
+    with engine.begin() as connection:
+        Base.metadata.drop_all(connection)
+        pre_migration_metadata.create_all(connection)
+
+    with engine.connect() as connection:
+        run_alembic(connection, command.upgrade, "head")
+
+        assert compare_metadata(MigrationContext.configure(connection), Base.metadata) == []
+        connection.commit()
+
+        run_alembic(connection, command.downgrade, "base")
+
+        assert compare_metadata(MigrationContext.configure(connection), pre_migration_metadata) == []
+        connection.commit()
+
+
+def test_migrations_complete_schema_created_without_indexes(test_db):
+    """Test that a database db_seed.py created from newer models, before the migrations, is completed"""
+    engine = test_db.get_bind()
+    added_indexes = [index.name for index in Booking.__table__.indexes if index.name != "ix_bookings_id"]
+
+    # The tables of the models exist already, only the indexes of the migrations are missing
+    with engine.begin() as connection:
+        for name in added_indexes:
+            connection.execute(text(f"DROP INDEX {name}"))
+        connection.execute(text(f"ALTER TABLE bookings DROP CONSTRAINT {BOOKING_OVERLAP_CONSTRAINT}"))
+
+    with engine.connect() as connection:
+        run_alembic(connection, command.upgrade, "head")
+
+        assert compare_metadata(MigrationContext.configure(connection), Base.metadata) == []
+        connection.commit()
+
+        run_alembic(connection, command.downgrade, "0000")
+
+        booking_indexes = {index["name"] for index in inspect(connection).get_indexes("bookings")}
+        assert not booking_indexes & set(added_indexes)
+        assert BOOKING_OVERLAP_CONSTRAINT not in booking_indexes
+        connection.commit()